@@ -11,6 +11,15 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from utils.auth import auth_manager
 from utils.notifications import notification_manager
+from utils.performance import iniciar_rerun, etapa, medir_rerun
+from utils.metrics_exporter import metrics_exporter
+from utils.aquecimento import aquecimento
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
+
+# Dados, índices e bibliotecas aquecidos em segundo plano enquanto o login é servido
+aquecimento.iniciar()
 
 # Configuração da página
 st.set_page_config(
@@ -20,6 +29,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Medição do rerun por etapas
+iniciar_rerun("app")
+
 # CSS customizado
 st.markdown("""
 <style>
@@ -63,6 +75,7 @@ st.markdown("""
 
 def show_login_page():
     """Exibe a página de login"""
+    etapa("login")
     st.markdown("""
     <div class="main-header">
         <h1>🏥 VISA - Diário Digital</h1>
@@ -131,7 +144,13 @@ def show_main_app():
         if st.button("🚪 Logout", use_container_width=True):
             auth_manager.logout()
     
+    # Estatísticas e notificações calculadas uma vez por usuário, dia e versão dos dados
+    etapa("dados")
+    from utils.resumos import resumos_dashboard
+    resumo = resumos_dashboard.obter(user['id'], user['perfil'])
+    
     # Sidebar com notificações
+    etapa("notificações")
     with st.sidebar:
         st.markdown(f"### 👤 {user['nome']}")
         st.markdown(f"**Perfil:** {user['perfil'].title()}")
@@ -141,17 +160,16 @@ def show_main_app():
         st.markdown("---")
         
         # Exibir notificações
-        notification_manager.show_notifications_sidebar(user['id'], user['perfil'])
+        notification_manager.show_notifications_sidebar(user['id'], user['perfil'], resumo['notificacoes'])
     
     # Conteúdo principal - Dashboard básico
     st.markdown("### 🏠 Dashboard")
     
     # Exibir alertas
-    notification_manager.show_dashboard_alerts(user['id'], user['perfil'])
+    notification_manager.show_dashboard_alerts(user['id'], user['perfil'], resumo['notificacoes'])
     
     # Estatísticas básicas
-    from utils.data_manager import data_manager
-    stats = data_manager.get_estatisticas(user['id'], user['perfil'])
+    stats = resumo['estatisticas']
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -184,11 +202,13 @@ def show_main_app():
 def main():
     """Função principal da aplicação"""
     # Verificar se o usuário está autenticado
+    etapa("autenticação")
     if not auth_manager.is_authenticated():
         show_login_page()
     else:
         show_main_app()
 
 if __name__ == "__main__":
-    main()
+    with medir_rerun("app"):
+        main()
 
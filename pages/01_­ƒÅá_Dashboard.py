@@ -15,6 +15,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.auth import auth_manager
 from utils.data_manager import data_manager
 from utils.notifications import notification_manager
+from utils.resumos import resumos_dashboard
+from utils.performance import iniciar_rerun, etapa, medir_rerun
+from utils.metrics_exporter import metrics_exporter
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
 
 # Configuração da página
 st.set_page_config(
@@ -23,7 +29,11 @@ st.set_page_config(
     layout="wide"
 )
 
+# Medição do rerun por etapas
+iniciar_rerun("Dashboard")
+
 # Verificar autenticação
+etapa("autenticação")
 auth_manager.require_auth()
 
 # CSS customizado
@@ -69,7 +79,14 @@ def main():
     **Bem-vindo(a), {user['nome']}!**
     """)
     
+    # Métricas, tendência e notificações calculadas uma vez por usuário, dia e versão dos dados
+    etapa("dados")
+    # Rerun automático quando os dados mudam
+    data_manager.canal.acompanhar_sessao()
+    resumo = resumos_dashboard.obter(user['id'], user['perfil'])
+    
     # Sidebar com informações do usuário
+    etapa("notificações")
     with st.sidebar:
         st.markdown(f"### 👤 {user['nome']}")
         st.markdown(f"**Perfil:** {user['perfil'].title()}")
@@ -77,15 +94,15 @@ def main():
             st.markdown(f"**Território:** {user['territorio']}")
         
         st.markdown("---")
-        notification_manager.show_notifications_sidebar(user['id'], user['perfil'])
+        notification_manager.show_notifications_sidebar(user['id'], user['perfil'], resumo['notificacoes'])
     
     # Alertas principais
-    notification_manager.show_dashboard_alerts(user['id'], user['perfil'])
+    notification_manager.show_dashboard_alerts(user['id'], user['perfil'], resumo['notificacoes'])
     
     st.markdown("---")
     
     # Métricas principais
-    stats = data_manager.get_estatisticas(user['id'], user['perfil'])
+    stats = resumo['estatisticas']
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -128,6 +145,7 @@ def main():
     st.markdown("---")
     
     # Gráficos e análises
+    etapa("gráficos")
     col1, col2 = st.columns(2)
     
     with col1:
@@ -159,15 +177,10 @@ def main():
     with col2:
         st.markdown("### 📈 Tendência Mensal")
         
-        # Carregar dados para gráfico de tendência
-        df = data_manager.get_inspecoes_by_user(user['id'], user['perfil'])
+        # Inspeções por mês (do resumo)
+        monthly_counts = resumo['mensal']
         
-        if len(df) > 0:
-            # Agrupar por mês
-            df['mes'] = pd.to_datetime(df['data_inspecao']).dt.to_period('M')
-            monthly_counts = df.groupby('mes').size().reset_index(name='count')
-            monthly_counts['mes_str'] = monthly_counts['mes'].astype(str)
-            
+        if len(monthly_counts) > 0:
             fig = px.line(
                 monthly_counts, 
                 x='mes_str', 
@@ -188,16 +201,18 @@ def main():
             st.info("Dados insuficientes para gráfico de tendência.")
     
     # Últimas inspeções
+    etapa("tabelas")
     st.markdown("### 📋 Últimas Inspeções")
     
-    df = data_manager.get_inspecoes_by_user(user['id'], user['perfil'])
+    # Inspetores veem só a própria atividade; coordenação e gerência, a de todos
+    if user['perfil'] == 'inspetor':
+        df_recent = data_manager.get_atividade_recente(5, inspetor_id=user['id'])
+    else:
+        df_recent = data_manager.get_atividade_recente(5)
     
-    if len(df) > 0:
-        # Ordenar por data de criação (mais recentes primeiro)
-        df_recent = df.sort_values('data_criacao', ascending=False).head(5)
-        
+    if len(df_recent) > 0:
         # Preparar dados para exibição
-        display_df = df_recent[['estabelecimento', 'data_inspecao', 'classificacao_risco', 'status']].copy()
+        display_df = df_recent[['estabelecimento', 'data_inspecao', 'classificacao_risco', 'status']]
         display_df['data_inspecao'] = pd.to_datetime(display_df['data_inspecao']).dt.strftime('%d/%m/%Y')
         
         # Adicionar ícones de status
@@ -209,6 +224,13 @@ def main():
         
         display_df['Status'] = display_df['status'].map(lambda x: f"{status_icons.get(x, '❓')} {x.title()}")
         
+        # Cadastro ou mudança de status, e quando
+        display_df['Atividade'] = [
+            "Cadastrada" if tipo == 'cadastro' else f"{str(anterior).title()} → {str(status).title()}"
+            for tipo, anterior, status in zip(df_recent['tipo'], df_recent['status_anterior'], df_recent['status'])
+        ]
+        display_df['Quando'] = df_recent['em'].dt.strftime('%d/%m/%Y %H:%M')
+        
         # Renomear colunas
         display_df = display_df.rename(columns={
             'estabelecimento': 'Estabelecimento',
@@ -218,7 +240,7 @@ def main():
         
         # Exibir tabela
         st.dataframe(
-            display_df[['Estabelecimento', 'Data', 'Risco', 'Status']], 
+            display_df[['Estabelecimento', 'Data', 'Risco', 'Status', 'Atividade', 'Quando']], 
             use_container_width=True,
             hide_index=True
         )
@@ -247,5 +269,6 @@ def main():
                 st.switch_page("pages/05_📊_Indicadores.py")
 
 if __name__ == "__main__":
-    main()
+    with medir_rerun("Dashboard"):
+        main()
 
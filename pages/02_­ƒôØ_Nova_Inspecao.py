@@ -11,7 +11,13 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.auth import auth_manager
 from utils.data_manager import data_manager
+from utils.calendario import calendario, PRAZO_RETORNO_DIAS_UTEIS
 from utils.validators import validators
+from utils.performance import iniciar_rerun, etapa, medir_rerun
+from utils.metrics_exporter import metrics_exporter
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
 
 # Configuração da página
 st.set_page_config(
@@ -20,7 +26,11 @@ st.set_page_config(
     layout="wide"
 )
 
+# Medição do rerun por etapas
+iniciar_rerun("Nova Inspeção")
+
 # Verificar autenticação
+etapa("autenticação")
 auth_manager.require_auth()
 
 def main():
@@ -31,6 +41,7 @@ def main():
     st.markdown("Cadastre uma nova inspeção sanitária")
     
     # Formulário de cadastro
+    etapa("formulário")
     with st.form("nova_inspecao_form", clear_on_submit=True):
         st.markdown("### 🏢 Dados do Estabelecimento")
         
@@ -81,11 +92,14 @@ def main():
             )
         
         with col2:
+            # Em branco: prazo legal em dias úteis contado da data da inspeção,
+            # calculado no envio (o formulário não reage à data escolhida)
             prazo_inspetor = st.date_input(
                 "Prazo de Retorno",
                 value=None,
                 min_value=datetime.now().date(),
-                help="Prazo definido pelo inspetor para retorno/regularização"
+                help=f"Prazo definido pelo inspetor para retorno/regularização. Em branco: "
+                     f"{PRAZO_RETORNO_DIAS_UTEIS} dias úteis a partir da data da inspeção"
             )
         
         st.markdown("### 📝 Observações")
@@ -113,6 +127,8 @@ def main():
     
     # Processar submissão do formulário
     if submitted:
+        etapa("validação e gravação")
+        
         # Validações
         errors = []
         
@@ -140,6 +156,10 @@ def main():
         if not valid:
             errors.append(msg)
         
+        # Prazo em branco: dias úteis a partir da data da inspeção
+        if prazo_inspetor is None and data_inspecao:
+            prazo_inspetor = calendario.somar_dias_uteis(data_inspecao, PRAZO_RETORNO_DIAS_UTEIS)
+        
         # Validar prazo (se informado)
         if prazo_inspetor:
             valid, msg = validators.validate_prazo(
@@ -174,7 +194,8 @@ def main():
             
             # Salvar inspeção
             if data_manager.create_inspecao(inspecao_data, user['id']):
-                st.success("✅ Inspeção cadastrada com sucesso!")
+                st.success(f"✅ Inspeção cadastrada com sucesso! Prazo de retorno: "
+                           f"{prazo_inspetor.strftime('%d/%m/%Y')}")
                 st.balloons()
                 
                 # Opções pós-cadastro
@@ -192,7 +213,7 @@ def main():
     
     # Informações adicionais
     with st.expander("ℹ️ Informações sobre o Cadastro"):
-        st.markdown("""
+        st.markdown(f"""
         **Campos Obrigatórios (*):**
         - Nome do Estabelecimento (mínimo 3 caracteres)
         - CNPJ (14 dígitos)
@@ -204,10 +225,12 @@ def main():
         **Dicas:**
         - A data da inspeção não pode ser futura
         - O prazo de retorno deve ser posterior à data da inspeção
+        - Sem prazo informado, o retorno fica a {PRAZO_RETORNO_DIAS_UTEIS} dias úteis da data da inspeção; prazos que caem em fim de semana ou feriado vencem no dia útil seguinte
         - Use observações detalhadas para facilitar o acompanhamento
         - O CNPJ pode ser digitado com ou sem formatação
         """)
 
 if __name__ == "__main__":
-    main()
+    with medir_rerun("Nova Inspeção"):
+        main()
 
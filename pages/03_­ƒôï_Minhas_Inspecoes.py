@@ -3,7 +3,6 @@ Página para listar e gerenciar inspeções
 """
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
 import sys
 import os
 
@@ -11,8 +10,15 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.auth import auth_manager
-from utils.data_manager import data_manager
+from utils.data_manager import data_manager, ConflitoVersao, DIAS_PROXIMAS
+from utils.calendario import calendario
+from utils.schema import id_to_str
 from utils.validators import validators
+from utils.performance import iniciar_rerun, etapa, medir_rerun
+from utils.metrics_exporter import metrics_exporter
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
 
 # Configuração da página
 st.set_page_config(
@@ -21,40 +27,28 @@ st.set_page_config(
     layout="wide"
 )
 
+# Medição do rerun por etapas
+iniciar_rerun("Minhas Inspeções")
+
 # Verificar autenticação
+etapa("autenticação")
 auth_manager.require_auth()
 
-def format_status_display(status, prazo_inspetor, prazo_coordenacao):
-    """Formata o status para exibição com ícones"""
-    hoje = datetime.now().date()
-    
+def format_status_display(status, dias_uteis):
+    """Formata o status para exibição com ícones
+
+    `dias_uteis`: dias úteis até o vencimento do prazo mais urgente
+    (negativo = vencido, NaN = sem prazo), de calendario.situacao_prazos.
+    """
     if status == 'concluido':
         return "✅ Concluído"
     
     # Verificar se está vencido
-    vencido = False
-    if prazo_inspetor and pd.notna(prazo_inspetor):
-        if prazo_inspetor.date() < hoje:
-            vencido = True
-    
-    if prazo_coordenacao and pd.notna(prazo_coordenacao):
-        if prazo_coordenacao.date() < hoje:
-            vencido = True
-    
-    if vencido:
+    if dias_uteis < 0:
         return "🔴 Vencido"
     
-    # Verificar se está próximo do vencimento (3 dias)
-    proximo = False
-    if prazo_inspetor and pd.notna(prazo_inspetor):
-        if prazo_inspetor.date() <= hoje + timedelta(days=3):
-            proximo = True
-    
-    if prazo_coordenacao and pd.notna(prazo_coordenacao):
-        if prazo_coordenacao.date() <= hoje + timedelta(days=3):
-            proximo = True
-    
-    if proximo:
+    # Verificar se está próximo do vencimento (3 dias úteis)
+    if dias_uteis <= DIAS_PROXIMAS:
         return "🟡 Próximo Vencimento"
     
     return "🟢 Pendente"
@@ -62,6 +56,16 @@ def format_status_display(status, prazo_inspetor, prazo_coordenacao):
 def show_details_modal(inspecao, user):
     """Exibe detalhes da inspeção em modal"""
     st.markdown("### 👁️ Detalhes da Inspeção")
+    tab_detalhes, tab_historico = st.tabs(["📄 Detalhes", "🕓 Histórico"])
+    
+    with tab_detalhes:
+        show_details(inspecao, user)
+    
+    with tab_historico:
+        show_history(inspecao, user)
+
+def show_details(inspecao, user):
+    """Dados atuais da inspeção"""
     st.markdown(f"**Estabelecimento:** {inspecao['estabelecimento']}")
     st.markdown(f"**CNPJ:** {inspecao['cnpj']}")
     st.markdown(f"**Atividade:** {inspecao['atividade_principal']}")
@@ -77,12 +81,176 @@ def show_details_modal(inspecao, user):
     st.markdown(f"**Território:** {inspecao.get('territorio', 'Não informado')}")
     st.markdown(f"**Status:** {inspecao['status'].title()}")
     
+    # Textos longos ficam fora do frame principal
+    textos = data_manager.get_textos(inspecao['id'])
+    
     st.markdown("**Observações:**")
-    st.text_area("", value=inspecao['observacoes'], disabled=True, height=100, key="obs_details")
+    st.text_area("", value=textos['observacoes'], disabled=True, height=100, key="obs_details")
     
-    if user['perfil'] in ['coordenador', 'gerencia'] and inspecao.get('comentarios_internos'):
+    if user['perfil'] in ['coordenador', 'gerencia'] and textos.get('comentarios_internos'):
         st.markdown("**Comentários Internos:**")
-        st.text_area("", value=inspecao['comentarios_internos'], disabled=True, height=80, key="com_details")
+        st.text_area("", value=textos['comentarios_internos'], disabled=True, height=80, key="com_details")
+
+CAMPOS_HISTORICO = {
+    'status': "Status",
+    'prazo_inspetor': "Prazo Inspetor",
+    'prazo_coordenacao': "Prazo Coordenação",
+    'observacoes': "Observações",
+    'comentarios_internos': "Comentários Internos",
+    'classificacao_risco': "Risco",
+    'territorio': "Território"
+}
+
+def _valor_historico(campo, valor):
+    """Formata um valor do histórico para a tabela"""
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return "—"
+    if campo in ('prazo_inspetor', 'prazo_coordenacao', 'data_inspecao'):
+        return pd.Timestamp(valor).strftime('%d/%m/%Y')
+    if campo == 'status':
+        return "Concluído" if valor == 'concluido' else "Pendente"
+    return str(valor)
+
+def show_history(inspecao, user):
+    """Quem alterou o quê e quando (auditoria)"""
+    historico = data_manager.get_historico(inspecao['id'])
+    
+    if user['perfil'] not in ['coordenador', 'gerencia']:
+        # Comentários internos são só da coordenação
+        historico = historico[historico['campo'] != 'comentarios_internos']
+    
+    if len(historico) == 0:
+        st.info("Nenhuma alteração registrada para esta inspeção.")
+        return
+    
+    try:
+        users_df = pd.read_csv("data/usuarios.csv")
+        nomes = dict(zip(users_df['id'], users_df['nome']))
+    except Exception:
+        nomes = {}
+    
+    tabela = pd.DataFrame({
+        'Quando': historico['em'].dt.strftime('%d/%m/%Y %H:%M'),
+        'Quem': [nomes.get(u, f"Usuário {int(u)}") if pd.notna(u) else "—" for u in historico['usuario']],
+        'Versão': historico['versao'],
+        'Campo': [CAMPOS_HISTORICO.get(c, c) if c else "Cadastro" for c in historico['campo']],
+        'Antes': [_valor_historico(c, v) for c, v in zip(historico['campo'], historico['antes'])],
+        'Depois': [_valor_historico(c, v) for c, v in zip(historico['campo'], historico['depois'])]
+    })
+    # Mais recentes primeiro
+    st.dataframe(tabela.iloc[::-1], use_container_width=True, hide_index=True)
+
+def _data_ou_none(valor):
+    """Converte um Timestamp (ou NaT) para date, como esperado pelo date_input"""
+    return valor.date() if pd.notna(valor) else None
+
+def salvar_edicao(inspecao_id, alteracoes, versao, user):
+    """Grava a edição com a versão lida; em conflito, guarda o estado para nova tentativa"""
+    try:
+        if data_manager.update_inspecao(inspecao_id, alteracoes, expected_version=versao,
+                                        user_id=user['id']):
+            st.session_state.pop('edicao', None)
+            st.success("✅ Inspeção atualizada com sucesso!")
+    except ConflitoVersao as e:
+        st.session_state.edicao['conflito'] = {'alteracoes': alteracoes, 'versao_atual': e.atual}
+        st.rerun()
+
+def show_edit_form(inspecao, user):
+    """Formulário de edição com controle de concorrência otimista"""
+    edicao = st.session_state.edicao
+    inspecao_id = edicao['id']
+    pode_coordenar = user['perfil'] in ['coordenador', 'gerencia']
+    
+    st.markdown("### ✏️ Editar Inspeção")
+    
+    # Conflito: outra pessoa gravou esta inspeção depois que o formulário foi aberto
+    conflito = edicao.get('conflito')
+    if conflito:
+        st.warning(
+            f"⚠️ Esta inspeção foi alterada por outra pessoa enquanto você editava "
+            f"(versão {edicao['versao']} → {conflito['versao_atual']}). "
+            "Confira os dados atuais antes de continuar."
+        )
+        st.markdown("**Suas alterações:**")
+        st.json({k: str(v) for k, v in conflito['alteracoes'].items()})
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("🔁 Aplicar minhas alterações sobre a versão atual", use_container_width=True):
+                edicao['versao'] = conflito['versao_atual']
+                edicao.pop('conflito')
+                salvar_edicao(inspecao_id, conflito['alteracoes'], edicao['versao'], user)
+        with col2:
+            if st.button("↩️ Descartar e recarregar", use_container_width=True):
+                st.session_state.pop('edicao', None)
+                st.rerun()
+        return
+    
+    textos = data_manager.get_textos(inspecao['id'])
+    status_opcoes = {"Pendente": 'pendente', "Concluído": 'concluido'}
+    status_atual = "Concluído" if inspecao['status'] == 'concluido' else "Pendente"
+    
+    with st.form("editar_inspecao_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            status = status_opcoes[st.selectbox(
+                "Status",
+                options=list(status_opcoes),
+                index=list(status_opcoes).index(status_atual)
+            )]
+            prazo_inspetor = st.date_input("Prazo de Retorno", value=_data_ou_none(inspecao['prazo_inspetor']))
+        
+        with col2:
+            if pode_coordenar:
+                prazo_coordenacao = st.date_input(
+                    "Prazo da Coordenação", value=_data_ou_none(inspecao['prazo_coordenacao'])
+                )
+            else:
+                prazo_coordenacao = _data_ou_none(inspecao['prazo_coordenacao'])
+        
+        observacoes = st.text_area("Observações", value=textos['observacoes'], height=120)
+        
+        if pode_coordenar:
+            comentarios = st.text_area("Comentários Internos", value=textos['comentarios_internos'], height=80)
+        else:
+            comentarios = textos['comentarios_internos']
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            submitted = st.form_submit_button("💾 Salvar Alterações", use_container_width=True, type="primary")
+        with col2:
+            cancelar = st.form_submit_button("Cancelar", use_container_width=True)
+    
+    if cancelar:
+        st.session_state.pop('edicao', None)
+        st.rerun()
+    
+    if submitted:
+        # Só os campos alterados: numa nova tentativa, nada do que outra pessoa gravou é sobrescrito
+        alteracoes = {}
+        if status != inspecao['status']:
+            alteracoes['status'] = status
+        if prazo_inspetor != _data_ou_none(inspecao['prazo_inspetor']):
+            alteracoes['prazo_inspetor'] = prazo_inspetor
+        if prazo_coordenacao != _data_ou_none(inspecao['prazo_coordenacao']):
+            alteracoes['prazo_coordenacao'] = prazo_coordenacao
+        if observacoes != textos['observacoes']:
+            alteracoes['observacoes'] = observacoes
+        if comentarios != textos['comentarios_internos']:
+            alteracoes['comentarios_internos'] = comentarios
+        
+        if 'observacoes' in alteracoes:
+            valid, msg = validators.validate_observacoes(observacoes)
+            if not valid:
+                st.error(f"❌ {msg}")
+                return
+        
+        if not alteracoes:
+            st.info("Nenhuma alteração para salvar.")
+            return
+        
+        salvar_edicao(inspecao_id, alteracoes, edicao['versao'], user)
 
 def main():
     user = auth_manager.get_current_user()
@@ -94,6 +262,7 @@ def main():
         st.markdown("# 📋 Todas as Inspeções")
     
     # Carregar dados
+    etapa("dados")
     df = data_manager.get_inspecoes_by_user(user['id'], user['perfil'])
     
     if len(df) == 0:
@@ -103,6 +272,7 @@ def main():
         return
     
     # Filtros
+    etapa("filtros")
     st.markdown("### 🔍 Filtros")
     
     col1, col2, col3, col4 = st.columns(4)
@@ -137,8 +307,8 @@ def main():
         else:
             filtro_inspetor = "Todos"
     
-    # Aplicar filtros
-    df_filtrado = df.copy()
+    # Aplicar filtros (cada filtro gera uma nova visão; nada é alterado)
+    df_filtrado = df
     
     # Filtro por texto
     if busca_texto:
@@ -152,38 +322,22 @@ def main():
             df_filtrado['classificacao_risco'].str.title() == filtro_risco
         ]
     
-    # Filtro por status
+    # Filtro por status (prazos em dias úteis)
     if filtro_status != "Todos":
-        hoje = datetime.now().date()
-        
         if filtro_status == "Concluído":
             df_filtrado = df_filtrado[df_filtrado['status'] == 'concluido']
-        elif filtro_status == "Vencido":
-            mask_vencido = (
-                ((df_filtrado['prazo_inspetor'].dt.date < hoje) | 
-                 (df_filtrado['prazo_coordenacao'].dt.date < hoje)) &
-                (df_filtrado['status'] == 'pendente')
-            )
-            df_filtrado = df_filtrado[mask_vencido]
-        elif filtro_status == "Próximo Vencimento":
-            limite = hoje + timedelta(days=3)
-            mask_proximo = (
-                ((df_filtrado['prazo_inspetor'].dt.date <= limite) | 
-                 (df_filtrado['prazo_coordenacao'].dt.date <= limite)) &
-                ((df_filtrado['prazo_inspetor'].dt.date >= hoje) | 
-                 (df_filtrado['prazo_coordenacao'].dt.date >= hoje)) &
-                (df_filtrado['status'] == 'pendente')
-            )
-            df_filtrado = df_filtrado[mask_proximo]
-        elif filtro_status == "Pendente":
-            hoje = datetime.now().date()
-            mask_pendente = (
-                (df_filtrado['status'] == 'pendente') &
-                ((df_filtrado['prazo_inspetor'].dt.date > hoje) | 
-                 (df_filtrado['prazo_coordenacao'].dt.date > hoje) |
-                 (df_filtrado['prazo_inspetor'].isna() & df_filtrado['prazo_coordenacao'].isna()))
-            )
-            df_filtrado = df_filtrado[mask_pendente]
+        else:
+            prazos = calendario.situacao_prazos(df_filtrado)
+            if filtro_status == "Vencido":
+                df_filtrado = df_filtrado[prazos['vencida'].to_numpy()]
+            elif filtro_status == "Próximo Vencimento":
+                df_filtrado = df_filtrado[prazos['proxima'].to_numpy()]
+            elif filtro_status == "Pendente":
+                mask_pendente = (
+                    (df_filtrado['status'] == 'pendente').to_numpy() &
+                    ~prazos['vencida'].to_numpy() & ~prazos['proxima'].to_numpy()
+                )
+                df_filtrado = df_filtrado[mask_pendente]
     
     # Filtro por inspetor
     if filtro_inspetor != "Todos":
@@ -196,26 +350,23 @@ def main():
         st.warning("Nenhuma inspeção encontrada com os filtros aplicados.")
         return
     
-    # Preparar dados para exibição
-    display_df = df_filtrado.copy()
-    
-    # Formatar datas
-    display_df['Data Inspeção'] = pd.to_datetime(display_df['data_inspecao']).dt.strftime('%d/%m/%Y')
-    
-    # Formatar prazos
-    display_df['Prazo Inspetor'] = display_df['prazo_inspetor'].apply(
-        lambda x: x.strftime('%d/%m/%Y') if pd.notna(x) else '-'
-    )
-    
-    display_df['Prazo Coordenação'] = display_df['prazo_coordenacao'].apply(
-        lambda x: x.strftime('%d/%m/%Y') if pd.notna(x) else '-'
-    )
-    
-    # Adicionar status formatado
-    display_df['Status'] = display_df.apply(
-        lambda row: format_status_display(row['status'], row['prazo_inspetor'], row['prazo_coordenacao']),
-        axis=1
-    )
+    etapa("tabelas")
+    
+    # Preparar dados para exibição (novas colunas em uma visão, sem cópia)
+    display_df = df_filtrado.assign(**{
+        # Formatar datas
+        'Data Inspeção': df_filtrado['data_inspecao'].dt.strftime('%d/%m/%Y'),
+        # Formatar prazos
+        'Prazo Inspetor': df_filtrado['prazo_inspetor'].dt.strftime('%d/%m/%Y').fillna('-'),
+        'Prazo Coordenação': df_filtrado['prazo_coordenacao'].dt.strftime('%d/%m/%Y').fillna('-'),
+        # Adicionar status formatado
+        'Status': [
+            format_status_display(status, dias_uteis)
+            for status, dias_uteis in zip(
+                df_filtrado['status'], calendario.situacao_prazos(df_filtrado)['dias_uteis']
+            )
+        ]
+    })
     
     # Selecionar colunas para exibição
     columns_to_show = [
@@ -243,6 +394,7 @@ def main():
     )
     
     # Seleção de registro para ações
+    etapa("ações")
     if len(df_filtrado) > 0:
         st.markdown("### 🔧 Ações")
         
@@ -269,12 +421,20 @@ def main():
                 with col2:
                     if user['perfil'] in ['coordenador', 'gerencia'] or selected_inspecao['inspetor_id'] == user['id']:
                         if st.button("✏️ Editar", use_container_width=True):
-                            st.info("Funcionalidade de edição será implementada em modal separado.")
+                            # Guarda a versão lida: a gravação só acontece se ninguém alterou depois
+                            st.session_state.edicao = {
+                                'id': id_to_str(selected_inspecao['id']),
+                                'versao': int(selected_inspecao['versao'])
+                            }
                 
                 with col3:
                     if user['perfil'] in ['coordenador', 'gerencia']:
                         if st.button("💬 Comentários", use_container_width=True):
                             st.info("Funcionalidade de comentários será implementada em modal separado.")
+                
+                edicao = st.session_state.get('edicao')
+                if edicao and edicao['id'] == id_to_str(selected_inspecao['id']):
+                    show_edit_form(selected_inspecao, user)
     
     # Botões de ação geral
     st.markdown("---")
@@ -296,5 +456,6 @@ def main():
             st.rerun()
 
 if __name__ == "__main__":
-    main()
+    with medir_rerun("Minhas Inspeções"):
+        main()
 
@@ -3,7 +3,6 @@ Painel de Coordenação - Gestão de processos e equipe
 """
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 import sys
 import os
@@ -12,7 +11,14 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.auth import auth_manager
-from utils.data_manager import data_manager
+from utils.data_manager import data_manager, pagina_criticos, contagem_criticos, TAMANHO_PAGINA_CRITICOS
+from utils.reinspecao import PERIODICIDADE_MESES, HORIZONTE_MESES
+from utils.performance import iniciar_rerun, etapa, medir_rerun
+from utils.metrics_exporter import metrics_exporter
+from utils.tarefas import enviar_tarefa, mostrar_tarefas, parametros_relatorio
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
 
 # Configuração da página
 st.set_page_config(
@@ -21,14 +27,19 @@ st.set_page_config(
     layout="wide"
 )
 
+# Medição do rerun por etapas
+iniciar_rerun("Painel Coordenação")
+
 # Verificar autenticação e permissão
+etapa("autenticação")
 auth_manager.require_auth(['coordenador', 'gerencia'])
 
+@data_manager.canal.memorizar
 def get_inspector_stats():
     """Retorna estatísticas por inspetor"""
-    df = data_manager.load_inspecoes()
+    stats = data_manager.get_estatisticas_equipe()
     
-    if len(df) == 0:
+    if len(stats) == 0:
         return pd.DataFrame()
     
     # Carregar dados de usuários para obter nomes
@@ -38,89 +49,35 @@ def get_inspector_stats():
     except Exception:
         users_dict = {}
     
-    # Agrupar por inspetor
-    stats = df.groupby("inspetor_id").agg({
-        "id": "count",  # Total de inspeções
-        "status": lambda x: (x == "pendente").sum(),  # Pendentes
-        "data_inspecao": lambda x: (pd.to_datetime(x).dt.month == datetime.now().month).sum()  # Mês atual
-    }).reset_index()
-    
-    stats.columns = ["inspetor_id", "total", "pendentes", "mes_atual"]
-    
-    # Calcular vencidas
-    hoje = datetime.now().date()
-    vencidas_por_inspetor = []
-    
-    for inspetor_id in stats["inspetor_id"]:
-        df_inspetor = df[df["inspetor_id"] == inspetor_id]
-        vencidas = 0
-        
-        for _, row in df_inspetor.iterrows():
-            if row["status"] == "pendente":
-                if (pd.notna(row["prazo_inspetor"]) and row["prazo_inspetor"].date() < hoje) or \
-                   (pd.notna(row["prazo_coordenacao"]) and row["prazo_coordenacao"].date() < hoje):
-                    vencidas += 1
-        
-        vencidas_por_inspetor.append(vencidas)
-    
-    stats["vencidas"] = vencidas_por_inspetor
-    
     # Adicionar nomes dos inspetores
     stats["nome_inspetor"] = stats["inspetor_id"].map(users_dict).fillna("Desconhecido")
     
     return stats
 
+@data_manager.canal.memorizar
 def get_critical_processes():
     """Retorna processos críticos que precisam de atenção"""
-    df = data_manager.load_inspecoes()
-    hoje = datetime.now().date()
-    
-    # Filtrar apenas pendentes
-    df_pendentes = df[df["status"] == "pendente"].copy()
-    
-    if len(df_pendentes) == 0:
-        return pd.DataFrame()
-    
-    # Identificar vencidas e próximas do vencimento
-    critical = []
-    
-    for _, row in df_pendentes.iterrows():
-        urgencia = "baixa"
-        dias_vencimento = None
-        
-        # Verificar prazo do inspetor
-        if pd.notna(row["prazo_inspetor"]):
-            dias = (row["prazo_inspetor"].date() - hoje).days
-            if dias < 0:
-                urgencia = "alta"
-                dias_vencimento = abs(dias)
-            elif dias <= 3:
-                urgencia = "media"
-                dias_vencimento = dias
-        
-        # Verificar prazo da coordenação
-        if pd.notna(row["prazo_coordenacao"]):
-            dias = (row["prazo_coordenacao"].date() - hoje).days
-            if dias < 0:
-                urgencia = "alta"
-                dias_vencimento = abs(dias)
-            elif dias <= 3 and urgencia != "alta":
-                urgencia = "media"
-                dias_vencimento = dias
-        
-        if urgencia in ["alta", "media"]:
-            critical.append({
-                "id": row["id"],
-                "estabelecimento": row["estabelecimento"],
-                "inspetor_id": row["inspetor_id"],
-                "urgencia": urgencia,
-                "dias_vencimento": dias_vencimento,
-                "prazo_inspetor": row["prazo_inspetor"],
-                "prazo_coordenacao": row["prazo_coordenacao"],
-                "classificacao_risco": row["classificacao_risco"]
-            })
-    
-    return pd.DataFrame(critical)
+    return data_manager.get_processos_criticos()
+
+@data_manager.canal.memorizar
+def get_critical_page(pagina):
+    """Retorna uma página dos processos críticos, do mais urgente para o menos urgente"""
+    return pagina_criticos(get_critical_processes(), pagina)
+
+@data_manager.canal.memorizar
+def get_critical_counts(coluna):
+    """Retorna vencidas e próximas por território ou inspetor"""
+    return contagem_criticos(get_critical_processes(), coluna)
+
+@data_manager.canal.memorizar
+def get_reinspection_schedule():
+    """Retorna a próxima reinspeção de cada CNPJ conforme o risco"""
+    return data_manager.get_agenda_reinspecoes()
+
+@data_manager.canal.memorizar
+def get_reinspection_workload(coluna):
+    """Retorna reinspeções atrasadas e por mês à frente, por território ou inspetor"""
+    return data_manager.get_carga_reinspecoes(coluna)
 
 def main():
     user = auth_manager.get_current_user()
@@ -129,19 +86,27 @@ def main():
     st.markdown("# 👥 Painel de Coordenação")
     st.markdown("Gestão de processos e acompanhamento da equipe")
     
+    # Rerun automático quando chegam inspeções novas ou alteradas
+    if st.toggle("🔄 Atualização automática", value=True, key="painel_auto_atualizar"):
+        data_manager.canal.acompanhar_sessao()
+    
     # Estatísticas por inspetor
+    etapa("dados")
     st.markdown("### 📊 Visão Geral por Inspetor")
     
     stats_df = get_inspector_stats()
     
     if len(stats_df) > 0:
         # Exibir tabela de estatísticas
-        display_stats = stats_df[["nome_inspetor", "total", "pendentes", "vencidas", "mes_atual"]].copy()
-        display_stats.columns = ["Inspetor", "Total", "Pendentes", "Vencidas", "Mês Atual"]
+        display_stats = stats_df[["nome_inspetor", "total", "pendentes", "vencidas", "proximas", "mes_atual",
+                                  "dias_conclusao_mediana", "dias_conclusao_p90"]]
+        display_stats.columns = ["Inspetor", "Total", "Pendentes", "Vencidas", "Próximas", "Mês Atual",
+                                 "Dias p/ Concluir (mediana)", "Dias p/ Concluir (p90)"]
         
         st.dataframe(display_stats, use_container_width=True, hide_index=True)
         
         # Gráfico de performance
+        etapa("gráficos")
         col1, col2 = st.columns(2)
         
         with col1:
@@ -177,38 +142,120 @@ def main():
     st.markdown("---")
     
     # Processos críticos
+    etapa("processos críticos")
     st.markdown("### 🚨 Processos Críticos")
     
     critical_df = get_critical_processes()
     
     if len(critical_df) > 0:
-        # Separar por urgência
-        alta_urgencia = critical_df[critical_df["urgencia"] == "alta"]
-        media_urgencia = critical_df[critical_df["urgencia"] == "media"]
+        vencidas = int((critical_df["urgencia"] == "alta").sum())
+        st.markdown(f"**{len(critical_df)}** processos críticos: **{vencidas}** vencidos e "
+                    f"**{len(critical_df) - vencidas}** próximos do vencimento")
+        
+        # Contagens completas; a lista abaixo mostra só uma página
+        nomes = dict(zip(stats_df["inspetor_id"], stats_df["nome_inspetor"])) if len(stats_df) > 0 else {}
+        col1, col2 = st.columns(2)
         
-        if len(alta_urgencia) > 0:
-            st.markdown("#### 🔴 Alta Urgência (Vencidas)")
-            for _, row in alta_urgencia.iterrows():
+        with col1:
+            st.markdown("#### 🗺️ Por Território")
+            por_territorio = get_critical_counts("territorio")
+            por_territorio.columns = ["Território", "Vencidas", "Próximas", "Total"]
+            st.dataframe(por_territorio, use_container_width=True, hide_index=True)
+        
+        with col2:
+            st.markdown("#### 👤 Por Inspetor")
+            por_inspetor = get_critical_counts("inspetor_id")
+            por_inspetor["inspetor_id"] = por_inspetor["inspetor_id"].map(nomes).fillna("Desconhecido")
+            por_inspetor.columns = ["Inspetor", "Vencidas", "Próximas", "Total"]
+            st.dataframe(por_inspetor, use_container_width=True, hide_index=True)
+        
+        # Ordenados pela pontuação de urgência (atraso × risco)
+        paginas = -(-len(critical_df) // TAMANHO_PAGINA_CRITICOS)
+        pagina = min(st.session_state.get("criticos_pagina", 0), paginas - 1)
+        
+        st.markdown("#### 📋 Por Urgência (atraso × risco)")
+        for posicao, (_, row) in enumerate(get_critical_page(pagina).iterrows(), start=pagina * TAMANHO_PAGINA_CRITICOS + 1):
+            if row["urgencia"] == "alta":
                 st.error(f"""
-                **{row["estabelecimento"]}** - Vencida há {row["dias_vencimento"]} dias
+                **{posicao}. {row["estabelecimento"]}** - Vencida há {row["dias_vencimento"]} dias
                 
                 Inspetor ID: {row["inspetor_id"]} | Risco: {row["classificacao_risco"].title()}
                 """)
-        
-        if len(media_urgencia) > 0:
-            st.markdown("#### 🟡 Atenção (Próximas do Vencimento)")
-            for _, row in media_urgencia.iterrows():
+            else:
                 st.warning(f"""
-                **{row["estabelecimento"]}** - Vence em {row["dias_vencimento"]} dias
+                **{posicao}. {row["estabelecimento"]}** - Vence em {row["dias_vencimento"]} dias
                 
                 Inspetor ID: {row["inspetor_id"]} | Risco: {row["classificacao_risco"].title()}
                 """)
+        
+        col1, col2, col3 = st.columns([1, 2, 1])
+        
+        with col1:
+            if st.button("◀ Anteriores", disabled=pagina == 0, use_container_width=True):
+                st.session_state.criticos_pagina = pagina - 1
+                st.rerun()
+        
+        with col2:
+            st.caption(f"Página {pagina + 1} de {paginas}")
+        
+        with col3:
+            if st.button("Próximos ▶", disabled=pagina >= paginas - 1, use_container_width=True):
+                st.session_state.criticos_pagina = pagina + 1
+                st.rerun()
     else:
         st.success("✅ Nenhum processo crítico no momento!")
     
     st.markdown("---")
     
+    # Reinspeções programadas pelo risco
+    etapa("reinspeções")
+    st.markdown("### 📅 Reinspeções Programadas")
+    ciclos = ", ".join(f"{risco.replace('medio', 'médio')} a cada {meses} meses"
+                       for risco, meses in PERIODICIDADE_MESES.items())
+    st.caption(f"Contadas da última inspeção de cada CNPJ pelo risco: {ciclos}")
+    
+    agenda_df = get_reinspection_schedule()
+    
+    if len(agenda_df) > 0:
+        atrasadas = int(agenda_df["atrasada"].sum())
+        proximas_30 = int(((agenda_df["dias_restantes"] >= 0) & (agenda_df["dias_restantes"] <= 30)).sum())
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Estabelecimentos", len(agenda_df))
+        with col2:
+            st.metric("Reinspeções Atrasadas", atrasadas)
+        with col3:
+            st.metric("Nos Próximos 30 Dias", proximas_30)
+        
+        st.markdown(f"#### 🗓️ Carga dos Próximos {HORIZONTE_MESES} Meses")
+        agrupar = st.radio("Agrupar por", ["Território", "Inspetor"], horizontal=True, key="reinspecao_agrupar")
+        if agrupar == "Território":
+            carga = get_reinspection_workload("territorio").rename(columns={"territorio": "Território"})
+        else:
+            nomes = dict(zip(stats_df["inspetor_id"], stats_df["nome_inspetor"])) if len(stats_df) > 0 else {}
+            carga = get_reinspection_workload("inspetor_id")
+            carga["inspetor_id"] = carga["inspetor_id"].map(nomes).fillna("Desconhecido")
+            carga = carga.rename(columns={"inspetor_id": "Inspetor"})
+        st.dataframe(carga, use_container_width=True, hide_index=True)
+        
+        st.markdown("#### 📋 Próximas Reinspeções")
+        proximas = agenda_df[~agenda_df["atrasada"]].head(TAMANHO_PAGINA_CRITICOS)
+        display_proximas = proximas[["estabelecimento", "cnpj", "classificacao_risco", "territorio",
+                                     "ultima_inspecao", "proxima_reinspecao", "dias_restantes"]]
+        display_proximas["classificacao_risco"] = display_proximas["classificacao_risco"].str.title()
+        display_proximas["ultima_inspecao"] = display_proximas["ultima_inspecao"].dt.strftime("%d/%m/%Y")
+        display_proximas["proxima_reinspecao"] = display_proximas["proxima_reinspecao"].dt.strftime("%d/%m/%Y")
+        display_proximas.columns = ["Estabelecimento", "CNPJ", "Risco", "Território",
+                                    "Última Inspeção", "Reinspeção", "Dias"]
+        st.dataframe(display_proximas, use_container_width=True, hide_index=True)
+    else:
+        st.info("Nenhuma reinspeção programada.")
+    
+    st.markdown("---")
+    
     # Ações de coordenação
+    etapa("ações")
     st.markdown("### 🛠️ Ações de Coordenação")
     
     col1, col2, col3 = st.columns(3)
@@ -219,53 +266,19 @@ def main():
     
     with col2:
         if st.button("📊 Relatório Detalhado", use_container_width=True):
-            show_detailed_report()
+            # Montado em segundo plano: a página segue respondendo
+            enviar_tarefa('relatorio', user['id'], parametros_relatorio(user))
     
     with col3:
         if st.button("⚙️ Definir Prazos", use_container_width=True):
             st.info("Funcionalidade de definição de prazos disponível.")
-
-def show_detailed_report():
-    """Exibe relatório detalhado"""
-    st.markdown("### 📊 Relatório Detalhado")
-    
-    df = data_manager.load_inspecoes()
     
-    if len(df) > 0:
-        # Estatísticas gerais
-        total = len(df)
-        pendentes = len(df[df["status"] == "pendente"])
-        concluidas = len(df[df["status"] == "concluido"])
-        
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            st.metric("Total de Inspeções", total)
-        
-        with col2:
-            st.metric("Pendentes", pendentes)
-        
-        with col3:
-            st.metric("Concluídas", concluidas)
-        
-        # Distribuição por risco
-        st.markdown("#### Distribuição por Risco")
-        risco_counts = df["classificacao_risco"].value_counts()
-        
-        fig, ax = plt.subplots()
-        ax.pie(risco_counts.values, labels=risco_counts.index, autopct="%1.1f%%")
-        ax.set_title("Distribuição por Classificação de Risco")
-        st.pyplot(fig)
-        
-        # Exportar relatório
-        if st.button("📄 Exportar Relatório Completo"):
-            export_path = data_manager.export_to_csv(df)
-            if export_path:
-                st.success(f"✅ Relatório exportado para: {export_path}")
-    else:
-        st.info("Nenhuma inspeção cadastrada para gerar relatório.")
+    # Relatórios e exportações enviados, inclusive em sessões anteriores
+    etapa("tarefas")
+    mostrar_tarefas(user['id'], ['relatorio', 'exportacao'])
 
 if __name__ == "__main__":
-    main()
+    with medir_rerun("Painel Coordenação"):
+        main()
 
 
@@ -4,7 +4,7 @@ Dashboard de Indicadores e Relatórios
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import datetime
 import sys
 import os
 
@@ -13,6 +13,16 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.auth import auth_manager
 from utils.data_manager import data_manager
+from utils.performance import iniciar_rerun, etapa, medir_rerun
+from utils.metrics_exporter import metrics_exporter
+from utils.relatorios import (calculate_kpis, create_inspector_performance_chart, create_monthly_trend_chart,
+                              create_risk_distribution_chart, create_status_chart, inicio_do_periodo,
+                              tabela_detalhada)
+from utils.relatorios_noturnos import relatorios_noturnos, PERIODOS_PADRAO
+from utils.tarefas import enviar_tarefa, mostrar_tarefas, parametros_relatorio
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
 
 # Configuração da página
 st.set_page_config(
@@ -21,201 +31,21 @@ st.set_page_config(
     layout="wide"
 )
 
+# Medição do rerun por etapas
+iniciar_rerun("Indicadores")
+
 # Verificar autenticação
+etapa("autenticação")
 auth_manager.require_auth()
 
-def calculate_kpis(df, user_profile, user_id):
-    """Calcula KPIs principais"""
-    if user_profile == 'inspetor':
-        df = df[df['inspetor_id'] == user_id]
-    
-    total = len(df)
-    if total == 0:
-        return {
-            'total_inspecoes': 0,
-            'cumprimento_prazos': 0,
-            'media_dias_prazo': 0,
-            'inspecoes_mes': 0,
-            'percentual_alto_risco': 0
-        }
-    
-    # Cumprimento de prazos
-    hoje = datetime.now().date()
-    concluidas = df[df['status'] == 'concluido']
-    cumprimento = len(concluidas) / total * 100 if total > 0 else 0
-    
-    # Média de dias para conclusão
-    if len(concluidas) > 0:
-        concluidas_copy = concluidas.copy()
-        concluidas_copy['dias_conclusao'] = (
-            pd.to_datetime(concluidas_copy['data_atualizacao']) - 
-            pd.to_datetime(concluidas_copy['data_inspecao'])
-        ).dt.days
-        media_dias = concluidas_copy['dias_conclusao'].mean()
+def show_chart(grafico, mensagem_vazio):
+    """Exibe um gráfico calculado na hora (figura) ou do snapshot noturno (PNG)"""
+    if grafico is None:
+        st.info(mensagem_vazio)
+    elif isinstance(grafico, bytes):
+        st.image(grafico, use_column_width=True)
     else:
-        media_dias = 0
-    
-    # Inspeções do mês atual
-    mes_atual = datetime.now().month
-    ano_atual = datetime.now().year
-    inspecoes_mes = len(df[
-        (pd.to_datetime(df['data_inspecao']).dt.month == mes_atual) &
-        (pd.to_datetime(df['data_inspecao']).dt.year == ano_atual)
-    ])
-    
-    # Percentual de alto risco
-    alto_risco = len(df[df['classificacao_risco'] == 'alto'])
-    percentual_alto_risco = alto_risco / total * 100 if total > 0 else 0
-    
-    return {
-        'total_inspecoes': total,
-        'cumprimento_prazos': cumprimento,
-        'media_dias_prazo': media_dias,
-        'inspecoes_mes': inspecoes_mes,
-        'percentual_alto_risco': percentual_alto_risco
-    }
-
-def create_monthly_trend_chart(df, user_profile, user_id):
-    """Cria gráfico de tendência mensal"""
-    if user_profile == 'inspetor':
-        df = df[df['inspetor_id'] == user_id]
-    
-    if len(df) == 0:
-        return None
-    
-    # Agrupar por mês
-    df_copy = df.copy()
-    df_copy['data_inspecao'] = pd.to_datetime(df_copy['data_inspecao'])
-    df_copy['mes_ano'] = df_copy['data_inspecao'].dt.to_period('M')
-    
-    monthly_data = df_copy.groupby(['mes_ano', 'status']).size().unstack(fill_value=0)
-    monthly_data.index = monthly_data.index.astype(str)
-    
-    fig, ax = plt.subplots()
-    
-    if 'pendente' in monthly_data.columns:
-        ax.plot(monthly_data.index, monthly_data['pendente'], marker='o', label='Pendentes', color='orange')
-    
-    if 'concluido' in monthly_data.columns:
-        ax.plot(monthly_data.index, monthly_data['concluido'], marker='o', label='Concluídas', color='green')
-    
-    ax.set_title('Tendência Mensal de Inspeções')
-    ax.set_xlabel('Mês')
-    ax.set_ylabel('Número de Inspeções')
-    ax.legend()
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    
-    return fig
-
-def create_risk_distribution_chart(df, user_profile, user_id):
-    """Cria gráfico de distribuição por risco"""
-    if user_profile == 'inspetor':
-        df = df[df['inspetor_id'] == user_id]
-    
-    if len(df) == 0:
-        return None
-    
-    risk_counts = df['classificacao_risco'].value_counts()
-    
-    colors = {
-        'alto': '#d62728',
-        'medio': '#ff7f0e', 
-        'baixo': '#2ca02c'
-    }
-    
-    fig, ax = plt.subplots()
-    ax.pie(risk_counts.values, labels=[name.title() for name in risk_counts.index], autopct='%1.1f%%', colors=[colors.get(name, '#7f7f7f') for name in risk_counts.index])
-    ax.set_title('Distribuição por Classificação de Risco')
-    
-    return fig
-
-def create_status_chart(df, user_profile, user_id):
-    """Cria gráfico de status das inspeções"""
-    if user_profile == 'inspetor':
-        df = df[df['inspetor_id'] == user_id]
-    
-    if len(df) == 0:
-        return None
-    
-    # Calcular status atual incluindo vencidas
-    hoje = datetime.now().date()
-    status_atual = []
-    
-    for _, row in df.iterrows():
-        if row['status'] == 'concluido':
-            status_atual.append('Concluída')
-        elif row['status'] == 'pendente':
-            vencida = False
-            if pd.notna(row['prazo_inspetor']) and pd.to_datetime(row['prazo_inspetor']).date() < hoje:
-                vencida = True
-            if pd.notna(row['prazo_coordenacao']) and pd.to_datetime(row['prazo_coordenacao']).date() < hoje:
-                vencida = True
-            
-            if vencida:
-                status_atual.append('Vencida')
-            else:
-                status_atual.append('Pendente')
-        else:
-            status_atual.append('Outro')
-    
-    status_counts = pd.Series(status_atual).value_counts()
-    
-    colors = {
-        'Concluída': '#2ca02c',
-        'Pendente': '#ff7f0e',
-        'Vencida': '#d62728',
-        'Outro': '#7f7f7f'
-    }
-    
-    fig, ax = plt.subplots()
-    ax.bar(status_counts.index, status_counts.values, color=[colors.get(status, '#7f7f7f') for status in status_counts.index])
-    ax.set_title('Status Atual das Inspeções')
-    ax.set_xlabel('Status')
-    ax.set_ylabel('Quantidade')
-    plt.tight_layout()
-    
-    return fig
-
-def create_inspector_performance_chart(df):
-    """Cria gráfico de performance por inspetor (apenas para coordenadores/gerência)"""
-    if len(df) == 0:
-        return None
-    
-    # Carregar dados de usuários
-    try:
-        users_df = pd.read_csv("data/usuarios.csv")
-        users_dict = dict(zip(users_df['id'], users_df['nome']))
-    except:
-        users_dict = {}
-    
-    # Agrupar por inspetor
-    inspector_stats = df.groupby('inspetor_id').agg({
-        'id': 'count',
-        'status': lambda x: (x == 'concluido').sum()
-    }).reset_index()
-    
-    inspector_stats.columns = ['inspetor_id', 'total', 'concluidas']
-    inspector_stats['pendentes'] = inspector_stats['total'] - inspector_stats['concluidas']
-    inspector_stats['nome'] = inspector_stats['inspetor_id'].map(users_dict).fillna('Desconhecido')
-    
-    fig, ax = plt.subplots()
-    
-    bar_width = 0.35
-    index = range(len(inspector_stats['nome']))
-    
-    bar1 = ax.bar([i - bar_width/2 for i in index], inspector_stats['concluidas'], bar_width, label='Concluídas', color='green')
-    bar2 = ax.bar([i + bar_width/2 for i in index], inspector_stats['pendentes'], bar_width, label='Pendentes', color='orange')
-    
-    ax.set_title('Performance por Inspetor')
-    ax.set_xlabel('Inspetor')
-    ax.set_ylabel('Número de Inspeções')
-    ax.set_xticks(index)
-    ax.set_xticklabels(inspector_stats['nome'], rotation=45, ha='right')
-    ax.legend()
-    plt.tight_layout()
-    
-    return fig
+        st.pyplot(grafico)
 
 def main():
     user = auth_manager.get_current_user()
@@ -228,14 +58,8 @@ def main():
     else:
         st.markdown("Indicadores gerais do sistema")
     
-    # Carregar dados
-    df = data_manager.load_inspecoes()
-    
-    if len(df) == 0:
-        st.info("Nenhuma inspeção cadastrada ainda.")
-        return
-    
     # Filtros de período
+    etapa("filtros")
     st.markdown("### 📅 Filtros")
     
     col1, col2, col3 = st.columns(3)
@@ -258,30 +82,62 @@ def main():
         else:
             data_fim = None
     
-    # Aplicar filtros de período
-    df_filtrado = df.copy()
+    # Início do período selecionado (None = todo o histórico)
     hoje = datetime.now().date()
-    
-    if periodo == "Último mês":
-        inicio = hoje - timedelta(days=30)
-        df_filtrado = df_filtrado[pd.to_datetime(df_filtrado['data_inspecao']).dt.date >= inicio]
-    elif periodo == "Últimos 3 meses":
-        inicio = hoje - timedelta(days=90)
-        df_filtrado = df_filtrado[pd.to_datetime(df_filtrado['data_inspecao']).dt.date >= inicio]
-    elif periodo == "Último ano":
-        inicio = hoje - timedelta(days=365)
-        df_filtrado = df_filtrado[pd.to_datetime(df_filtrado['data_inspecao']).dt.date >= inicio]
-    elif periodo == "Personalizado" and data_inicio and data_fim:
-        df_filtrado = df_filtrado[
-            (pd.to_datetime(df_filtrado['data_inspecao']).dt.date >= data_inicio) &
-            (pd.to_datetime(df_filtrado['data_inspecao']).dt.date <= data_fim)
-        ]
+    inicio = inicio_do_periodo(periodo, hoje)
+    
+    if periodo == "Personalizado" and data_inicio and data_fim:
+        inicio = data_inicio
+    
+    parametros = parametros_relatorio(
+        user, inicio, data_fim if periodo == "Personalizado" and data_inicio and data_fim else None)
+    
+    etapa("dados")
+    
+    # Visões padrão de todos os territórios: snapshot noturno do dia, se houver
+    snapshot = None
+    if user['perfil'] in ['coordenador', 'gerencia'] and periodo in PERIODOS_PADRAO:
+        snapshot = relatorios_noturnos.carregar(periodo, data_manager.canal.obter_chave())
+        if snapshot is not None:
+            # Snapshot desatualizado: calcula com os dados atuais, salvo se o usuário pedir o snapshot
+            usar_snapshot = st.toggle(
+                f"📦 Usar snapshot noturno (gerado às {snapshot['gerado_em'].strftime('%H:%M')})",
+                value=not snapshot['desatualizado'], key="indicadores_snapshot")
+            if snapshot['desatualizado']:
+                st.caption("⚠️ Houve cadastros ou alterações depois da geração do snapshot; "
+                           "os indicadores são calculados com os dados atuais.")
+            if not usar_snapshot:
+                snapshot = None
+    
+    if snapshot is not None:
+        kpis = snapshot['kpis']
+        graficos = snapshot['graficos']
+    else:
+        # Carregar dados (o arquivo frio só entra se o período alcançá-lo)
+        df = data_manager.load_inspecoes_historico(inicio)
+        
+        if len(df) == 0:
+            st.info("Nenhuma inspeção cadastrada ainda.")
+            return
+        
+        # Aplicar filtros de período
+        df_filtrado = df
+        
+        if periodo in ["Último mês", "Últimos 3 meses", "Último ano"]:
+            df_filtrado = df_filtrado[pd.to_datetime(df_filtrado['data_inspecao']).dt.date >= inicio]
+        elif periodo == "Personalizado" and data_inicio and data_fim:
+            df_filtrado = df_filtrado[
+                (pd.to_datetime(df_filtrado['data_inspecao']).dt.date >= data_inicio) &
+                (pd.to_datetime(df_filtrado['data_inspecao']).dt.date <= data_fim)
+            ]
+        
+        kpis = calculate_kpis(df_filtrado, user['perfil'], user['id'])
+        graficos = None
     
     # KPIs principais
+    etapa("indicadores")
     st.markdown("### 📈 Indicadores Principais")
     
-    kpis = calculate_kpis(df_filtrado, user['perfil'], user['id'])
-    
     col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
@@ -317,45 +173,39 @@ def main():
     st.markdown("---")
     
     # Gráficos
+    etapa("gráficos")
     st.markdown("### 📊 Análises Visuais")
     
+    if graficos is None:
+        graficos = {
+            'tendencia': create_monthly_trend_chart(df_filtrado, user['perfil'], user['id']),
+            'risco': create_risk_distribution_chart(df_filtrado, user['perfil'], user['id']),
+            'status': create_status_chart(df_filtrado, user['perfil'], user['id']),
+            'inspetores': (create_inspector_performance_chart(df_filtrado)
+                           if user['perfil'] in ['coordenador', 'gerencia'] else None)
+        }
+    
     col1, col2 = st.columns(2)
     
     with col1:
         # Tendência mensal
-        fig_trend = create_monthly_trend_chart(df_filtrado, user['perfil'], user['id'])
-        if fig_trend:
-            st.pyplot(fig_trend)
-        else:
-            st.info("Dados insuficientes para gráfico de tendência")
+        show_chart(graficos['tendencia'], "Dados insuficientes para gráfico de tendência")
     
     with col2:
         # Distribuição por risco
-        fig_risk = create_risk_distribution_chart(df_filtrado, user['perfil'], user['id'])
-        if fig_risk:
-            st.pyplot(fig_risk)
-        else:
-            st.info("Dados insuficientes para gráfico de risco")
+        show_chart(graficos['risco'], "Dados insuficientes para gráfico de risco")
     
     # Segunda linha de gráficos
     col1, col2 = st.columns(2)
     
     with col1:
         # Status das inspeções
-        fig_status = create_status_chart(df_filtrado, user['perfil'], user['id'])
-        if fig_status:
-            st.pyplot(fig_status)
-        else:
-            st.info("Dados insuficientes para gráfico de status")
+        show_chart(graficos['status'], "Dados insuficientes para gráfico de status")
     
     with col2:
         # Performance por inspetor (apenas para coordenadores/gerência)
         if user['perfil'] in ['coordenador', 'gerencia']:
-            fig_performance = create_inspector_performance_chart(df_filtrado)
-            if fig_performance:
-                st.pyplot(fig_performance)
-            else:
-                st.info("Dados insuficientes para gráfico de performance")
+            show_chart(graficos['inspetores'], "Dados insuficientes para gráfico de performance")
         else:
             # Para inspetores, mostrar evolução pessoal
             st.markdown("#### 📈 Sua Evolução")
@@ -363,13 +213,11 @@ def main():
                 df_inspetor = df_filtrado[df_filtrado['inspetor_id'] == user['id']]
                 if len(df_inspetor) > 0:
                     # Gráfico simples de evolução
-                    df_inspetor_copy = df_inspetor.copy()
-                    df_inspetor_copy['data_inspecao'] = pd.to_datetime(df_inspetor_copy['data_inspecao'])
-                    df_inspetor_copy = df_inspetor_copy.sort_values('data_inspecao')
-                    df_inspetor_copy['acumulado'] = range(1, len(df_inspetor_copy) + 1)
+                    datas = pd.to_datetime(df_inspetor['data_inspecao']).sort_values()
+                    acumulado = range(1, len(datas) + 1)
                     
                     fig, ax = plt.subplots()
-                    ax.plot(df_inspetor_copy['data_inspecao'], df_inspetor_copy['acumulado'], marker='o')
+                    ax.plot(datas, acumulado, marker='o')
                     ax.set_title('Suas Inspeções Acumuladas')
                     ax.set_xlabel('Data da Inspeção')
                     ax.set_ylabel('Inspeções Acumuladas')
@@ -384,65 +232,54 @@ def main():
     st.markdown("---")
     
     # Tabela detalhada
+    etapa("tabelas")
     st.markdown("### 📋 Dados Detalhados")
     
-    if len(df_filtrado) > 0:
-        # Preparar dados para exibição
-        display_df = df_filtrado.copy()
-        
-        # Filtrar por perfil
-        if user['perfil'] == 'inspetor':
-            display_df = display_df[display_df['inspetor_id'] == user['id']]
-        
-        # Formatar datas
-        display_df['Data Inspeção'] = pd.to_datetime(display_df['data_inspecao']).dt.strftime('%d/%m/%Y')
-        display_df['Prazo Inspetor'] = display_df['prazo_inspetor'].apply(
-            lambda x: pd.to_datetime(x).strftime('%d/%m/%Y') if pd.notna(x) else '-'
-        )
-        display_df['Prazo Coordenação'] = display_df['prazo_coordenacao'].apply(
-            lambda x: pd.to_datetime(x).strftime('%d/%m/%Y') if pd.notna(x) else '-'
-        )
-        
-        # Selecionar colunas
-        columns = ['estabelecimento', 'Data Inspeção', 'classificacao_risco', 
-                  'Prazo Inspetor', 'Prazo Coordenação', 'status']
-        
-        if user['perfil'] in ['coordenador', 'gerencia']:
-            columns.insert(-1, 'inspetor_id')
-        
-        # Renomear colunas
-        column_names = {
-            'estabelecimento': 'Estabelecimento',
-            'classificacao_risco': 'Risco',
-            'status': 'Status',
-            'inspetor_id': 'Inspetor ID'
-        }
-        
-        display_final = display_df[columns].rename(columns=column_names)
-        
+    if snapshot is not None:
+        display_final = snapshot['tabela']
+    else:
+        display_final = tabela_detalhada(df_filtrado, user['perfil'], user['id'])
+    
+    if len(display_final) > 0:
         st.dataframe(display_final, use_container_width=True, hide_index=True)
         
-        # Exportar dados
+        # Exportação e resumo do período em segundo plano
         col1, col2, col3 = st.columns([1, 1, 1])
         
+        with col1:
+            if st.button("🧮 Resumo do Período", use_container_width=True):
+                enviar_tarefa('agregados', user['id'], parametros, f"🧮 Resumo do período ({periodo})")
+        
         with col2:
             if st.button("📄 Exportar Relatório", use_container_width=True):
-                export_path = data_manager.export_to_csv(display_df)
-                if export_path:
-                    st.success(f"✅ Relatório exportado para: {export_path}")
-                    
-                    # Informações sobre o arquivo
-                    with st.expander("ℹ️ Informações do Arquivo"):
-                        st.markdown(f"""
-                        **Arquivo:** {export_path}
-                        **Registros:** {len(display_df)}
-                        **Período:** {periodo}
-                        **Gerado em:** {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-                        """)
+                enviar_tarefa('exportacao', user['id'], parametros, f"📄 Exportação ({periodo})")
     else:
         st.info("Nenhuma inspeção encontrada no período selecionado.")
+    
+    # Resumos e exportações enviados, inclusive em sessões anteriores
+    etapa("tarefas")
+    mostrar_tarefas(user['id'], ['agregados', 'exportacao'])
+    
+    # Uso de memória do frame de inspeções (apenas gerência)
+    if user['perfil'] == 'gerencia':
+        with st.expander("💾 Uso de Memória dos Dados"):
+            report = data_manager.memory_report()
+            col1, col2, col3 = st.columns(3)
+            
+            with col1:
+                st.metric("Bytes/linha (original)", f"{report['bytes_por_linha_antes']:.0f}")
+            
+            with col2:
+                st.metric("Bytes/linha (compacto)", f"{report['bytes_por_linha_depois']:.0f}")
+            
+            with col3:
+                st.metric("Redução", f"{report['reducao']:.1f}x")
+            
+            st.caption(f"{report['linhas']} linhas carregadas; o compacto inclui as observações "
+                       f"e os comentários guardados fora do frame")
 
 if __name__ == "__main__":
-    main()
+    with medir_rerun("Indicadores"):
+        main()
 
 
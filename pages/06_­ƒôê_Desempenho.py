@@ -0,0 +1,227 @@
+"""
+Painel de Desempenho - Latência da camada de dados (gerência)
+"""
+import streamlit as st
+import pandas as pd
+from datetime import datetime
+import sys
+import os
+
+# Adicionar o diretório pai ao path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.auth import auth_manager
+from utils.metrics import metrics
+from utils.performance import (
+    iniciar_rerun, etapa, medir_rerun, reruns_lentos, ORCAMENTO_RERUN_MS,
+    profiling_ativo, ativar_profiling, limpar_profiling, profiling_stats_bytes, profiling_resumo
+)
+from utils.metrics_exporter import metrics_exporter
+from utils.aquecimento import aquecimento
+
+# Endpoint local de métricas (Prometheus)
+metrics_exporter.start()
+
+# Configuração da página
+st.set_page_config(
+    page_title="Desempenho - VISA Digital",
+    page_icon="📈",
+    layout="wide"
+)
+
+# Medição do rerun por etapas
+iniciar_rerun("Desempenho")
+
+# Verificar autenticação e permissão
+etapa("autenticação")
+auth_manager.require_auth(['gerencia'])
+
+def format_bytes(n):
+    """Formata bytes para exibição"""
+    for unidade in ['B', 'KB', 'MB', 'GB']:
+        if n < 1024:
+            return f"{n:.0f} {unidade}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+def show_etapas_por_pagina():
+    """Exibe o tempo de cada etapa dos reruns, por página"""
+    st.markdown("### 🧭 Tempo de Rerun por Página")
+    st.caption(f"Orçamento por rerun: {ORCAMENTO_RERUN_MS:.0f} ms (VISA_RERUN_BUDGET_MS)")
+    
+    etapas = metrics.section_summary()
+    if not etapas:
+        st.info("Nenhum rerun medido ainda.")
+    else:
+        df = pd.DataFrame(etapas).rename(columns={
+            'pagina': 'Página',
+            'etapa': 'Etapa',
+            'reruns': 'Reruns',
+            'p50_ms': 'p50 (ms)',
+            'p95_ms': 'p95 (ms)',
+            'p99_ms': 'p99 (ms)',
+            'media_ms': 'Média (ms)',
+            'max_ms': 'Máx (ms)'
+        })
+        st.dataframe(
+            df.style.format({
+                'p50 (ms)': '{:.1f}', 'p95 (ms)': '{:.1f}', 'p99 (ms)': '{:.1f}',
+                'Média (ms)': '{:.1f}', 'Máx (ms)': '{:.1f}'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    lentos = reruns_lentos()
+    if lentos:
+        st.markdown(f"#### 🚨 Reruns Acima do Orçamento ({len(lentos)} recentes)")
+        df_lentos = pd.DataFrame([
+            {
+                'Quando': r['quando'].strftime('%d/%m/%Y %H:%M:%S'),
+                'Página': r['pagina'],
+                'Total (ms)': r['total_ms'],
+                'Etapas': ", ".join(f"{nome}: {ms:.0f} ms" for nome, ms in r['etapas'].items())
+            }
+            for r in reversed(lentos)
+        ])
+        st.dataframe(
+            df_lentos.style.format({'Total (ms)': '{:.0f}'}),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    st.markdown("---")
+
+def show_aquecimento():
+    """Etapas do aquecimento da partida deste processo"""
+    situacao = aquecimento.situacao()
+    if situacao['iniciado_em'] is None:
+        return
+    estado = "concluído" if situacao['pronto'] else "em andamento"
+    with st.expander(f"🔥 Aquecimento da partida ({estado})"):
+        df = pd.DataFrame(situacao['etapas']).rename(columns={
+            'etapa': 'Etapa', 'ms': 'Duração (ms)', 'erro': 'Erro'
+        })
+        st.dataframe(df.style.format({'Duração (ms)': '{:.0f}'}, na_rep='—'),
+                     use_container_width=True, hide_index=True)
+
+def show_profiling():
+    """Controles do cProfile da sessão atual"""
+    st.markdown("### 🔬 Perfil de Execução (cProfile)")
+    st.caption("Mede apenas os reruns desta sessão, em qualquer página, enquanto estiver ligado.")
+    
+    ativo = st.toggle("Ativar cProfile nesta sessão", value=profiling_ativo())
+    if ativo != profiling_ativo():
+        ativar_profiling(ativo)
+    
+    dados = profiling_stats_bytes()
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "📥 Baixar estatísticas (.prof)",
+            data=dados or b"",
+            file_name=f"visa_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof",
+            mime="application/octet-stream",
+            disabled=dados is None,
+            use_container_width=True
+        )
+    with col2:
+        if st.button("🧹 Limpar perfil", use_container_width=True):
+            limpar_profiling()
+            st.rerun()
+    
+    if dados is not None:
+        with st.expander("Funções com maior tempo acumulado"):
+            st.code(profiling_resumo(), language=None)
+    
+    st.markdown("---")
+
+def main():
+    # Header
+    st.markdown("# 📈 Desempenho")
+    st.markdown("Latência dos métodos de dados, autenticação e notificações")
+    st.caption(
+        f"Métricas deste processo do servidor desde "
+        f"{metrics.started_at.strftime('%d/%m/%Y %H:%M:%S')}"
+    )
+    
+    etapa("tabelas")
+    show_aquecimento()
+    show_etapas_por_pagina()
+    show_profiling()
+    
+    resumo = metrics.summary()
+    
+    if not resumo:
+        st.info("Nenhuma chamada registrada ainda.")
+        return
+    
+    # Percentis por método
+    st.markdown("### ⏱️ Latência por Método")
+    
+    df = pd.DataFrame(resumo).sort_values('p95_ms', ascending=False)
+    df['bytes_lidos'] = df['bytes_lidos'].map(format_bytes)
+    df['bytes_gravados'] = df['bytes_gravados'].map(format_bytes)
+    
+    df = df.rename(columns={
+        'metodo': 'Método',
+        'chamadas': 'Chamadas',
+        'erros': 'Erros',
+        'p50_ms': 'p50 (ms)',
+        'p95_ms': 'p95 (ms)',
+        'p99_ms': 'p99 (ms)',
+        'media_ms': 'Média (ms)',
+        'max_ms': 'Máx (ms)',
+        'linhas': 'Linhas Varridas',
+        'bytes_lidos': 'Bytes Lidos',
+        'bytes_gravados': 'Bytes Gravados'
+    })
+    
+    st.dataframe(
+        df.style.format({
+            'p50 (ms)': '{:.2f}', 'p95 (ms)': '{:.2f}', 'p99 (ms)': '{:.2f}',
+            'Média (ms)': '{:.2f}', 'Máx (ms)': '{:.2f}'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    st.bar_chart(df.set_index('Método')[['p50 (ms)', 'p95 (ms)', 'p99 (ms)']])
+    
+    st.markdown("---")
+    
+    # Chamadas mais lentas
+    st.markdown("### 🐢 Chamadas Mais Lentas (recentes)")
+    
+    lentas = pd.DataFrame(metrics.slowest_recent(20))
+    if len(lentas) > 0:
+        lentas['quando'] = lentas['quando'].dt.strftime('%d/%m/%Y %H:%M:%S')
+        lentas = lentas.rename(columns={
+            'quando': 'Quando',
+            'metodo': 'Método',
+            'duracao_ms': 'Duração (ms)',
+            'linhas': 'Linhas'
+        })
+        st.dataframe(
+            lentas.style.format({'Duração (ms)': '{:.2f}'}),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    st.markdown("---")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col2:
+        if st.button("🔄 Atualizar", use_container_width=True):
+            st.rerun()
+    
+    with col3:
+        if st.button("🧹 Zerar Métricas", use_container_width=True):
+            metrics.reset()
+            st.rerun()
+
+if __name__ == "__main__":
+    with medir_rerun("Desempenho"):
+        main()
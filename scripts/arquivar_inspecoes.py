@@ -0,0 +1,33 @@
+"""
+Job de arquivamento das inspeções concluídas
+
+Move as inspeções concluídas há mais de N meses de data/inspecoes.csv
+para o arquivo frio comprimido (data/inspecoes_arquivo.csv.gz).
+
+Uso:
+    python scripts/arquivar_inspecoes.py --meses 12
+"""
+import argparse
+import os
+import sys
+
+# Adicionar o diretório pai ao path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.data_manager import DataManager, MESES_ARQUIVAMENTO
+
+def main():
+    parser = argparse.ArgumentParser(description="Arquiva inspeções concluídas antigas")
+    parser.add_argument("--meses", type=int, default=MESES_ARQUIVAMENTO,
+                        help="Idade mínima (em meses) da conclusão para arquivar")
+    parser.add_argument("--data-dir", default="data", help="Diretório dos dados")
+    args = parser.parse_args()
+    
+    manager = DataManager(args.data_dir)
+    movidas = manager.archive_inspecoes_concluidas(args.meses)
+    meta = manager.get_arquivo_meta()
+    
+    print(f"{movidas} inspeção(ões) arquivada(s); arquivo frio com {meta['total']} registro(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Suíte de benchmarks da camada de dados e das páginas
+
+Roda os caminhos quentes sobre um conjunto gerado por
+scripts/gerar_dados_sinteticos.py e grava os tempos em JSON. Com
+--baseline, compara com um resultado anterior e sai com código 1 se
+alguma medição piorar além da tolerância.
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 100k --saida /tmp/visa_100k
+    python scripts/benchmark.py --dados /tmp/visa_100k --saida resultados.json
+    python scripts/benchmark.py --dados /tmp/visa_100k --baseline resultados.json
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+
+def load_page(pattern: str, name: str):
+    """Importa um módulo de página (sem executar o main)"""
+    path = glob.glob(os.path.join(REPO_DIR, "pages", pattern))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def medir(func, repeticoes: int, preparar=None) -> dict:
+    """Executa a função N vezes e resume os tempos em milissegundos"""
+    tempos = []
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        func()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+
+    tempos.sort()
+    p95 = tempos[min(len(tempos) - 1, int(round(0.95 * (len(tempos) - 1))))]
+    return {
+        "repeticoes": repeticoes,
+        "min_ms": round(tempos[0], 3),
+        "mediana_ms": round(statistics.median(tempos), 3),
+        "p95_ms": round(p95, 3),
+        "media_ms": round(statistics.fmean(tempos), 3)
+    }
+
+def nova_inspecao(usuarios) -> tuple:
+    """Monta os dados de uma inspeção para create_inspecao"""
+    inspetor = usuarios[usuarios["perfil"] == "inspetor"].sample(1).iloc[0]
+    hoje = datetime.now().date()
+    dados = {
+        "estabelecimento": "Estabelecimento Benchmark",
+        "cnpj": "11.222.333/0001-81",
+        "atividade_principal": "Restaurante",
+        "classificacao_risco": random.choice(["alto", "medio", "baixo"]),
+        "data_inspecao": hoje,
+        "observacoes": "Inspeção criada pela suíte de benchmarks.",
+        "prazo_inspetor": hoje + timedelta(days=30),
+        "territorio": inspetor["territorio"]
+    }
+    return dados, int(inspetor["id"])
+
+def executar(args) -> dict:
+    """Prepara uma cópia dos dados e mede cada caminho quente"""
+    import pandas as pd
+
+    # Cópia descartável: create/update alteram os arquivos
+    workdir = tempfile.mkdtemp(prefix="visa_bench_")
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir)
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(args.dados, nome), data_dir)
+
+    # Os singletons usam caminhos relativos a data/
+    os.chdir(workdir)
+
+    from utils.auth import auth_manager
+    from utils.data_manager import data_manager
+    from utils.notifications import notification_manager
+
+    usuarios = pd.read_csv(os.path.join(data_dir, "usuarios.csv"))
+    gerente = usuarios[usuarios["perfil"] == "gerencia"].iloc[0].to_dict()
+    inspetor = usuarios[usuarios["perfil"] == "inspetor"].iloc[0].to_dict()
+
+    # Fora do servidor não há sessão: a checagem de login das páginas é ignorada
+    auth_manager.require_auth = lambda allowed_profiles=None: None
+
+    painel = load_page("04_*_Painel_Coordenacao.py", "painel_coordenacao")
+    indicadores = load_page("05_*_Indicadores.py", "indicadores")
+
+    ids = pd.read_csv(os.path.join(data_dir, "inspecoes.csv"), usecols=["id"])["id"].tolist()
+    df = data_manager.load_inspecoes()
+    random.seed(args.seed)
+    rep = args.repeticoes
+    rep_escrita = args.repeticoes_escrita
+
+    def limpar_cache():
+        data_manager._cache = None
+
+    benchmarks = {
+        "load_inspecoes": lambda: medir(data_manager.load_inspecoes, rep, limpar_cache),
+        "load_inspecoes_cache": lambda: medir(data_manager.load_inspecoes, rep),
+        "create_inspecao": lambda: medir(
+            lambda: data_manager.create_inspecao(*nova_inspecao(usuarios)), rep_escrita),
+        "update_inspecao": lambda: medir(
+            lambda: data_manager.update_inspecao(random.choice(ids), {"status": "concluido"}), rep_escrita),
+        "get_estatisticas": lambda: medir(
+            lambda: data_manager.get_estatisticas(gerente["id"], gerente["perfil"]), rep),
+        "get_notifications_gerencia": lambda: medir(
+            lambda: notification_manager.get_notifications(gerente["id"], gerente["perfil"]), rep),
+        "get_notifications_inspetor": lambda: medir(
+            lambda: notification_manager.get_notifications(inspetor["id"], inspetor["perfil"]), rep),
+        "get_inspector_stats": lambda: medir(painel.get_inspector_stats, rep),
+        "get_critical_processes": lambda: medir(painel.get_critical_processes, rep),
+        "calculate_kpis": lambda: medir(
+            lambda: indicadores.calculate_kpis(df, gerente["perfil"], gerente["id"]), rep)
+    }
+
+    selecionados = args.apenas.split(",") if args.apenas else list(benchmarks)
+    resultados = {}
+    for nome in selecionados:
+        resultados[nome] = benchmarks[nome]()
+        print(f"{nome:32s} mediana {resultados[nome]['mediana_ms']:10.2f} ms   "
+              f"p95 {resultados[nome]['p95_ms']:10.2f} ms")
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "linhas": len(ids),
+            "usuarios": len(usuarios),
+            "dados": os.path.abspath(args.dados),
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "maquina": platform.node()
+        },
+        "resultados": resultados
+    }
+
+def comparar(atual: dict, baseline: dict, tolerancia: float) -> list:
+    """Compara medianas com a baseline e retorna as regressões"""
+    regressoes = []
+    print(f"\n{'benchmark':32s} {'baseline':>12s} {'atual':>12s} {'razão':>8s}")
+    for nome, resultado in atual["resultados"].items():
+        base = baseline.get("resultados", {}).get(nome)
+        if not base or not base["mediana_ms"]:
+            continue
+        razao = resultado["mediana_ms"] / base["mediana_ms"]
+        marca = ""
+        if razao > 1 + tolerancia:
+            regressoes.append(nome)
+            marca = "  REGRESSÃO"
+        print(f"{nome:32s} {base['mediana_ms']:10.2f}ms {resultado['mediana_ms']:10.2f}ms {razao:7.2f}x{marca}")
+    return regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do Diário de Campo Digital")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    parser.add_argument("--repeticoes", type=int, default=10, help="Repetições das leituras")
+    parser.add_argument("--repeticoes-escrita", type=int, default=5, help="Repetições das escritas")
+    parser.add_argument("--apenas", help="Benchmarks separados por vírgula")
+    parser.add_argument("--seed", type=int, default=42, help="Semente aleatória")
+    parser.add_argument("--saida", help="Arquivo JSON para gravar os resultados")
+    parser.add_argument("--baseline", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="Piora relativa aceita antes de acusar regressão (0.2 = 20%%)")
+    args = parser.parse_args()
+    # O benchmark muda de diretório; fixar os caminhos antes
+    args.dados = os.path.abspath(args.dados)
+    args.saida = os.path.abspath(args.saida) if args.saida else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    resultado = executar(args)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados gravados em {args.saida}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressoes = comparar(resultado, baseline, args.tolerancia)
+        if regressoes:
+            print(f"\n{len(regressoes)} regressão(ões): {', '.join(regressoes)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Gerador de dados sintéticos de inspeções e usuários
+
+Produz um diretório com inspecoes.csv e usuarios.csv no mesmo formato de
+data/, para medir o sistema em escala (10k, 100k, 1M linhas...).
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 100000 --saida /tmp/visa_100k
+    python scripts/gerar_dados_sinteticos.py --linhas 10k --inspetores 40 \\
+        --territorios Norte,Sul,Leste,Oeste,Centro --mix-risco alto=0.2,medio=0.5,baixo=0.3
+
+Senhas dos usuários gerados: admin123 (gerência), coord123 (coordenadores)
+e insp123 (inspetores), como nos usuários de teste.
+"""
+import argparse
+import hashlib
+import os
+import uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+ATIVIDADES = [
+    "Restaurante", "Lanchonete", "Padaria", "Supermercado", "Mercado",
+    "Farmácia", "Drogaria", "Açougue", "Peixaria", "Bar",
+    "Clínica", "Laboratório", "Creche", "Escola", "Hotel",
+    "Academia", "Salão de Beleza", "Distribuidora", "Indústria de Alimentos", "Feira"
+]
+
+def parse_linhas(valor: str) -> int:
+    """Aceita contagens como 10000, 10k ou 1M"""
+    valor = valor.strip().lower()
+    multiplicador = 1
+    if valor.endswith("k"):
+        multiplicador, valor = 1_000, valor[:-1]
+    elif valor.endswith("m"):
+        multiplicador, valor = 1_000_000, valor[:-1]
+    return int(float(valor) * multiplicador)
+
+def parse_mix(valor: str) -> dict:
+    """Converte 'alto=0.2,medio=0.5,baixo=0.3' em probabilidades normalizadas"""
+    mix = {}
+    for parte in valor.split(","):
+        nome, peso = parte.split("=")
+        mix[nome.strip()] = float(peso)
+    total = sum(mix.values())
+    return {nome: peso / total for nome, peso in mix.items()}
+
+def hash_password(password: str) -> str:
+    """Mesmo hash SHA256 usado pelo AuthManager"""
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+def gerar_usuarios(inspetores: int, territorios: list) -> pd.DataFrame:
+    """Gera gerência, um coordenador por território e os inspetores"""
+    usuarios = [{
+        "id": 1, "username": "admin", "password": hash_password("admin123"),
+        "nome": "Administrador", "perfil": "gerencia", "territorio": "Todos", "ativo": True
+    }]
+
+    for i, territorio in enumerate(territorios, start=1):
+        usuarios.append({
+            "id": len(usuarios) + 1, "username": f"coord{i}", "password": hash_password("coord123"),
+            "nome": f"Coordenador {territorio}", "perfil": "coordenador",
+            "territorio": territorio, "ativo": True
+        })
+
+    for i in range(1, inspetores + 1):
+        usuarios.append({
+            "id": len(usuarios) + 1, "username": f"insp{i}", "password": hash_password("insp123"),
+            "nome": f"Inspetor {i:03d}", "perfil": "inspetor",
+            "territorio": territorios[(i - 1) % len(territorios)], "ativo": True
+        })
+
+    return pd.DataFrame(usuarios)
+
+def gerar_inspecoes(linhas: int, usuarios: pd.DataFrame, args, rng) -> pd.DataFrame:
+    """Gera as inspeções de forma vetorizada"""
+    hoje = pd.Timestamp(datetime.now().date())
+
+    inspetores = usuarios[usuarios["perfil"] == "inspetor"]
+    idx_inspetor = rng.integers(0, len(inspetores), linhas)
+    inspetor_id = inspetores["id"].to_numpy()[idx_inspetor]
+    territorio = inspetores["territorio"].to_numpy()[idx_inspetor]
+
+    # Estabelecimentos se repetem (reinspeções): um CNPJ por estabelecimento
+    n_estab = max(linhas // 3, 1)
+    estab = rng.integers(0, n_estab, linhas)
+    cnpj_base = 10_000_000_000_000 + estab * 7919
+    cnpj = pd.Series(cnpj_base).astype(str).str.zfill(14)
+    cnpj = (cnpj.str[:2] + "." + cnpj.str[2:5] + "." + cnpj.str[5:8] + "/" +
+            cnpj.str[8:12] + "-" + cnpj.str[12:])
+    atividade = np.array(ATIVIDADES)[estab % len(ATIVIDADES)]
+    estabelecimento = pd.Series(atividade).str.cat(pd.Series(estab).astype(str), sep=" ")
+
+    mix = args.mix_risco
+    risco = rng.choice(list(mix.keys()), linhas, p=list(mix.values()))
+
+    # Datas de inspeção espalhadas pelos últimos N dias
+    dias_atras = rng.integers(0, args.historico_dias, linhas)
+    data_inspecao = hoje - pd.to_timedelta(dias_atras, unit="D")
+
+    # Prazo do inspetor: distribuição discreta de dias, parte sem prazo
+    prazo_dias = rng.choice(args.prazo_dias, linhas)
+    prazo_inspetor = pd.Series(data_inspecao + pd.to_timedelta(prazo_dias, unit="D"))
+    prazo_inspetor[rng.random(linhas) < args.fracao_sem_prazo] = pd.NaT
+
+    prazo_coordenacao = pd.Series(data_inspecao + pd.to_timedelta(prazo_dias + 15, unit="D"))
+    prazo_coordenacao[rng.random(linhas) >= args.fracao_prazo_coordenacao] = pd.NaT
+
+    # Inspeções antigas têm mais chance de estarem concluídas
+    idade = dias_atras / max(args.historico_dias, 1)
+    concluida = rng.random(linhas) < np.clip(args.fracao_concluidas + (idade - 0.5), 0, 1)
+    status = np.where(concluida, "concluido", "pendente")
+
+    data_criacao = pd.Series(data_inspecao + pd.to_timedelta(rng.integers(8, 18, linhas), unit="h"))
+    dias_conclusao = rng.gamma(2.0, 10.0, linhas).astype(int)
+    data_atualizacao = data_criacao + pd.to_timedelta(np.where(concluida, dias_conclusao, 0), unit="D")
+    data_atualizacao = data_atualizacao.where(data_atualizacao <= pd.Timestamp(datetime.now()),
+                                              pd.Timestamp(datetime.now()))
+
+    ids = rng.bytes(16 * linhas)
+    ids = [str(uuid.UUID(bytes=ids[i:i + 16], version=4)) for i in range(0, 16 * linhas, 16)]
+
+    return pd.DataFrame({
+        "id": ids,
+        "estabelecimento": estabelecimento,
+        "cnpj": cnpj,
+        "atividade_principal": atividade,
+        "classificacao_risco": risco,
+        "data_inspecao": data_inspecao.strftime("%Y-%m-%d"),
+        "observacoes": "Inspeção de rotina. Orientações sobre boas práticas de manipulação e armazenamento.",
+        "prazo_inspetor": prazo_inspetor.dt.strftime("%Y-%m-%d"),
+        "prazo_coordenacao": prazo_coordenacao.dt.strftime("%Y-%m-%d"),
+        "status": status,
+        "inspetor_id": inspetor_id,
+        "territorio": territorio,
+        "data_criacao": data_criacao,
+        "data_atualizacao": data_atualizacao,
+        "comentarios_internos": ""
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera dados sintéticos de inspeções")
+    parser.add_argument("--linhas", type=parse_linhas, default=parse_linhas("10k"),
+                        help="Número de inspeções (ex.: 10k, 100k, 1M)")
+    parser.add_argument("--inspetores", type=int, default=30, help="Número de inspetores")
+    parser.add_argument("--territorios", default="Norte,Sul,Leste,Oeste,Centro",
+                        help="Territórios separados por vírgula")
+    parser.add_argument("--mix-risco", type=parse_mix, default=parse_mix("alto=0.2,medio=0.5,baixo=0.3"),
+                        help="Proporção de cada classificação de risco")
+    parser.add_argument("--prazo-dias", type=lambda v: [int(d) for d in v.split(",")],
+                        default=[15, 30, 30, 60, 90], help="Dias de prazo do inspetor (sorteados)")
+    parser.add_argument("--fracao-sem-prazo", type=float, default=0.2,
+                        help="Fração de inspeções sem prazo do inspetor")
+    parser.add_argument("--fracao-prazo-coordenacao", type=float, default=0.3,
+                        help="Fração de inspeções com prazo da coordenação")
+    parser.add_argument("--fracao-concluidas", type=float, default=0.7,
+                        help="Fração média de inspeções concluídas")
+    parser.add_argument("--historico-dias", type=int, default=3 * 365,
+                        help="Período coberto pelas datas de inspeção")
+    parser.add_argument("--seed", type=int, default=42, help="Semente aleatória")
+    parser.add_argument("--saida", required=True, help="Diretório de saída")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    territorios = [t.strip() for t in args.territorios.split(",") if t.strip()]
+
+    os.makedirs(args.saida, exist_ok=True)
+    usuarios = gerar_usuarios(args.inspetores, territorios)
+    usuarios.to_csv(os.path.join(args.saida, "usuarios.csv"), index=False)
+
+    inspecoes = gerar_inspecoes(args.linhas, usuarios, args, rng)
+    inspecoes.to_csv(os.path.join(args.saida, "inspecoes.csv"), index=False)
+
+    print(f"{len(inspecoes)} inspeções e {len(usuarios)} usuários gravados em {args.saida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Job noturno dos snapshots das visões padrão dos Indicadores
+
+Calcula KPIs, gráficos e tabela detalhada das visões padrão (todos os
+territórios) e publica uma nova versão em data/relatorios/, que os
+Indicadores servem durante o dia (ver utils/relatorios_noturnos.py).
+
+Os períodos são relativos à data: agende depois da meia-noite e depois do
+arquivamento, por exemplo no cron:
+    30 2 * * * cd /srv/diario_visat && python scripts/arquivar_inspecoes.py && python scripts/gerar_relatorios_noturnos.py
+
+Uso:
+    python scripts/gerar_relatorios_noturnos.py --manter 7
+"""
+import argparse
+import os
+import sys
+import time
+
+# Adicionar o diretório pai ao path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use("Agg")
+
+from utils.data_manager import DataManager
+from utils.relatorios_noturnos import RelatoriosNoturnos, PERIODOS_PADRAO
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera os snapshots noturnos dos Indicadores")
+    parser.add_argument("--data-dir", default="data", help="Diretório dos dados")
+    parser.add_argument("--periodos", default=",".join(PERIODOS_PADRAO),
+                        help="Visões a calcular, separadas por vírgula")
+    parser.add_argument("--manter", type=int, default=7, help="Versões mantidas em disco")
+    args = parser.parse_args()
+
+    periodos = [p.strip() for p in args.periodos.split(",") if p.strip()]
+    desconhecidos = [p for p in periodos if p not in PERIODOS_PADRAO]
+    if desconhecidos:
+        parser.error(f"períodos desconhecidos: {', '.join(desconhecidos)}")
+
+    manager = DataManager(args.data_dir)
+    relatorios = RelatoriosNoturnos(os.path.join(args.data_dir, "relatorios"))
+    inicio = time.perf_counter()
+    destino = relatorios.gerar(manager, periodos)
+    removidas = relatorios.limpar(args.manter)
+
+    print(f"{len(periodos)} visão(ões) gravada(s) em {destino} em {time.perf_counter() - inicio:.1f} s; "
+          f"{removidas} versão(ões) antiga(s) removida(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Inicia o servidor Streamlit com o aquecimento já na partida
+
+Com `streamlit run app.py`, nada do aplicativo roda antes da primeira
+sessão: o aquecimento (utils/aquecimento.py) e o endpoint de métricas só
+começam quando alguém abre a página de login. Este script liga os dois no
+próprio processo do servidor e então executa o `streamlit run`; os scripts
+das páginas encontram os módulos já importados e os dados já carregados.
+
+Deve ser executado do diretório do projeto, como o `streamlit run`:
+    python scripts/servidor.py --server.port 8501 --server.headless true
+
+O balanceador consulta http://127.0.0.1:9464/pronto (VISA_METRICS_PORT).
+"""
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# O mesmo caminho que app.py acrescenta: os módulos de utils são compartilhados
+sys.path.append(REPO_DIR)
+
+def main():
+    from utils.metrics_exporter import metrics_exporter
+    from utils.aquecimento import aquecimento
+    metrics_exporter.start()
+    aquecimento.iniciar()
+
+    from streamlit.web import cli
+    sys.argv = ["streamlit", "run", os.path.join(REPO_DIR, "app.py")] + sys.argv[1:]
+    cli.main(prog_name="streamlit")
+
+if __name__ == "__main__":
+    main()
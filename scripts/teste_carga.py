@@ -0,0 +1,447 @@
+"""
+Teste de carga com sessões simultâneas (sem navegador)
+
+Simula N usuários ao mesmo tempo com o AppTest do Streamlit: cada usuário
+faz login pelo app.py, cadastra inspeções na Nova Inspeção, filtra Minhas
+Inspeções e abre os Indicadores. Todas as sessões rodam no mesmo processo,
+compartilhando as instâncias globais (DataManager, métricas...), como no
+servidor.
+
+Ao final informa os percentis de latência dos reruns por ação, a vazão e
+quantas inspeções confirmadas na tela não chegaram ao arquivo (escritas
+perdidas). Sai com código 1 se houver algum erro ou escrita perdida
+(limites em --max-erros e --max-perdidas).
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 10k --saida /tmp/visa_10k
+    python scripts/teste_carga.py --dados /tmp/visa_10k --usuarios 20 --iteracoes 5
+    python scripts/teste_carga.py --dados /tmp/visa_10k --usuarios 50 \\
+        --mix inspetor=0.7,coordenador=0.2,gerencia=0.1 --saida carga.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+import warnings
+from collections import defaultdict
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+
+# Senhas dos usuários gerados por scripts/gerar_dados_sinteticos.py
+SENHAS = {
+    "gerencia": "admin123",
+    "coordenador": "coord123",
+    "inspetor": "insp123"
+}
+
+# CNPJ válido usado nos cadastros do teste
+CNPJ_TESTE = "11.222.333/0001-81"
+
+def page_path(pattern: str) -> str:
+    """Caminho de uma página (os nomes têm emoji)"""
+    return glob.glob(os.path.join(REPO_DIR, "pages", pattern))[0]
+
+def parse_mix(valor: str) -> dict:
+    """Converte 'inspetor=0.7,coordenador=0.2,gerencia=0.1' em probabilidades"""
+    mix = {}
+    for parte in valor.split(","):
+        nome, peso = parte.split("=")
+        mix[nome.strip()] = float(peso)
+    total = sum(mix.values())
+    return {nome: peso / total for nome, peso in mix.items()}
+
+def percentil(tempos: list, q: float) -> float:
+    """Percentil q (0-1) de uma lista já ordenada"""
+    return tempos[min(len(tempos) - 1, int(round(q * (len(tempos) - 1))))]
+
+def widget(elementos, rotulo: str):
+    """Localiza um widget pelo início do rótulo"""
+    for elemento in elementos:
+        if elemento.label.startswith(rotulo):
+            return elemento
+    raise LookupError(f"Widget não encontrado: {rotulo}")
+
+def fixar_runtime():
+    """Usa um único runtime simulado para todas as sessões
+
+    O AppTest cria e descarta o runtime global a cada rerun; com várias
+    sessões rodando ao mesmo tempo, uma sessão apagaria o runtime de outra
+    no meio do script. Também compartilha o cache de bytecode dos scripts e
+    espera o fim de cada rerun, como o servidor faz.
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    from streamlit import source_util
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    compartilhado = MagicMock(spec=Runtime)
+    compartilhado.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    compartilhado.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: compartilhado)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    # O cache de páginas também é global e ignora o script principal: uma sessão
+    # em app.py faria outra, aberta em uma página, executar o app.py
+    get_pages = source_util.get_pages
+    paginas = {}
+    lock = threading.Lock()
+
+    def get_pages_por_script(main_script_path):
+        with lock:
+            if main_script_path not in paginas:
+                with source_util._pages_cache_lock:
+                    source_util._cached_pages = None
+                paginas[main_script_path] = get_pages(main_script_path)
+            return paginas[main_script_path]
+
+    source_util.get_pages = get_pages_por_script
+
+    # Cada rerun do AppTest cria o seu cache de bytecode e compila o script
+    # de novo. Compilações simultâneas às vezes falham no CPython 3.11 ("AST
+    # constructor recursion depth mismatch") e a sessão recebe uma página
+    # vazia, sem exceção: um login válido parecia recusado. O servidor
+    # compila cada script uma vez, no cache do Runtime.
+    cache_scripts = ScriptCache()
+    local_script_runner.ScriptCache = lambda: cache_scripts
+
+    # O AppTest volta assim que o script para e lê em seguida o evento
+    # SHUTDOWN, que sob carga ainda não chegou (KeyError: 'client_state'),
+    # ou o script ainda está no rerun pedido por st.rerun() (login)
+    aguardar = local_script_runner.require_widgets_deltas
+
+    def aguardar_fim(runner, timeout: float = 3):
+        aguardar(runner, timeout)
+        limite = time.time() + timeout
+        while ScriptRunnerEvent.SHUTDOWN not in runner.events:
+            if time.time() > limite:
+                raise RuntimeError(f"Rerun do AppTest passou de {timeout} s")
+            time.sleep(0.01)
+
+    local_script_runner.require_widgets_deltas = aguardar_fim
+
+class Resultados:
+    """Acumula as medições de todas as sessões (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tempos = defaultdict(list)
+        self.erros = defaultdict(int)
+        self.mensagens_erro = []
+        self.criadas = []
+
+    def registrar(self, acao: str, ms: float, erro: str = None):
+        with self._lock:
+            self.tempos[acao].append(ms)
+            if erro:
+                self.erros[acao] += 1
+                if len(self.mensagens_erro) < 20:
+                    self.mensagens_erro.append(f"{acao}: {erro}")
+
+    def registrar_criacao(self, marcador: str):
+        with self._lock:
+            self.criadas.append(marcador)
+
+class UsuarioVirtual:
+    """Uma sessão do navegador: login e navegação pelas páginas"""
+
+    def __init__(self, numero: int, usuario: dict, resultados: Resultados, args, execucao: str):
+        self.numero = numero
+        self.usuario = usuario
+        self.resultados = resultados
+        self.args = args
+        self.execucao = execucao
+        self.user = None
+        self.rng = random.Random(args.seed + numero)
+
+    def _rodar(self, acao: str, at, interacao=None):
+        """Executa um rerun (e a interação seguinte, se houver) e mede cada um"""
+        for passo in ([at.run] + ([lambda: interacao(at)] if interacao else [])):
+            inicio = time.perf_counter()
+            erro = None
+            try:
+                passo()
+                if at.exception:
+                    erro = at.exception[0].message
+                elif not at.main.children:
+                    # Erro de compilação e afins: o AppTest devolve a página vazia, sem exceção
+                    erro = "página vazia (o script não rodou)"
+            except Exception as e:
+                erro = f"{type(e).__name__}: {e}"
+                # Mensagem de erro exibida pela página, se houver (ajuda a achar a causa)
+                try:
+                    if at.error:
+                        erro += f" (página: {at.error[0].value[:120]})"
+                except Exception:
+                    pass
+            self.resultados.registrar(acao, (time.perf_counter() - inicio) * 1000, erro)
+            if erro:
+                return at, erro
+        return at, None
+
+    def _pagina(self, path: str):
+        from streamlit.testing.v1 import AppTest
+        at = AppTest.from_file(path, default_timeout=self.args.timeout)
+        at.session_state["user"] = self.user
+        return at
+
+    def login(self) -> bool:
+        """Login pelo formulário do app.py"""
+        from streamlit.testing.v1 import AppTest
+        at = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=self.args.timeout)
+
+        def entrar(at):
+            widget(at.text_input, "👤 Usuário").input(self.usuario["username"])
+            widget(at.text_input, "🔒 Senha").input(SENHAS[self.usuario["perfil"]])
+            # O rerun pedido pelo st.rerun() do login roda no mesmo passo (ver fixar_runtime)
+            widget(at.button, "🚀 Entrar").click().run()
+
+        at, erro = self._rodar("login", at, entrar)
+        if erro or "user" not in at.session_state:
+            if not erro:
+                mensagens = [e.value for e in at.error] + [w.value for w in at.warning]
+                self.resultados.registrar("login", 0.0, f"usuário ou senha recusados "
+                                          f"({self.usuario['username']}: {' '.join(mensagens) or 'sem mensagem'})")
+            return False
+        self.user = at.session_state["user"]
+        return True
+
+    def nova_inspecao(self, iteracao: int):
+        """Cadastra uma inspeção com um marcador único no nome"""
+        marcador = f"Carga {self.execucao} u{self.numero} i{iteracao}"
+        at = self._pagina(page_path("02_*_Nova_Inspecao.py"))
+
+        def salvar(at):
+            widget(at.text_input, "Nome do Estabelecimento").input(marcador)
+            widget(at.text_input, "Atividade Principal").input("Restaurante")
+            widget(at.text_input, "CNPJ").input(CNPJ_TESTE)
+            widget(at.selectbox, "Classificação de Risco").select(self.rng.choice(["Baixo", "Médio", "Alto"]))
+            widget(at.text_area, "Observações da Inspeção").input(
+                "Inspeção cadastrada pelo teste de carga do sistema.")
+            widget(at.button, "💾 Salvar Inspeção").click().run()
+
+        at, erro = self._rodar("nova_inspecao", at, salvar)
+        if not erro and any("cadastrada com sucesso" in s.value for s in at.success):
+            self.resultados.registrar_criacao(marcador)
+
+    def minhas_inspecoes(self):
+        """Abre Minhas Inspeções e aplica filtros de risco e status"""
+        at = self._pagina(page_path("03_*_Minhas_Inspecoes.py"))
+
+        def filtrar(at):
+            if not at.selectbox:
+                # Sem inspeções visíveis: a página não mostra os filtros
+                return
+            widget(at.selectbox, "⚠️ Risco").select(self.rng.choice(["Todos", "Alto", "Médio", "Baixo"]))
+            widget(at.selectbox, "📊 Status").select(
+                self.rng.choice(["Todos", "Pendente", "Vencido", "Próximo Vencimento", "Concluído"]))
+            at.run()
+
+        self._rodar("minhas_inspecoes", at, filtrar)
+
+    def indicadores(self):
+        """Abre os Indicadores e troca o período"""
+        at = self._pagina(page_path("05_*_Indicadores.py"))
+
+        def periodo(at):
+            widget(at.selectbox, "Período").select(
+                self.rng.choice(["Último mês", "Últimos 3 meses", "Último ano"])).run()
+
+        self._rodar("indicadores", at, periodo)
+
+    def executar(self, barreira: threading.Barrier):
+        """Roteiro completo da sessão"""
+        barreira.wait()
+        try:
+            if not self.login():
+                return
+            for i in range(self.args.iteracoes):
+                self.nova_inspecao(i)
+                self._pausa()
+                self.minhas_inspecoes()
+                self._pausa()
+                self.indicadores()
+                self._pausa()
+        except Exception:
+            self.resultados.registrar("sessao", 0.0, traceback.format_exc(limit=3))
+
+    def _pausa(self):
+        """Tempo de leitura entre as ações (com variação)"""
+        if self.args.pausa > 0:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.args.pausa)
+
+def escolher_usuarios(usuarios, quantidade: int, mix: dict, rng: random.Random) -> list:
+    """Sorteia os perfis pelo mix e distribui as contas de cada perfil"""
+    por_perfil = {perfil: grupo.to_dict("records") for perfil, grupo in usuarios.groupby("perfil")}
+    perfis = [p for p in mix if p in por_perfil]
+    pesos = [mix[p] for p in perfis]
+    escolhidos = []
+    contadores = defaultdict(int)
+    for _ in range(quantidade):
+        perfil = rng.choices(perfis, pesos)[0]
+        contas = por_perfil[perfil]
+        escolhidos.append(contas[contadores[perfil] % len(contas)])
+        contadores[perfil] += 1
+    return escolhidos
+
+def executar(args) -> dict:
+    """Prepara uma cópia dos dados, dispara as sessões e resume os resultados"""
+    import pandas as pd
+
+    # Cópia descartável: os cadastros alteram os arquivos
+    workdir = tempfile.mkdtemp(prefix="visa_carga_")
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir)
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(args.dados, nome), data_dir)
+
+    # Os singletons usam caminhos relativos a data/
+    os.chdir(workdir)
+    # Sem endpoint de métricas durante o teste (evita disputar a porta do servidor)
+    os.environ.setdefault("VISA_METRICS_PORT", "0")
+
+    usuarios = pd.read_csv(os.path.join(data_dir, "usuarios.csv"))
+    linhas_antes = len(pd.read_csv(os.path.join(data_dir, "inspecoes.csv"), usecols=["id"]))
+
+    fixar_runtime()
+
+    rng = random.Random(args.seed)
+    escolhidos = escolher_usuarios(usuarios, args.usuarios, args.mix, rng)
+    execucao = uuid.uuid4().hex[:6]
+    resultados = Resultados()
+
+    sessoes = [UsuarioVirtual(i, u, resultados, args, execucao) for i, u in enumerate(escolhidos)]
+    barreira = threading.Barrier(len(sessoes))
+    threads = [threading.Thread(target=s.executar, args=(barreira,), name=f"usuario-{s.numero}")
+               for s in sessoes]
+
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    # Escritas perdidas: confirmadas na tela mas ausentes do arquivo
+    final = pd.read_csv(os.path.join(data_dir, "inspecoes.csv"), usecols=["id", "estabelecimento"])
+    gravadas = set(final["estabelecimento"][final["estabelecimento"].str.startswith(f"Carga {execucao} ", na=False)])
+    perdidas = [m for m in resultados.criadas if m not in gravadas]
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    acoes = {}
+    total_reruns = 0
+    for acao, tempos in sorted(resultados.tempos.items()):
+        tempos = sorted(tempos)
+        total_reruns += len(tempos)
+        acoes[acao] = {
+            "reruns": len(tempos),
+            "erros": resultados.erros.get(acao, 0),
+            "p50_ms": round(percentil(tempos, 0.50), 1),
+            "p95_ms": round(percentil(tempos, 0.95), 1),
+            "p99_ms": round(percentil(tempos, 0.99), 1),
+            "media_ms": round(statistics.fmean(tempos), 1),
+            "max_ms": round(tempos[-1], 1)
+        }
+
+    perfis = defaultdict(int)
+    for u in escolhidos:
+        perfis[u["perfil"]] += 1
+
+    return {
+        "meta": {
+            "usuarios": args.usuarios,
+            "perfis": dict(perfis),
+            "iteracoes": args.iteracoes,
+            "pausa_s": args.pausa,
+            "linhas_iniciais": linhas_antes,
+            "dados": os.path.abspath(args.dados),
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "maquina": platform.node()
+        },
+        "duracao_s": round(duracao, 2),
+        "reruns": total_reruns,
+        "vazao_reruns_s": round(total_reruns / duracao, 2) if duracao else 0.0,
+        "acoes": acoes,
+        "escritas": {
+            "confirmadas": len(resultados.criadas),
+            "gravadas": len(gravadas),
+            "perdidas": len(perdidas)
+        },
+        "erros": resultados.mensagens_erro
+    }
+
+def imprimir(resultado: dict):
+    """Resumo legível no terminal"""
+    meta = resultado["meta"]
+    perfis = ", ".join(f"{n} {p}" for p, n in sorted(meta["perfis"].items()))
+    print(f"\n{meta['usuarios']} sessões ({perfis}), {meta['iteracoes']} iteração(ões), "
+          f"{meta['linhas_iniciais']} inspeções iniciais")
+    print(f"\n{'ação':20s} {'reruns':>7s} {'erros':>6s} {'p50':>10s} {'p95':>10s} {'p99':>10s} {'máx':>10s}")
+    for acao, a in resultado["acoes"].items():
+        print(f"{acao:20s} {a['reruns']:7d} {a['erros']:6d} {a['p50_ms']:8.1f}ms {a['p95_ms']:8.1f}ms "
+              f"{a['p99_ms']:8.1f}ms {a['max_ms']:8.1f}ms")
+    escritas = resultado["escritas"]
+    print(f"\nDuração: {resultado['duracao_s']:.1f} s   Vazão: {resultado['vazao_reruns_s']:.1f} reruns/s")
+    print(f"Cadastros confirmados: {escritas['confirmadas']}   gravados: {escritas['gravadas']}   "
+          f"perdidos: {escritas['perdidas']}")
+    for mensagem in resultado["erros"]:
+        print(f"  erro: {mensagem.strip()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do Diário de Campo Digital")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    parser.add_argument("--usuarios", type=int, default=10, help="Sessões simultâneas")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("inspetor=0.7,coordenador=0.2,gerencia=0.1"),
+                        help="Proporção de cada perfil")
+    parser.add_argument("--iteracoes", type=int, default=3, help="Repetições do roteiro por sessão")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Pausa média entre ações, em segundos")
+    parser.add_argument("--timeout", type=float, default=120, help="Tempo máximo de um rerun, em segundos")
+    parser.add_argument("--seed", type=int, default=42, help="Semente aleatória")
+    parser.add_argument("--saida", help="Arquivo JSON para gravar os resultados")
+    parser.add_argument("--max-perdidas", type=int, default=0,
+                        help="Sai com código 1 se houver mais escritas perdidas que isso")
+    parser.add_argument("--max-erros", type=int, default=0,
+                        help="Sai com código 1 se houver mais erros (reruns, logins, sessões) que isso")
+    args = parser.parse_args()
+    # O teste muda de diretório; fixar os caminhos antes
+    args.dados = os.path.abspath(args.dados)
+    args.saida = os.path.abspath(args.saida) if args.saida else None
+
+    # Avisos do AppTest sobre o runtime simulado poluem a saída
+    warnings.filterwarnings("ignore")
+
+    resultado = executar(args)
+    imprimir(resultado)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados gravados em {args.saida}")
+
+    erros = sum(acao["erros"] for acao in resultado["acoes"].values())
+    if erros > args.max_erros or resultado["escritas"]["perdidas"] > args.max_perdidas:
+        print(f"\nFALHOU: {erros} erro(s), {resultado['escritas']['perdidas']} escrita(s) perdida(s)")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
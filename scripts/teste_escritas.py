@@ -0,0 +1,254 @@
+"""
+Teste de escritas concorrentes no arquivo de inspeções
+
+Dispara N escritores que cadastram e atualizam inspeções ao mesmo tempo,
+enquanto leitores carregam o arquivo sem parar. Os escritores podem ser
+processos (vários workers do servidor) ou threads de um mesmo processo
+(várias sessões de um servidor, onde as escritas são agrupadas em lotes).
+Mede a vazão, a latência, quantas gravações do arquivo foram feitas, as
+escritas perdidas (confirmadas mas ausentes do arquivo) e as leituras que
+falharam ou encontraram o arquivo pela metade.
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 10k --saida /tmp/visa_10k
+    python scripts/teste_escritas.py --dados /tmp/visa_10k --escritores 50 --escritas 10
+    python scripts/teste_escritas.py --dados /tmp/visa_10k --escritores 50 --modo threads
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+
+def percentil(tempos: list, q: float) -> float:
+    """Percentil q (0-1) de uma lista já ordenada"""
+    return tempos[min(len(tempos) - 1, int(round(q * (len(tempos) - 1))))]
+
+def escrever(numero: int, escritas: int, ids: list) -> dict:
+    """Alterna cadastros e atualizações e mede cada escrita"""
+    from utils.data_manager import data_manager, ConflitoVersao
+
+    rng = random.Random(numero)
+    tempos = []
+    confirmadas = []
+    falhas = 0
+    conflitos = 0
+    for i in range(escritas):
+        inicio = time.perf_counter()
+        if i % 2 == 0:
+            marcador = f"Escrita w{numero} i{i}"
+            ok = data_manager.create_inspecao({
+                "estabelecimento": marcador,
+                "cnpj": "11.222.333/0001-81",
+                "atividade_principal": "Restaurante",
+                "classificacao_risco": rng.choice(["alto", "medio", "baixo"]),
+                "data_inspecao": datetime.now().date(),
+                "observacoes": "Inspeção criada pelo teste de escritas concorrentes.",
+                "prazo_inspetor": None,
+                "territorio": "Norte"
+            }, 1000 + numero)
+        else:
+            # Atualização condicional: versão lida do cache, como na tela de edição
+            marcador = None
+            inspecao_id = rng.choice(ids)
+            try:
+                ok = data_manager.update_inspecao(inspecao_id, {"status": "concluido"},
+                                                  expected_version=data_manager.get_versao(inspecao_id))
+            except ConflitoVersao:
+                conflitos += 1
+                ok = True
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        if ok and marcador:
+            confirmadas.append(marcador)
+        elif not ok:
+            falhas += 1
+    return {"tempos": tempos, "confirmadas": confirmadas, "falhas": falhas, "conflitos": conflitos}
+
+def gravacoes_do_processo() -> dict:
+    """Gravações do arquivo feitas por este processo (uma por lote)"""
+    from utils.metrics import metrics
+    stats = metrics.snapshot().get("DataManager._aplicar_alteracoes")
+    return {"gravacoes": stats.count if stats else 0, "bytes_gravados": stats.bytes_written if stats else 0}
+
+def escritor(numero: int, workdir: str, escritas: int, ids: list, largada, fila):
+    """Processo escritor"""
+    warnings.filterwarnings("ignore")
+    os.chdir(workdir)
+    import utils.data_manager  # noqa: F401 (importado antes da largada)
+    # Fora do servidor o Streamlit avisa a cada st.*; não poluir a saída
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    largada.wait()
+    resultado = escrever(numero, escritas, ids)
+    resultado.update(gravacoes_do_processo())
+    fila.put(resultado)
+
+def leitor(workdir: str, parar, fila):
+    """Processo leitor: lê o arquivo continuamente e confere a estrutura"""
+    warnings.filterwarnings("ignore")
+    os.chdir(workdir)
+    import pandas as pd
+
+    leituras = 0
+    erros = 0
+    while not parar.is_set():
+        try:
+            df = pd.read_csv(os.path.join("data", "inspecoes.csv"))
+            # Arquivo pela metade: colunas faltando ou linhas incompletas
+            if "status" not in df.columns or df["inspetor_id"].isna().any():
+                erros += 1
+        except Exception:
+            erros += 1
+        leituras += 1
+    fila.put({"leituras": leituras, "erros_leitura": erros})
+
+def executar(args) -> dict:
+    """Prepara uma cópia dos dados, dispara escritores e leitores e resume"""
+    import pandas as pd
+
+    workdir = tempfile.mkdtemp(prefix="visa_escritas_")
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir)
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(args.dados, nome), data_dir)
+
+    ids = pd.read_csv(os.path.join(data_dir, "inspecoes.csv"), usecols=["id"])["id"].tolist()
+    linhas_antes = len(ids)
+
+    ctx = mp.get_context("spawn")
+    parar = ctx.Event()
+    fila_leitores = ctx.Queue()
+    leitores = [ctx.Process(target=leitor, args=(workdir, parar, fila_leitores))
+                for _ in range(args.leitores)]
+    for p in leitores:
+        p.start()
+
+    if args.modo == "threads":
+        # Escritores como sessões de um mesmo servidor: um DataManager compartilhado
+        os.chdir(workdir)
+        import utils.data_manager  # noqa: F401
+        logging.getLogger("streamlit").setLevel(logging.ERROR)
+        resultados = [None] * args.escritores
+        largada = threading.Barrier(args.escritores + 1)
+
+        def rodar(numero):
+            largada.wait()
+            resultados[numero] = escrever(numero, args.escritas, ids)
+
+        threads = [threading.Thread(target=rodar, args=(i,)) for i in range(args.escritores)]
+        for t in threads:
+            t.start()
+        largada.wait()
+        inicio = time.perf_counter()
+        for t in threads:
+            t.join()
+        duracao = time.perf_counter() - inicio
+        resultados[0].update(gravacoes_do_processo())
+        os.chdir(REPO_DIR)
+    else:
+        largada = ctx.Barrier(args.escritores + 1)
+        fila_escritores = ctx.Queue()
+        escritores = [ctx.Process(target=escritor, args=(i, workdir, args.escritas, ids, largada, fila_escritores))
+                      for i in range(args.escritores)]
+        for p in escritores:
+            p.start()
+
+        # Todos os escritores já importaram o DataManager: começa a medição
+        largada.wait()
+        inicio = time.perf_counter()
+        resultados = [fila_escritores.get() for _ in escritores]
+        duracao = time.perf_counter() - inicio
+        for p in escritores:
+            p.join()
+
+    parar.set()
+    leituras = [fila_leitores.get() for _ in leitores]
+    for p in leitores:
+        p.join()
+
+    # Estado final como a aplicação o vê (com VISA_STORAGE=journal, snapshot + journal)
+    from utils.data_manager import DataManager
+    final = DataManager(data_dir)._read_inspecoes()
+    gravadas = set(final["estabelecimento"])
+    confirmadas = [m for r in resultados for m in r["confirmadas"]]
+    perdidas = [m for m in confirmadas if m not in gravadas]
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    tempos = sorted(t for r in resultados for t in r["tempos"])
+    total = len(tempos)
+    gravacoes = sum(r.get("gravacoes", 0) for r in resultados)
+    bytes_gravados = sum(r.get("bytes_gravados", 0) for r in resultados)
+    return {
+        "meta": {
+            "modo": args.modo,
+            "escritores": args.escritores,
+            "escritas_por_escritor": args.escritas,
+            "leitores": args.leitores,
+            "linhas_iniciais": linhas_antes,
+            "dados": os.path.abspath(args.dados),
+            "gerado_em": datetime.now().isoformat(timespec="seconds")
+        },
+        "duracao_s": round(duracao, 2),
+        "escritas": total,
+        "vazao_escritas_s": round(total / duracao, 2) if duracao else 0.0,
+        "latencia_ms": {
+            "p50": round(percentil(tempos, 0.50), 1),
+            "p95": round(percentil(tempos, 0.95), 1),
+            "p99": round(percentil(tempos, 0.99), 1),
+            "media": round(statistics.fmean(tempos), 1)
+        },
+        "gravacoes_arquivo": gravacoes,
+        "escritas_por_gravacao": round(total / gravacoes, 2) if gravacoes else 0.0,
+        "bytes_gravados_por_escrita": round(bytes_gravados / total) if total else 0,
+        "falhas": sum(r["falhas"] for r in resultados),
+        "conflitos_versao": sum(r["conflitos"] for r in resultados),
+        "cadastros_confirmados": len(confirmadas),
+        "cadastros_perdidos": len(perdidas),
+        "linhas_finais": len(final),
+        "leituras": sum(r["leituras"] for r in leituras),
+        "erros_leitura": sum(r["erros_leitura"] for r in leituras)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de escritas concorrentes")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    parser.add_argument("--escritores", type=int, default=50, help="Processos escritores")
+    parser.add_argument("--escritas", type=int, default=10, help="Escritas por escritor")
+    parser.add_argument("--leitores", type=int, default=2, help="Processos leitores")
+    parser.add_argument("--modo", choices=["processos", "threads"], default="processos",
+                        help="Escritores em processos separados ou em threads de um mesmo processo")
+    parser.add_argument("--saida", help="Arquivo JSON para gravar os resultados")
+    args = parser.parse_args()
+    args.dados = os.path.abspath(args.dados)
+
+    resultado = executar(args)
+    lat = resultado["latencia_ms"]
+    print(f"{resultado['meta']['escritores']} escritores, {resultado['escritas']} escritas em "
+          f"{resultado['duracao_s']:.1f} s: {resultado['vazao_escritas_s']:.1f} escritas/s")
+    print(f"Gravações do arquivo: {resultado['gravacoes_arquivo']} "
+          f"({resultado['escritas_por_gravacao']:.1f} escritas por gravação, "
+          f"{resultado['bytes_gravados_por_escrita'] / 1024:.1f} KB gravados por escrita)")
+    print(f"Latência: p50 {lat['p50']:.1f} ms   p95 {lat['p95']:.1f} ms   p99 {lat['p99']:.1f} ms")
+    print(f"Cadastros confirmados: {resultado['cadastros_confirmados']}   "
+          f"perdidos: {resultado['cadastros_perdidos']}   falhas: {resultado['falhas']}   "
+          f"conflitos de versão: {resultado['conflitos_versao']}")
+    print(f"Leituras: {resultado['leituras']}   com erro/arquivo incompleto: {resultado['erros_leitura']}")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
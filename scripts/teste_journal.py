@@ -0,0 +1,212 @@
+"""
+Teste de recuperação do armazenamento em journal (VISA_STORAGE=journal)
+
+Verifica, sobre uma cópia dos dados:
+- registro final cortado em cada byte: a leitura volta ao estado anterior
+  à última escrita, e a escrita seguinte corta o resto e grava normalmente;
+- registro final corrompido (CRC inválido): ignorado da mesma forma;
+- processo escritor morto com SIGKILL no meio das gravações: toda escrita
+  confirmada continua no estado reaplicado;
+- tempo de reaplicação na partida com o journal no limite de compactação.
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 10k --saida /tmp/visa_10k
+    python scripts/teste_journal.py --dados /tmp/visa_10k
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+os.environ["VISA_STORAGE"] = "journal"
+# Sem compactação automática durante os cortes do journal
+os.environ.setdefault("VISA_JOURNAL_MAX_BYTES", str(1 << 40))
+os.environ.setdefault("VISA_METRICS_PORT", "0")
+
+def preparar_copia(dados: str) -> str:
+    """Diretório temporário com inspecoes.csv e usuarios.csv"""
+    workdir = tempfile.mkdtemp(prefix="visa_journal_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(dados, nome), os.path.join(workdir, "data"))
+    return os.path.join(workdir, "data")
+
+def nova_inspecao(marcador: str) -> dict:
+    return {
+        "estabelecimento": marcador,
+        "cnpj": "11.222.333/0001-81",
+        "atividade_principal": "Restaurante",
+        "classificacao_risco": "medio",
+        "data_inspecao": datetime.now().date(),
+        "observacoes": "Inspeção criada pelo teste do journal.",
+        "prazo_inspetor": None,
+        "territorio": "Norte"
+    }
+
+def estado(data_dir: str):
+    """Estado reaplicado por um processo que acabou de subir"""
+    from utils.journal import JournalInspecoes
+    from utils.data_manager import DataManager
+    dm = DataManager(data_dir)
+    return JournalInspecoes(dm.inspecoes_file, dm._trava, dm._preparar).ler()
+
+def resumo(df) -> dict:
+    """id -> (versão, status, estabelecimento) para comparar estados"""
+    return {i: (int(v), s, e) for i, v, s, e in
+            zip(df["id"], df["versao"], df["status"], df["estabelecimento"])}
+
+def testar_cortes(dados: str, escritas: int) -> list:
+    """Corta/corrompe o último registro em cada byte e confere a leitura"""
+    from utils.data_manager import DataManager
+
+    data_dir = preparar_copia(dados)
+    dm = DataManager(data_dir)
+    ids = dm._read_inspecoes()["id"].tolist()
+    rng = random.Random(0)
+    for i in range(escritas - 1):
+        if i % 2 == 0:
+            dm.create_inspecao(nova_inspecao(f"Journal {i}"), 1)
+        else:
+            dm.update_inspecao(rng.choice(ids), {"status": "concluido"})
+    anterior = resumo(estado(data_dir))
+    dm.update_inspecao(ids[0], {"status": "concluido", "prazo_inspetor": datetime.now().date()})
+    completo = resumo(estado(data_dir))
+
+    with open(dm.journal.caminho, "rb") as f:
+        dados_journal = f.read()
+    inicio_ultimo = dados_journal.rindex(b"\n", 0, len(dados_journal) - 1) + 1
+
+    falhas = []
+    cortes = range(inicio_ultimo, len(dados_journal))
+    for corte in cortes:
+        with open(dm.journal.caminho, "wb") as f:
+            f.write(dados_journal[:corte])
+        if resumo(estado(data_dir)) != anterior:
+            falhas.append(f"corte em {corte}: estado diferente do anterior à última escrita")
+
+    # Um byte trocado no meio do último registro
+    corrompido = bytearray(dados_journal)
+    corrompido[(inicio_ultimo + len(dados_journal)) // 2] ^= 0x20
+    with open(dm.journal.caminho, "wb") as f:
+        f.write(bytes(corrompido))
+    if resumo(estado(data_dir)) != anterior:
+        falhas.append("registro corrompido: estado diferente do anterior à última escrita")
+
+    # Depois da queda, a próxima escrita descarta o resto e grava inteira
+    with open(dm.journal.caminho, "wb") as f:
+        f.write(dados_journal[:len(dados_journal) - 7])
+    DataManager(data_dir).create_inspecao(nova_inspecao("Depois da queda"), 1)
+    final = estado(data_dir)
+    if "Depois da queda" not in set(final["estabelecimento"]):
+        falhas.append("escrita após a queda não aparece no estado")
+    if len(final) != len(anterior) + 1:
+        falhas.append("restos do registro cortado apareceram no estado")
+
+    if completo == anterior:
+        falhas.append("a última escrita não alterou o estado (teste inválido)")
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    print(f"Cortes do último registro: {len(cortes)} posições + 1 corrompido   falhas: {len(falhas)}")
+    return falhas
+
+def escritor(data_dir: str):
+    """Processo filho: cadastra sem parar e informa cada escrita confirmada"""
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    from utils.data_manager import DataManager
+    dm = DataManager(data_dir)
+    i = 0
+    while True:
+        marcador = f"Morte {os.getpid()} {i}"
+        if dm.create_inspecao(nova_inspecao(marcador), 1):
+            print(marcador, flush=True)
+        i += 1
+
+def testar_mortes(dados: str, mortes: int) -> list:
+    """Mata escritores com SIGKILL e confere as escritas confirmadas"""
+    data_dir = preparar_copia(dados)
+    rng = random.Random(1)
+    confirmadas = []
+    for _ in range(mortes):
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--escritor", data_dir],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        # Espera o primeiro cadastro e deixa gravar mais um pouco
+        confirmadas.append(proc.stdout.readline().strip())
+        time.sleep(rng.uniform(0.05, 0.5))
+        proc.send_signal(signal.SIGKILL)
+        confirmadas.extend(linha.strip() for linha in proc.stdout)
+        proc.wait()
+
+    gravadas = set(estado(data_dir)["estabelecimento"])
+    perdidas = [m for m in confirmadas if m and m not in gravadas]
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    print(f"Escritores mortos: {mortes}   escritas confirmadas: {len(confirmadas)}   perdidas: {len(perdidas)}")
+    return [f"escrita confirmada perdida: {m}" for m in perdidas]
+
+def medir_reaplicacao(dados: str, limite: int) -> float:
+    """Tempo (ms) de subir com o journal no limite de compactação"""
+    from utils.journal import codificar
+
+    data_dir = preparar_copia(dados)
+    base = estado(data_dir)
+    versoes = dict(zip(base["id"], base["versao"].astype(int)))
+    ids = list(versoes)
+    rng = random.Random(2)
+    tamanho = 0
+    registros = 0
+    with open(os.path.join(data_dir, "inspecoes.journal"), "wb") as f:
+        while tamanho < limite:
+            inspecao_id = rng.choice(ids)
+            versoes[inspecao_id] += 1
+            linha = codificar({"op": "atualizar", "id": inspecao_id, "campos": {
+                "status": rng.choice(["pendente", "concluido"]),
+                "data_atualizacao": datetime.now(),
+                "versao": versoes[inspecao_id]
+            }})
+            f.write(linha)
+            tamanho += len(linha)
+            registros += 1
+
+    inicio = time.perf_counter()
+    estado(data_dir)
+    duracao = (time.perf_counter() - inicio) * 1000
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    print(f"Reaplicação na partida: {registros} registros ({tamanho / 1024 / 1024:.1f} MB) "
+          f"em {duracao:.0f} ms")
+    return duracao
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--escritor":
+        escritor(sys.argv[2])
+        return
+
+    parser = argparse.ArgumentParser(description="Teste de recuperação do journal")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    parser.add_argument("--escritas", type=int, default=20, help="Escritas antes dos cortes")
+    parser.add_argument("--mortes", type=int, default=10, help="Escritores mortos com SIGKILL")
+    parser.add_argument("--limite", type=int, default=4 * 1024 * 1024,
+                        help="Tamanho do journal na medição da partida (bytes)")
+    args = parser.parse_args()
+    args.dados = os.path.abspath(args.dados)
+
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    falhas = testar_cortes(args.dados, args.escritas)
+    falhas += testar_mortes(args.dados, args.mortes)
+    medir_reaplicacao(args.dados, args.limite)
+
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
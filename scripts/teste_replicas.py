@@ -0,0 +1,202 @@
+"""
+Teste de coerência entre réplicas (VISA_REPLICAS_DB)
+
+Verifica:
+- protocolo, com o registro em memória: a versão publicada por um canal é
+  recebida pelos outros, e a réplica que gravou não recebe a própria versão;
+- réplicas em processos separados, sobre a mesma cópia dos dados e o mesmo
+  registro SQLite: cada uma cadastra inspeções em intervalos aleatórios e
+  lê os dados sem parar pelo cache do DataManager. Para cada cadastro, mede
+  o atraso até cada outra réplica enxergá-lo (confirmação da gravação até
+  a leitura pelo cache) e confere que nenhuma ficou sem enxergar.
+
+O processo pai fixa instantes absolutos para todas as réplicas: início das
+gravações (depois do tempo de partida) e fim das leituras (último cadastro
+possível mais uma folga), para que a diferença de partida entre os
+processos não deixe uma réplica gravando depois de as outras pararem.
+
+O atraso esperado fica abaixo de VISA_WATCH_INTERVAL mais a releitura do
+arquivo.
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 2k --saida /tmp/visa_2k
+    python scripts/teste_replicas.py --dados /tmp/visa_2k --replicas 3
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+os.environ.setdefault("VISA_METRICS_PORT", "0")
+
+def preparar_copia(dados: str) -> str:
+    """Diretório temporário com inspecoes.csv e usuarios.csv"""
+    workdir = tempfile.mkdtemp(prefix="visa_replicas_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(dados, nome), os.path.join(workdir, "data"))
+    return os.path.join(workdir, "data")
+
+def nova_inspecao(marcador: str) -> dict:
+    return {
+        "estabelecimento": marcador,
+        "cnpj": "11.222.333/0001-81",
+        "atividade_principal": "Restaurante",
+        "classificacao_risco": "medio",
+        "data_inspecao": datetime.now().date(),
+        "observacoes": "Inspeção criada pelo teste de réplicas.",
+        "prazo_inspetor": None,
+        "territorio": "Norte"
+    }
+
+def percentil(valores: list, q: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))] if ordenados else 0.0
+
+def testar_protocolo() -> list:
+    """Três canais num mesmo registro em memória"""
+    from utils.replicas import RegistroMemoria
+    from utils.versao_dados import CanalVersao
+
+    registro = RegistroMemoria()
+    canais = [CanalVersao(lambda: None, registro) for _ in range(3)]
+    falhas = []
+
+    canais[0].publicar()
+    for canal in canais:
+        canal._conferir_registro()
+    if [c.versao for c in canais] != [1, 1, 1]:
+        falhas.append(f"protocolo: versões após uma gravação {[c.versao for c in canais]}, esperado [1, 1, 1]")
+
+    # Duas réplicas gravam antes da conferência: cada uma recebe a da outra
+    canais[1].publicar()
+    canais[2].publicar()
+    for canal in canais:
+        canal._conferir_registro()
+    if canais[0].versao != 2 or min(c.versao for c in canais[1:]) < 3:
+        falhas.append(f"protocolo: versões após gravações simultâneas {[c.versao for c in canais]}")
+
+    print(f"Protocolo (registro em memória): {'ok' if not falhas else 'FALHOU'}")
+    return falhas
+
+def replica(indice: int, data_dir: str, escritas: int, inicio: float, duracao: float, fim: float):
+    """Processo filho: cadastra e lê sem parar, informando o que gravou e viu
+
+    `inicio` e `fim` são instantes absolutos (time.time) comuns a todas as
+    réplicas: os cadastros ficam entre `inicio` e `inicio + duracao`, e as
+    leituras seguem até `fim`.
+    """
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    from utils.data_manager import DataManager
+    from utils.metrics import metrics
+
+    dm = DataManager(data_dir)
+    vistos = set(dm.load_inspecoes()["estabelecimento"])
+    rng = random.Random(indice)
+    # Instantes dos cadastros, espalhados pela duração do teste
+    agenda = sorted(inicio + rng.uniform(0.5, duracao) for _ in range(escritas))
+    if time.time() > inicio:
+        print(json.dumps({"atrasada": indice, "segundos": time.time() - inicio}), flush=True)
+    n = 0
+    while time.time() < fim:
+        if agenda and time.time() >= agenda[0]:
+            agenda.pop(0)
+            marcador = f"Replica {indice} {n}"
+            n += 1
+            if dm.create_inspecao(nova_inspecao(marcador), 1):
+                vistos.add(marcador)
+                print(json.dumps({"escrita": marcador, "em": time.time()}), flush=True)
+
+        df = dm.load_inspecoes()
+        agora = time.time()
+        for marcador in set(df["estabelecimento"]) - vistos:
+            vistos.add(marcador)
+            if marcador.startswith("Replica "):
+                print(json.dumps({"visto": marcador, "em": agora, "replica": indice}), flush=True)
+        time.sleep(0.02)
+
+    atraso = metrics.observation_snapshot().get("replica_atraso")
+    print(json.dumps({"recebidas": atraso.count if atraso else 0,
+                      "p99_ms": atraso.percentile(0.99) if atraso else 0.0,
+                      "max_ms": atraso.max_ms if atraso else 0.0, "replica": indice}), flush=True)
+
+def testar_replicas(dados: str, replicas: int, escritas: int, duracao: float, partida: float) -> list:
+    data_dir = preparar_copia(dados)
+    env = dict(os.environ, VISA_REPLICAS_DB=os.path.join(data_dir, "versoes.sqlite"))
+    # Um só relógio para todas: gravações depois da partida, leituras até o
+    # último cadastro possível mais a folga da observação
+    inicio = time.time() + partida
+    fim = inicio + duracao + 3 * float(os.environ.get("VISA_WATCH_INTERVAL", "1")) + 2
+    procs = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--replica", str(i), data_dir,
+                          str(escritas), repr(inicio), str(duracao), repr(fim)],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+        for i in range(replicas)
+    ]
+    eventos = []
+    for proc in procs:
+        eventos.extend(json.loads(linha) for linha in proc.stdout if linha.startswith("{"))
+        proc.wait()
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+
+    gravadas = {e["escrita"]: e["em"] for e in eventos if "escrita" in e}
+    atrasos = []
+    vistas = set()
+    for e in eventos:
+        if "visto" in e and e["visto"] in gravadas:
+            atrasos.append(max(0.0, e["em"] - gravadas[e["visto"]]) * 1000)
+            vistas.add((e["visto"], e["replica"]))
+    faltando = [(m, i) for m in gravadas for i in range(replicas)
+                if int(m.split()[1]) != i and (m, i) not in vistas]
+
+    print(f"Réplicas: {replicas}   cadastros: {len(gravadas)}   leituras esperadas: "
+          f"{len(gravadas) * (replicas - 1)}   vistas: {len(atrasos)}")
+    print(f"Atraso até a leitura em outra réplica: p50 {percentil(atrasos, 0.5):.0f} ms   "
+          f"p99 {percentil(atrasos, 0.99):.0f} ms   máx {max(atrasos, default=0):.0f} ms")
+    for e in eventos:
+        if "atrasada" in e:
+            print(f"  réplica {e['atrasada']} ficou pronta {e['segundos']:.1f} s depois do início "
+                  f"(aumente --partida)")
+        if "recebidas" in e:
+            print(f"  réplica {e['replica']}: {e['recebidas']} versões recebidas pelo registro, "
+                  f"atraso da invalidação p99 {e['p99_ms']:.0f} ms   máx {e['max_ms']:.0f} ms")
+    return [f"cadastro {m} nunca visto pela réplica {i}" for m, i in faltando]
+
+def main():
+    if len(sys.argv) == 8 and sys.argv[1] == "--replica":
+        replica(int(sys.argv[2]), sys.argv[3], int(sys.argv[4]), float(sys.argv[5]),
+                float(sys.argv[6]), float(sys.argv[7]))
+        return
+
+    parser = argparse.ArgumentParser(description="Teste de coerência entre réplicas")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    parser.add_argument("--replicas", type=int, default=3, help="Processos réplica")
+    parser.add_argument("--escritas", type=int, default=10, help="Cadastros por réplica")
+    parser.add_argument("--duracao", type=float, default=15, help="Duração das gravações (s)")
+    parser.add_argument("--partida", type=float, default=10,
+                        help="Tempo para as réplicas carregarem os dados antes das gravações (s)")
+    args = parser.parse_args()
+    args.dados = os.path.abspath(args.dados)
+
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    falhas = testar_protocolo()
+    falhas += testar_replicas(args.dados, args.replicas, args.escritas, args.duracao, args.partida)
+
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Teste do snapshot Arrow mapeado em memória (utils/snapshot.py)
+
+Com processos de trabalho sobre uma cópia dos dados, mede e verifica:
+- tempo de carga pelo CSV e pelo snapshot mapeado;
+- memória física (PSS) dos processos com o frame carregado, com e sem o
+  snapshot: as páginas mapeadas são divididas entre os processos;
+- troca na gravação: um processo continua lendo o snapshot antigo depois
+  que outro gravou e publicou o novo, e o arquivo antigo some do sistema
+  quando ele solta o frame;
+- vários processos carregando a mesma versão nova: um só publica.
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 100k --saida /tmp/visa_100k
+    python scripts/teste_snapshot.py --dados /tmp/visa_100k --processos 4
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+os.environ.setdefault("VISA_METRICS_PORT", "0")
+
+def preparar_copia(dados: str) -> str:
+    """Diretório temporário com inspecoes.csv e usuarios.csv"""
+    workdir = tempfile.mkdtemp(prefix="visa_snapshot_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(dados, nome), os.path.join(workdir, "data"))
+    return os.path.join(workdir, "data")
+
+def trabalhador(data_dir: str):
+    """Processo filho: executa os comandos lidos da entrada padrão"""
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    from utils.data_manager import DataManager
+    from utils.metrics import metrics
+    from utils.schema import TextosLongos
+
+    dm = DataManager(data_dir)
+    frames = []
+    print(json.dumps({"pronto": True}), flush=True)
+    for comando in sys.stdin:
+        comando = comando.strip()
+        resposta = {}
+        if comando == "carregar":
+            # Como uma nova versão publicada: o cache é refeito
+            dm.canal.publicar()
+            inicio = time.perf_counter()
+            frames.append(dm.load_inspecoes())
+            resposta["ms"] = (time.perf_counter() - inicio) * 1000
+        if comando in ("carregar", "ler"):
+            # Percorre as colunas, como as páginas fariam
+            df = frames[-1]
+            resposta["soma"] = int(df["versao"].sum()) + int(df["data_inspecao"].notna().sum())
+            del df
+        elif comando == "soltar":
+            frames.clear()
+            dm._cache = None
+            dm._textos = TextosLongos()
+            gc.collect()
+        elif comando == "gravar":
+            dm.create_inspecao({
+                "estabelecimento": "Snapshot", "cnpj": "11.222.333/0001-81",
+                "atividade_principal": "Restaurante", "classificacao_risco": "medio",
+                "data_inspecao": datetime.now().date(), "observacoes": "Teste do snapshot.",
+                "prazo_inspetor": None, "territorio": "Norte"
+            }, 1)
+        resposta["publicados"] = metrics.counters().get("snapshot_publicados", 0)
+        print(json.dumps(resposta), flush=True)
+
+class Processo:
+    def __init__(self, data_dir: str, snapshot: bool):
+        env = dict(os.environ, VISA_SNAPSHOT="1" if snapshot else "0")
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--trabalhador", data_dir],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, text=True, env=env)
+        self._resposta()
+
+    def _resposta(self) -> dict:
+        while True:
+            linha = self.proc.stdout.readline()
+            if not linha:
+                raise RuntimeError("processo de trabalho terminou")
+            if linha.startswith("{"):
+                return json.loads(linha)
+
+    def enviar(self, comando: str):
+        self.proc.stdin.write(comando + "\n")
+        self.proc.stdin.flush()
+
+    def executar(self, comando: str) -> dict:
+        self.enviar(comando)
+        return self._resposta()
+
+    def pss_kb(self) -> int:
+        """Memória física proporcional (páginas divididas entre quem as usa)"""
+        with open(f"/proc/{self.proc.pid}/smaps_rollup") as f:
+            for linha in f:
+                if linha.startswith("Pss:"):
+                    return int(linha.split()[1])
+        return 0
+
+    def snapshots_removidos(self) -> int:
+        """Mapeamentos de snapshots já substituídos no diretório"""
+        with open(f"/proc/{self.proc.pid}/maps") as f:
+            return sum(1 for linha in f if "inspecoes.arrow" in linha and "(deleted)" in linha)
+
+    def encerrar(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+def medir_memoria(dados: str, processos: int, snapshot: bool) -> dict:
+    """Tempo de carga e PSS somado dos processos com o frame carregado"""
+    data_dir = preparar_copia(dados)
+    if snapshot:
+        # Snapshot da versão atual já publicado, como depois da primeira carga
+        p = Processo(data_dir, True)
+        p.executar("carregar")
+        p.encerrar()
+    grupo = [Processo(data_dir, snapshot) for _ in range(processos)]
+    antes = sum(p.pss_kb() for p in grupo)
+    tempos = [p.executar("carregar")["ms"] for p in grupo]
+    depois = sum(p.pss_kb() for p in grupo)
+    for p in grupo:
+        p.encerrar()
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    return {"ms": sorted(tempos)[len(tempos) // 2], "pss_mb": (depois - antes) / 1024}
+
+def testar_troca(dados: str) -> list:
+    """Snapshot antigo continua legível e é liberado ao ser solto"""
+    data_dir = preparar_copia(dados)
+    falhas = []
+    leitor = Processo(data_dir, True)
+    escritor = Processo(data_dir, True)
+    antes = leitor.executar("carregar")["soma"]
+    escritor.executar("gravar")
+    escritor.executar("carregar")
+    if leitor.executar("ler")["soma"] != antes:
+        falhas.append("o frame mapeado mudou depois da troca do snapshot")
+    if leitor.snapshots_removidos() == 0:
+        falhas.append("o leitor não mantém o snapshot antigo mapeado (teste inválido)")
+    leitor.executar("soltar")
+    if leitor.snapshots_removidos() != 0:
+        falhas.append("snapshot antigo continua mapeado depois de solto")
+    if leitor.executar("carregar")["soma"] == antes:
+        falhas.append("o leitor não enxergou a nova versão")
+    leitor.encerrar()
+    escritor.encerrar()
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    print(f"Troca do snapshot com leitor ativo: {'ok' if not falhas else 'FALHOU'}")
+    return falhas
+
+def testar_publicacao_unica(dados: str, processos: int) -> list:
+    """Vários processos carregando a mesma versão nova ao mesmo tempo"""
+    data_dir = preparar_copia(dados)
+    grupo = [Processo(data_dir, True) for _ in range(processos)]
+    for p in grupo:
+        p.enviar("carregar")
+    publicados = sum(p._resposta()["publicados"] for p in grupo)
+    for p in grupo:
+        p.encerrar()
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    print(f"Carga simultânea em {processos} processos: {publicados} publicação(ões) do snapshot")
+    return [] if publicados == 1 else [f"{publicados} publicações para uma só versão"]
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--trabalhador":
+        trabalhador(sys.argv[2])
+        return
+
+    parser = argparse.ArgumentParser(description="Teste do snapshot Arrow mapeado")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    parser.add_argument("--processos", type=int, default=4, help="Processos de trabalho")
+    args = parser.parse_args()
+    args.dados = os.path.abspath(args.dados)
+
+    for snapshot in (False, True):
+        r = medir_memoria(args.dados, args.processos, snapshot)
+        print(f"{'Snapshot mapeado' if snapshot else 'CSV':17s} carga p50 {r['ms']:7.0f} ms   "
+              f"PSS do frame em {args.processos} processos: {r['pss_mb']:6.1f} MB")
+
+    falhas = testar_troca(args.dados)
+    falhas += testar_publicacao_unica(args.dados, args.processos)
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Teste da fila de tarefas em segundo plano (utils/tarefas.py)
+
+Sobre uma cópia dos dados, mede e verifica:
+- quanto tempo a página ficava parada no relatório e na exportação feitos
+  dentro do script, e quanto leva agora o envio da tarefa;
+- resultados iguais aos do caminho síncrono (totais e arquivo exportado);
+- limites: tarefas executando ao mesmo tempo, no total e por usuário, e
+  envio recusado com a fila do usuário cheia;
+- cancelamento de tarefa na fila e em execução (sem arquivo pela metade);
+- andamento informado durante a exportação;
+- leituras do servidor enquanto o pool trabalha (prioridade menor no pool).
+
+Limites, cancelamento e andamento usam uma exportação lenta de duração
+fixa (cerca de 20 blocos com uma pausa a cada andamento informado), para
+que as tarefas fiquem em execução o bastante em qualquer tamanho de dados.
+
+Uso:
+    python scripts/gerar_dados_sinteticos.py --linhas 100k --saida /tmp/visa_100k
+    python scripts/teste_tarefas.py --dados /tmp/visa_100k
+"""
+import argparse
+import filecmp
+import glob
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_DIR)
+# Os processos do pool importam a exportação lenta deste arquivo como módulo
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("VISA_METRICS_PORT", "0")
+
+def preparar_copia(dados: str) -> str:
+    """Diretório temporário com inspecoes.csv e usuarios.csv; vira o diretório atual"""
+    workdir = tempfile.mkdtemp(prefix="visa_tarefas_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for nome in ("inspecoes.csv", "usuarios.csv"):
+        shutil.copy(os.path.join(dados, nome), os.path.join(workdir, "data"))
+    os.chdir(workdir)
+    return workdir
+
+# Blocos e pausa por andamento da exportação lenta: cerca de 2 s por tarefa
+BLOCOS_LENTA = 20
+PAUSA_LENTA_S = 0.1
+
+def exportacao_lenta(parametros: dict, progresso) -> dict:
+    """Exportação em BLOCOS_LENTA blocos, com uma pausa a cada andamento
+
+    Roda no processo do pool: a duração não depende do tamanho dos dados, e
+    o cancelamento é conferido em cada andamento, como na exportação real.
+    """
+    from utils import data_manager as modulo
+    from utils import relatorios
+    modulo.LINHAS_POR_BLOCO_EXPORTACAO = parametros['linhas_por_bloco']
+
+    def devagar(fracao: float, mensagem: str = ''):
+        progresso(fracao, mensagem)
+        time.sleep(PAUSA_LENTA_S)
+
+    return relatorios.exportar_inspecoes(parametros, devagar)
+
+class Amostrador:
+    """Registra, a cada poucos ms, quantas tarefas executam (total e por usuário)"""
+
+    def __init__(self, fila):
+        self.fila = fila
+        self.max_total = 0
+        self.max_usuario = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._parar.is_set():
+            with self.fila._lock:
+                executando = [t.usuario_id for t in self.fila._tarefas.values() if t.estado == 'executando']
+            self.max_total = max(self.max_total, len(executando))
+            for usuario in set(executando):
+                self.max_usuario = max(self.max_usuario, executando.count(usuario))
+            time.sleep(0.005)
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+def medir_leituras(dm, segundos: float) -> float:
+    """Mediana (ms) de get_estatisticas repetido por alguns segundos"""
+    tempos = []
+    fim = time.monotonic() + segundos
+    while time.monotonic() < fim:
+        inicio = time.perf_counter()
+        dm.get_estatisticas(None, 'gerencia')
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste da fila de tarefas em segundo plano")
+    parser.add_argument("--dados", required=True, help="Diretório com inspecoes.csv e usuarios.csv")
+    args = parser.parse_args()
+    args.dados = os.path.abspath(args.dados)
+
+    warnings.filterwarnings("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    workdir = preparar_copia(args.dados)
+
+    from utils import relatorios
+    from utils.data_manager import data_manager
+    from utils.tarefas import FilaTarefas, LimiteTarefas, TIPOS, TipoTarefa
+    import teste_tarefas
+
+    falhas = []
+    gerente = {'data_dir': os.path.abspath("data"), 'perfil': 'gerencia', 'usuario_id': 1,
+               'inicio': None, 'fim': None}
+
+    # Caminho síncrono: o que a página fazia dentro do script
+    df = data_manager.load_inspecoes()
+    inicio = time.perf_counter()
+    sincrono = relatorios.relatorio_detalhado(gerente, lambda fracao, mensagem='': None)
+    ms_relatorio = (time.perf_counter() - inicio) * 1000
+    inicio = time.perf_counter()
+    export_sincrono = data_manager.export_to_csv(df)
+    ms_exportacao = (time.perf_counter() - inicio) * 1000
+
+    # Importada como módulo (não __main__) para o pool encontrar a função
+    TIPOS['exportacao_lenta'] = TipoTarefa("Exportação lenta (teste)", teste_tarefas.exportacao_lenta,
+                                           lambda tarefa: None)
+    lenta = dict(gerente, linhas_por_bloco=max(1, -(-len(df) // BLOCOS_LENTA)))
+
+    fila = FilaTarefas(max_processos=2, por_usuario=1, max_fila=3)
+    # Pool já de pé, como depois da primeira tarefa do servidor
+    fila.aguardar(fila.enviar('agregados', 1, gerente).id, 120)
+
+    inicio = time.perf_counter()
+    relatorio = fila.enviar('relatorio', 1, gerente)
+    ms_envio = (time.perf_counter() - inicio) * 1000
+    exportacao = fila.enviar('exportacao', 1, gerente)
+    relatorio = fila.aguardar(relatorio.id, 300)
+    exportacao = fila.aguardar(exportacao.id, 300)
+
+    print(f"Relatório no script:  {ms_relatorio:8.0f} ms   na fila: {(relatorio.concluida_em - relatorio.iniciada_em).total_seconds() * 1000:8.0f} ms")
+    print(f"Exportação no script: {ms_exportacao:8.0f} ms   na fila: {(exportacao.concluida_em - exportacao.iniciada_em).total_seconds() * 1000:8.0f} ms")
+    print(f"Página parada no envio da tarefa: {ms_envio:.1f} ms")
+
+    if relatorio.estado != 'concluida':
+        falhas.append(f"relatório terminou como {relatorio.estado}: {relatorio.erro}")
+    elif {k: relatorio.resultado[k] for k in ('total', 'pendentes', 'concluidas', 'risco')} != \
+            {k: sincrono[k] for k in ('total', 'pendentes', 'concluidas', 'risco')}:
+        falhas.append("totais do relatório diferentes do caminho síncrono")
+    if exportacao.estado != 'concluida':
+        falhas.append(f"exportação terminou como {exportacao.estado}: {exportacao.erro}")
+    elif not filecmp.cmp(export_sincrono, exportacao.resultado['caminho'], shallow=False):
+        falhas.append("arquivo exportado diferente do caminho síncrono")
+
+    # Limites: usuário 1 com várias exportações, usuário 2 com uma
+    amostrador = Amostrador(fila)
+    # Uma começa na hora e três aguardam: a fila do usuário 1 fica cheia
+    enviadas = [fila.enviar('exportacao_lenta', 1, lenta) for _ in range(4)]
+    try:
+        enviadas.append(fila.enviar('exportacao_lenta', 1, lenta))
+        falhas.append("quarta tarefa aguardando foi aceita (limite da fila do usuário é 3)")
+    except LimiteTarefas:
+        pass
+    enviadas.append(fila.enviar('exportacao_lenta', 2, dict(lenta, usuario_id=2)))
+    for tarefa in enviadas:
+        fila.aguardar(tarefa.id, 300)
+    amostrador.parar()
+    print(f"Executando ao mesmo tempo: no máximo {amostrador.max_total} no total, "
+          f"{amostrador.max_usuario} por usuário")
+    if amostrador.max_total > 2 or amostrador.max_usuario > 1:
+        falhas.append("limite de tarefas simultâneas desrespeitado")
+    if amostrador.max_total < 2:
+        falhas.append("o segundo usuário não executou junto com o primeiro")
+
+    # Andamento e cancelamento em execução
+    arquivos_antes = set(glob.glob("data/export_inspecoes_*"))
+    progressos = []
+    rodando = fila.enviar('exportacao_lenta', 1, lenta)
+    na_fila = fila.enviar('exportacao_lenta', 1, lenta)
+    while rodando.progresso < 0.3 and rodando.ativa():
+        progressos.append(rodando.progresso)
+        time.sleep(0.01)
+    fila.cancelar(na_fila.id, 1)
+    if na_fila.estado != 'cancelada':
+        falhas.append("tarefa na fila não foi cancelada na hora")
+    inicio = time.perf_counter()
+    fila.cancelar(rodando.id, 1)
+    fila.aguardar(rodando.id, 60)
+    ms_cancelar = (time.perf_counter() - inicio) * 1000
+    print(f"Cancelamento em execução: {rodando.estado} em {ms_cancelar:.0f} ms; "
+          f"{len(set(progressos))} valores de andamento vistos antes")
+    if rodando.estado != 'cancelada':
+        falhas.append(f"tarefa em execução terminou como {rodando.estado}")
+    if len(set(progressos)) < 3:
+        falhas.append("andamento da exportação não foi informado")
+    time.sleep(0.2)
+    if set(glob.glob("data/export_inspecoes_*")) - arquivos_antes:
+        falhas.append("exportação cancelada deixou arquivo")
+    if glob.glob("data/*.tmp"):
+        falhas.append("exportação cancelada deixou temporário")
+
+    # Leituras do servidor com o pool ocupado
+    parado = medir_leituras(data_manager, 2)
+    ocupadas = [fila.enviar('exportacao', u, dict(gerente, usuario_id=u)) for u in (1, 2)]
+    time.sleep(0.5)
+    ocupado = medir_leituras(data_manager, 2)
+    for tarefa in ocupadas:
+        fila.cancelar(tarefa.id, tarefa.usuario_id)
+        fila.aguardar(tarefa.id, 60)
+    print(f"get_estatisticas no servidor: {parado:.1f} ms com o pool parado, {ocupado:.1f} ms com 2 tarefas")
+
+    fila.encerrar()
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    sys.exit(1 if falhas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Aquecimento do servidor na partida
+
+O primeiro usuário depois de um deploy pagava a criação dos singletons, a
+primeira leitura do CSV (ou do snapshot), os índices do histórico, a
+importação do matplotlib e do plotly e a primeira montagem de gráficos. Uma
+thread faz esse trabalho em segundo plano, etapa por etapa, enquanto a
+página de login já é servida.
+
+Quem chega a uma página pesada durante o aquecimento não refaz o trabalho:
+a carga do frame é única por versão (ver DataManager.load_inspecoes) e o
+usuário só espera o que ainda falta.
+
+O estado fica em `aquecimento.situacao()` e na rota /pronto do endpoint de
+métricas (200 quando pronto, 503 antes), para o balanceador só mandar
+sessões à réplica depois do aquecimento.
+
+Configuração por variáveis de ambiente:
+    VISA_WARMUP   1 (padrão) aquece em segundo plano; 0 desativa (pronto na hora)
+"""
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+AQUECER = os.environ.get("VISA_WARMUP", "1") != "0"
+
+def _modulos():
+    """Camada de dados, autenticação, notificações e bibliotecas de gráficos"""
+    import matplotlib.pyplot  # noqa: F401
+    import plotly.express  # noqa: F401
+    import plotly.graph_objects  # noqa: F401
+    from . import auth, data_manager, notifications  # noqa: F401
+
+def _inspecoes():
+    from .data_manager import data_manager
+    data_manager.load_inspecoes()
+
+def _historico():
+    from .data_manager import data_manager
+    data_manager.historico.carregar()
+
+def _estatisticas():
+    """Agregados da visão da gerência (inclui vencidas e arquivo frio), atividade recente e reinspeções"""
+    from .data_manager import data_manager
+    data_manager.get_estatisticas(None, 'gerencia')
+    data_manager.get_storage_stats()
+    data_manager.get_atividade_recente()
+    data_manager.get_agenda_reinspecoes()
+
+def _graficos():
+    """Primeiro gráfico de cada biblioteca: fontes, validadores, serialização"""
+    import matplotlib.pyplot as plt
+    import plotly.express as px
+    fig, ax = plt.subplots(figsize=(4, 3))
+    ax.bar(['a', 'b'], [1, 2])
+    ax.set_title('aquecimento')
+    fig.savefig(io.BytesIO(), format='png')
+    plt.close(fig)
+    px.bar(x=['a', 'b'], y=[1, 2], title='aquecimento').to_json()
+
+ETAPAS: List[Tuple[str, Callable[[], Any]]] = [
+    ('modulos', _modulos),
+    ('inspecoes', _inspecoes),
+    ('historico', _historico),
+    ('estatisticas', _estatisticas),
+    ('graficos', _graficos),
+]
+
+class Aquecimento:
+    """Executa as etapas de aquecimento uma vez por processo"""
+
+    def __init__(self, etapas: List[Tuple[str, Callable[[], Any]]] = ETAPAS):
+        self.etapas = etapas
+        self._lock = threading.Lock()
+        self._pronto = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.iniciado_em: Optional[datetime] = None
+        # nome -> {'ms': duração, 'erro': mensagem ou None}
+        self.resultados: Dict[str, Dict[str, Any]] = {}
+
+    def iniciar(self):
+        """Liga a thread de aquecimento (chamadas seguintes não fazem nada)"""
+        if self._thread is not None or self._pronto.is_set():
+            return
+        with self._lock:
+            if self._thread is not None or self._pronto.is_set():
+                return
+            if not AQUECER:
+                self._pronto.set()
+                return
+            self.iniciado_em = datetime.now()
+            self._thread = threading.Thread(target=self._executar, name="visa-aquecimento", daemon=True)
+            self._thread.start()
+
+    def _executar(self):
+        for nome, funcao in self.etapas:
+            inicio = time.perf_counter()
+            erro = None
+            try:
+                funcao()
+            except Exception as e:
+                # Etapa que falhou será feita pelo primeiro usuário que precisar dela
+                logger.exception("Falha no aquecimento (%s)", nome)
+                erro = str(e)
+            ms = (time.perf_counter() - inicio) * 1000
+            with self._lock:
+                self.resultados[nome] = {'ms': ms, 'erro': erro}
+        self._pronto.set()
+
+    def pronto(self) -> bool:
+        return self._pronto.is_set()
+
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        """Espera o fim do aquecimento; False se o tempo acabou antes"""
+        return self._pronto.wait(timeout)
+
+    def situacao(self) -> Dict[str, Any]:
+        """Estado para a rota /pronto e para a página de Desempenho"""
+        with self._lock:
+            resultados = {nome: dict(r) for nome, r in self.resultados.items()}
+        return {
+            'pronto': self.pronto(),
+            'iniciado_em': self.iniciado_em.isoformat(timespec='seconds') if self.iniciado_em else None,
+            'etapas': [
+                {'etapa': nome, **resultados.get(nome, {'ms': None, 'erro': None})}
+                for nome, _ in self.etapas
+            ]
+        }
+
+# Instância global do aquecimento
+aquecimento = Aquecimento()
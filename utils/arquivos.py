@@ -0,0 +1,89 @@
+"""
+Escrita segura dos arquivos de dados do Diário de Campo Digital
+
+- Trava consultiva entre processos (fcntl.flock) em um arquivo .lock ao lado
+  do arquivo de dados, para serializar os ciclos leitura-alteração-gravação.
+- Gravação atômica: o conteúdo vai para um arquivo temporário no mesmo
+  diretório, recebe fsync e substitui o original com os.replace. Leitores
+  nunca esperam pela trava e sempre veem o arquivo antigo ou o novo inteiro.
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sem flock, a trava vale só dentro do processo
+    fcntl = None
+
+class TravaArquivo:
+    """Trava exclusiva entre processos, reentrante na mesma thread"""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho + '.lock'
+        # Serializa as threads do processo antes de disputar o flock
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    @contextmanager
+    def __call__(self):
+        with self._lock:
+            profundidade = getattr(self._local, 'profundidade', 0)
+            if profundidade == 0 and fcntl is not None:
+                fd = os.open(self.caminho, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self._local.fd = fd
+            self._local.profundidade = profundidade + 1
+            try:
+                yield
+            finally:
+                self._local.profundidade = profundidade
+                if profundidade == 0 and fcntl is not None:
+                    fd = self._local.fd
+                    self._local.fd = None
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+
+def gravar_atomico(caminho: str, escrever: Callable[[str], None]):
+    """Grava via arquivo temporário + os.replace
+
+    `escrever` recebe o caminho do temporário e grava o conteúdo completo.
+    """
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(caminho) + '.', suffix='.tmp', dir=diretorio)
+    os.close(fd)
+    try:
+        escrever(tmp)
+        # mkstemp cria com 0600: manter as permissões do arquivo substituído
+        try:
+            os.chmod(tmp, os.stat(caminho).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+        # Conteúdo no disco antes da troca de nome
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, caminho)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    _fsync_diretorio(diretorio)
+
+def _fsync_diretorio(diretorio: str):
+    """Persiste a troca de nome (entrada do diretório)"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(diretorio, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,252 @@
+"""
+Atividade recente das inspeções (cadastros e mudanças de status)
+
+As "Últimas Inspeções" do Dashboard ordenavam o frame inteiro do usuário
+por data de criação a cada rerun para ficar com 5 linhas. Aqui cada
+inspetor, cada território e a visão geral têm uma fila limitada (deque com
+os LIMITE_ATIVIDADE eventos mais recentes), alimentada pelas gravações:
+`create_inspecao` e `update_inspecao` passam pelo lote de
+DataManager._aplicar_alteracoes, que registra os cadastros e as mudanças
+de status. Ler os N últimos eventos custa O(N).
+
+As filas valem para uma versão dos dados (CanalVersao) e guardam a marca
+do histórico de alterações (utils/historico.py) já refletida nelas. Quando a
+versão muda por uma gravação de outro processo ou réplica, só as entradas
+do histórico gravadas desde a marca são aplicadas (cadastros e mudanças de
+status): o custo acompanha o tamanho da mudança, não o do histórico. As
+filas são montadas do zero só na primeira leitura e quando o arquivo do
+histórico é substituído; aí os cadastros mais recentes saem do frame e as
+mudanças de status, do histórico percorrido do mais novo para o mais
+antigo, parando quando as filas estão cheias.
+"""
+import bisect
+import itertools
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from .schema import id_to_key, id_to_str
+
+# Eventos guardados por fila (inspetor, território e geral)
+LIMITE_ATIVIDADE = 20
+
+# Entradas do histórico resolvidas contra o frame de cada vez na reconstrução
+LOTE_HISTORICO = 256
+
+COLUNAS = ['id', 'tipo', 'em', 'estabelecimento', 'inspetor_id', 'territorio',
+           'classificacao_risco', 'data_inspecao', 'status', 'status_anterior']
+
+def evento(tipo: str, em: Any, linha: Dict[str, Any], status_anterior: Any = None) -> Dict[str, Any]:
+    """Evento de atividade a partir de uma linha de inspeção (cadastro ou status)"""
+    inspetor = linha.get('inspetor_id')
+    return {
+        'id': id_to_str(linha['id']),
+        'tipo': tipo,
+        'em': pd.Timestamp(em),
+        'estabelecimento': linha.get('estabelecimento'),
+        'inspetor_id': int(inspetor) if pd.notna(inspetor) else None,
+        'territorio': linha.get('territorio'),
+        'classificacao_risco': linha.get('classificacao_risco'),
+        'data_inspecao': pd.Timestamp(linha['data_inspecao']) if pd.notna(linha.get('data_inspecao')) else pd.NaT,
+        'status': linha.get('status'),
+        'status_anterior': status_anterior
+    }
+
+def _linhas_por_id(df: pd.DataFrame, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Linhas do frame (compacto) das inspeções `ids`, por id em texto"""
+    chaves = list({id_to_key(inspecao_id) for inspecao_id in ids})
+    if len(df) == 0 or not chaves:
+        return {}
+    if isinstance(df['id'].dtype, pd.ArrowDtype):
+        # Ids binários comparados no Arrow: o isin do pandas converte os
+        # valores e perde os bytes nulos do fim (ids terminados em 00)
+        coluna = pa.array(df['id'].array)
+        binarias = pa.array([chave for chave in chaves if isinstance(chave, bytes)], type=coluna.type)
+        mascara = pc.is_in(coluna, value_set=binarias).to_numpy(zero_copy_only=False)
+    else:
+        mascara = df['id'].isin(chaves).to_numpy()
+    return {id_to_str(linha['id']): linha for linha in df[mascara].to_dict('records')}
+
+class AtividadeRecente:
+    """Filas limitadas dos eventos mais recentes por inspetor, por território e geral"""
+
+    def __init__(self, limite: int = LIMITE_ATIVIDADE):
+        self.limite = limite
+        self._lock = threading.Lock()
+        # Versão dos dados refletida nas filas (None: sincronizar na próxima leitura)
+        self.versao = None
+        # Marca do histórico já aplicada às filas (None: montar do zero)
+        self._marca = None
+        self._filas: Dict[tuple, deque] = {}
+
+    def _chaves(self, ev: Dict[str, Any]) -> List[tuple]:
+        chaves = [('todos',)]
+        if ev['inspetor_id'] is not None:
+            chaves.append(('inspetor', ev['inspetor_id']))
+        if ev['territorio']:
+            chaves.append(('territorio', ev['territorio']))
+        return chaves
+
+    def _anexar(self, filas: Dict[tuple, deque], eventos: Iterable[Dict[str, Any]]):
+        """Anexa eventos em ordem cronológica
+
+        Um evento mais antigo que o fim da fila (gravado por outra réplica)
+        entra na posição pela data, se ainda couber.
+        """
+        for ev in eventos:
+            for chave in self._chaves(ev):
+                fila = filas.get(chave)
+                if fila is None:
+                    fila = filas[chave] = deque(maxlen=self.limite)
+                if not fila or fila[-1]['em'] <= ev['em']:
+                    fila.append(ev)
+                elif len(fila) < self.limite or fila[0]['em'] < ev['em']:
+                    if len(fila) == self.limite:
+                        fila.popleft()
+                    fila.insert(bisect.bisect_right(fila, ev['em'], key=lambda e: e['em']), ev)
+
+    def registrar(self, eventos: List[Dict[str, Any]], versao_antes: int, versao_depois: int,
+                  marca_antes: Any, marca_depois: Any):
+        """Eventos de uma gravação deste processo
+
+        Só anexa se as filas estavam na versão e na marca do histórico de
+        antes da gravação e nada mais mudou no meio; caso contrário a próxima
+        leitura sincroniza pelo histórico a partir da marca das filas.
+        """
+        with self._lock:
+            if (self.versao == versao_antes and versao_depois == versao_antes + 1
+                    and self._marca == marca_antes):
+                self._anexar(self._filas, sorted(eventos, key=lambda ev: ev['em']))
+                self.versao = versao_depois
+                self._marca = marca_depois
+            else:
+                self.versao = None
+
+    def _eventos(self, df: pd.DataFrame, entradas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Cadastros e mudanças de status das entradas do histórico
+
+        Inspeções que já não estão no frame (arquivadas, removidas) ficam de fora.
+        """
+        relevantes = [entrada for entrada in entradas
+                      if entrada['op'] == 'criar' or 'status' in entrada['campos']]
+        por_id = _linhas_por_id(df, (entrada['id'] for entrada in relevantes))
+        eventos = []
+        for entrada in relevantes:
+            linha = por_id.get(entrada['id'])
+            if linha is None:
+                continue
+            if entrada['op'] == 'criar':
+                eventos.append(evento('cadastro', entrada['em'], linha))
+            else:
+                antes, depois = entrada['campos']['status']
+                eventos.append(evento('status', entrada['em'], dict(linha, status=depois), antes))
+        return eventos
+
+    def sincronizar(self, df: pd.DataFrame, historico, marca: Any, versao: int):
+        """Leva as filas à versão `versao` do frame `df`
+
+        `marca`: marca do histórico lida antes do frame (as entradas até ela
+        estão refletidas em `df`). Aplica só as entradas gravadas entre a
+        marca das filas e `marca`; sem marca, ou com o histórico substituído,
+        monta as filas do zero.
+        """
+        with self._lock:
+            de = self._marca
+        entradas = historico.entre_marcas(de, marca) if de is not None else None
+        if entradas is None:
+            filas = self._montar(df, historico, marca)
+            with self._lock:
+                self._filas = filas
+                self._marca = marca
+                self.versao = versao
+            return
+
+        eventos = sorted(self._eventos(df, entradas), key=lambda ev: ev['em'])
+        with self._lock:
+            if self._marca != de:
+                # Outra thread (ou uma gravação deste processo) já avançou as filas
+                return
+            if marca[0] == de[0] and marca[1] < de[1]:
+                # Frame mais velho que as filas: a próxima leitura traz um mais novo
+                return
+            self._anexar(self._filas, eventos)
+            self._marca = marca
+            self.versao = versao
+
+    def _montar(self, df: pd.DataFrame, historico, marca: Any) -> Dict[tuple, deque]:
+        """Filas do zero: cadastros mais recentes do frame e mudanças de status do histórico"""
+        filas: Dict[tuple, deque] = {}
+        if len(df) == 0:
+            return filas
+
+        # Cadastros: os `limite` mais recentes de cada fila, sem ordenar o frame
+        criacao = df['data_criacao'].to_numpy(dtype='datetime64[ns]')
+        validas = np.flatnonzero(~np.isnat(criacao))
+        ordem = validas[np.argsort(criacao[validas], kind='stable')[::-1]]
+        escolhidas = set(ordem[:self.limite].tolist())
+        for coluna in ('inspetor_id', 'territorio'):
+            grupos = df[coluna].iloc[ordem].reset_index(drop=True)
+            presentes = grupos.notna().to_numpy()
+            posicao = grupos[presentes].groupby(grupos[presentes], observed=True).cumcount().to_numpy()
+            escolhidas.update(ordem[presentes][posicao < self.limite].tolist())
+        cadastros = [evento('cadastro', linha['data_criacao'], linha)
+                     for linha in df.iloc[sorted(escolhidas)].to_dict('records')]
+
+        # Por fila: datas dos cadastros (crescentes) e do cadastro mais antigo,
+        # antes do qual não há mudança de status a buscar
+        datas_cadastros: Dict[tuple, List[pd.Timestamp]] = defaultdict(list)
+        for ev in cadastros:
+            for chave in self._chaves(ev):
+                datas_cadastros[chave].append(ev['em'])
+        for datas in datas_cadastros.values():
+            datas.sort()
+        primeiro = {('todos',): pd.Timestamp(criacao[validas].min())} if len(validas) else {}
+        for coluna, tipo in (('inspetor_id', 'inspetor'), ('territorio', 'territorio')):
+            minimos = df['data_criacao'].groupby(df[coluna], observed=True).min().dropna()
+            for valor, data in minimos.items():
+                primeiro[(tipo, int(valor) if tipo == 'inspetor' else valor)] = data
+
+        tomados: Dict[tuple, int] = defaultdict(int)
+
+        def mais_novos(chave: tuple, em: pd.Timestamp) -> int:
+            datas = datas_cadastros.get(chave, [])
+            return tomados[chave] + len(datas) - bisect.bisect_right(datas, em)
+
+        def cheia(chave: tuple, em: pd.Timestamp) -> bool:
+            return mais_novos(chave, em) >= self.limite or em < primeiro.get(chave, em)
+
+        status = []
+        entradas = historico.recentes('status', marca)
+        while True:
+            lote = list(itertools.islice(entradas, LOTE_HISTORICO))
+            if not lote:
+                break
+            for ev in self._eventos(df, lote):
+                chaves = self._chaves(ev)
+                if any(not cheia(chave, ev['em']) for chave in chaves):
+                    status.append(ev)
+                    for chave in chaves:
+                        tomados[chave] += 1
+            # Histórico do mais novo para o mais antigo: fila cheia não volta a ter vaga
+            em = pd.Timestamp(lote[-1]['em'])
+            if all(cheia(chave, em) for chave in primeiro):
+                break
+
+        self._anexar(filas, sorted(cadastros + status, key=lambda ev: ev['em']))
+        return filas
+    def ultimos(self, n: int, inspetor_id: Optional[int] = None,
+                territorio: Optional[str] = None) -> pd.DataFrame:
+        """Os `n` eventos mais recentes (do mais novo para o mais antigo)"""
+        if inspetor_id is not None:
+            chave = ('inspetor', int(inspetor_id))
+        elif territorio:
+            chave = ('territorio', territorio)
+        else:
+            chave = ('todos',)
+        with self._lock:
+            fila = self._filas.get(chave, ())
+            eventos = [fila[-i] for i in range(1, min(n, len(fila)) + 1)]
+        return pd.DataFrame(eventos, columns=COLUNAS)
@@ -6,6 +6,7 @@ import pandas as pd
 import hashlib
 import os
 from typing import Optional, Dict, Any
+from .metrics import metrics, instrumentar
 
 class AuthManager:
     def __init__(self, users_file: str = "data/usuarios.csv"):
@@ -55,10 +56,13 @@ class AuthManager:
         """Verifica se a senha confere com o hash SHA256"""
         return self.hash_password(password) == hashed
     
+    @instrumentar
     def authenticate(self, username: str, password: str) -> Optional[Dict[str, Any]]:
         """Autentica usuário e retorna dados se válido"""
         try:
             users_df = pd.read_csv(self.users_file)
+            metrics.add_bytes_read(os.path.getsize(self.users_file))
+            metrics.add_rows(len(users_df))
             
             user = users_df[users_df['username'] == username]
             
@@ -83,6 +87,7 @@ class AuthManager:
             return st.session_state.user
         return None
     
+    @instrumentar
     def login(self, username: str, password: str) -> bool:
         """Realiza login do usuário"""
         user = self.authenticate(username, password)
@@ -91,12 +96,14 @@ class AuthManager:
             return True
         return False
     
+    @instrumentar
     def logout(self):
         """Realiza logout do usuário"""
         if 'user' in st.session_state:
             del st.session_state.user
         st.rerun()
     
+    @instrumentar
     def require_auth(self, allowed_profiles: list = None):
         """Decorator/função para exigir autenticação"""
         if not self.is_authenticated():
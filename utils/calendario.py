@@ -0,0 +1,139 @@
+"""
+Calendário de dias úteis dos prazos
+
+Os prazos legais de retorno contam dias úteis: sem sábados, domingos e
+feriados nacionais, estaduais e municipais (e pontos facultativos em que
+não há expediente). Os feriados ficam em data/feriados.csv, uma linha por
+dia (data,nome,abrangencia), e o arquivo é relido quando muda: feriados
+estaduais e municipais são acrescentados ali. Na leitura, linhas sem
+abrangência e anos sem feriados nacionais, estaduais ou municipais geram um
+aviso no log.
+
+Regras aplicadas a frames inteiros com as funções busday do NumPy:
+- um prazo que cai em dia não útil vence no primeiro dia útil seguinte;
+- dias úteis restantes: dias úteis de hoje (inclusive) até o vencimento
+  (exclusive); 0 = vence hoje, negativo = dias úteis de atraso;
+- vencida: pendente com algum prazo com dias úteis restantes < 0;
+- próxima do vencimento: pendente, não vencida, com algum prazo a até
+  `dias_proximas` dias úteis.
+
+Configuração por variáveis de ambiente:
+    VISA_FERIADOS          arquivo de feriados (padrão data/feriados.csv)
+    VISA_PRAZO_DIAS_UTEIS  prazo de retorno sugerido na Nova Inspeção (padrão 30)
+"""
+import logging
+import os
+import threading
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_FERIADOS = os.environ.get("VISA_FERIADOS", os.path.join("data", "feriados.csv"))
+PRAZO_RETORNO_DIAS_UTEIS = int(os.environ.get("VISA_PRAZO_DIAS_UTEIS", "30"))
+
+# Abrangências esperadas em cada ano do arquivo de feriados
+ABRANGENCIAS = ('nacional', 'estadual', 'municipal')
+
+# Segunda a sexta
+SEMANA_UTIL = '1111100'
+
+def _dias(valores) -> np.ndarray:
+    """Datas (Series, datas, Timestamps; textos e NaN viram NaT) como datetime64[D]"""
+    return pd.to_datetime(pd.Series(valores), errors='coerce').to_numpy(dtype='datetime64[D]')
+
+def _hoje(hoje=None) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(hoje or datetime.now().date()).date(), 'D')
+
+class CalendarioUteis:
+    """Dias úteis com os feriados de um arquivo CSV"""
+
+    def __init__(self, arquivo: str):
+        self.arquivo = arquivo
+        self._lock = threading.Lock()
+        # (mtime do arquivo lido, calendário do NumPy)
+        self._carregado = None
+
+    def _carregar(self):
+        try:
+            mtime = os.stat(self.arquivo).st_mtime_ns
+        except OSError:
+            mtime = None
+        carregado = self._carregado
+        if carregado is not None and carregado[0] == mtime:
+            return carregado
+        with self._lock:
+            if self._carregado is not None and self._carregado[0] == mtime:
+                return self._carregado
+            feriados = []
+            if mtime is not None:
+                try:
+                    tabela = pd.read_csv(self.arquivo, usecols=['data', 'abrangencia'], dtype=str)
+                    datas = pd.to_datetime(tabela['data'], format='%Y-%m-%d')
+                    feriados = datas.to_numpy(dtype='datetime64[D]')
+                    self._conferir_abrangencias(datas.dt.year, tabela['abrangencia'])
+                except Exception:
+                    # Arquivo inválido: segue com os feriados já lidos (ou só fins de semana)
+                    logger.exception("Falha ao ler os feriados de %s", self.arquivo)
+                    metrics.incr('calendario_falhas')
+                    if self._carregado is not None:
+                        return self._carregado
+            self._carregado = (mtime, np.busdaycalendar(weekmask=SEMANA_UTIL, holidays=feriados))
+            return self._carregado
+
+    def _conferir_abrangencias(self, anos: pd.Series, abrangencias: pd.Series):
+        """Avisa de linhas sem abrangência e de anos sem feriados de alguma abrangência
+
+        Um ano sem feriados estaduais ou municipais costuma ser arquivo
+        incompleto: os prazos daquele ano contariam esses dias como úteis.
+        """
+        abrangencias = abrangencias.fillna('').str.strip().str.lower()
+        sem_abrangencia = int((abrangencias == '').sum())
+        if sem_abrangencia:
+            logger.warning("%d feriado(s) sem abrangência em %s", sem_abrangencia, self.arquivo)
+        presentes = abrangencias.groupby(anos).agg(set)
+        for ano, encontradas in presentes.items():
+            faltando = [a for a in ABRANGENCIAS if a not in encontradas]
+            if faltando:
+                logger.warning("Feriados de %d sem abrangência %s em %s",
+                               ano, ', '.join(faltando), self.arquivo)
+
+    def somar_dias_uteis(self, inicio, dias: int) -> date:
+        """Data `dias` dias úteis depois de `inicio` (que, se não for útil, conta do próximo dia útil)"""
+        dia = np.busday_offset(_dias([inicio])[0], dias, roll='forward', busdaycal=self._carregar()[1])
+        return pd.Timestamp(dia).date()
+
+    def vencimentos(self, prazos) -> np.ndarray:
+        """Vencimento efetivo de cada prazo (datetime64[D]; NaT sem prazo)"""
+        dias = _dias(prazos)
+        validos = ~np.isnat(dias)
+        vencimento = np.full(len(dias), np.datetime64('NaT'), dtype='datetime64[D]')
+        vencimento[validos] = np.busday_offset(dias[validos], 0, roll='forward', busdaycal=self._carregar()[1])
+        return vencimento
+
+    def dias_restantes(self, prazos, hoje=None) -> np.ndarray:
+        """Dias úteis até o vencimento de cada prazo (negativo = atraso; NaN sem prazo)"""
+        vencimento = self.vencimentos(prazos)
+        validos = ~np.isnat(vencimento)
+        restantes = np.full(len(vencimento), np.nan)
+        restantes[validos] = np.busday_count(_hoje(hoje), vencimento[validos], busdaycal=self._carregar()[1])
+        return restantes
+
+    def situacao_prazos(self, df: pd.DataFrame, hoje=None, dias_proximas: int = 3) -> pd.DataFrame:
+        """Por inspeção: dias úteis restantes do prazo mais urgente, vencida e próxima
+
+        `dias_uteis` é o menor entre os dias restantes do prazo do inspetor e
+        o da coordenação (NaN sem prazo); `vencida` e `proxima` só valem para
+        pendentes.
+        """
+        restantes = np.fmin(self.dias_restantes(df['prazo_inspetor'], hoje),
+                            self.dias_restantes(df['prazo_coordenacao'], hoje))
+        pendente = (df['status'] == 'pendente').to_numpy(dtype=bool, na_value=False)
+        vencida = pendente & (restantes < 0)
+        proxima = pendente & (restantes >= 0) & (restantes <= dias_proximas)
+        return pd.DataFrame({'dias_uteis': restantes, 'vencida': vencida, 'proxima': proxima}, index=df.index)
+
+# Instância global do calendário de dias úteis
+calendario = CalendarioUteis(ARQUIVO_FERIADOS)
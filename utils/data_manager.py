@@ -1,17 +1,205 @@
 """
 Gerenciador de dados CSV para o Diário de Campo Digital
 """
+import numpy as np
 import pandas as pd
 import streamlit as st
 import os
-from datetime import datetime, timedelta
+import json
+import logging
+import threading
+from datetime import datetime
 from typing import Dict, List, Optional, Any
 import uuid
+from collections import ChainMap
+from .schema import TextosLongos, compact_inspecoes, expand_inspecoes, bytes_por_linha, id_to_key, id_to_str
+from .metrics import metrics, instrumentar
+from .arquivos import TravaArquivo, gravar_atomico
+from .gravacao_agrupada import GravadorAgrupado, AGRUPAR_ESCRITAS
+from .journal import JournalInspecoes, ARMAZENAMENTO
+from .historico import HistoricoInspecoes
+from .atividade import AtividadeRecente, evento
+from .reinspecao import AgendaReinspecoes, CAMPOS_AGENDA, ultimas_por_cnpj, agenda, carga_reinspecoes
+from .calendario import calendario
+from .versao_dados import CanalVersao
+from .replicas import registro_configurado
+from .snapshot import SnapshotArrow, USAR_SNAPSHOT
+
+logger = logging.getLogger(__name__)
+
+# Copy-on-write: frames derivados compartilham memória até serem alterados,
+# então o cache pode ser entregue às páginas sem cópias defensivas
+pd.options.mode.copy_on_write = True
+
+# Inspeções concluídas há mais de N meses vão para o arquivo frio
+MESES_ARQUIVAMENTO = 12
+
+# Linhas expandidas e gravadas de cada vez na exportação para CSV
+LINHAS_POR_BLOCO_EXPORTACAO = 20000
+
+DATE_COLUMNS = ['data_inspecao', 'prazo_inspetor', 'prazo_coordenacao',
+                'data_criacao', 'data_atualizacao']
+
+def _mesmo_valor(a, b) -> bool:
+    """Compara valores de células tratando ausentes (None, NaN, NaT) como iguais"""
+    if pd.isna(a) or pd.isna(b):
+        return bool(pd.isna(a) and pd.isna(b))
+    return bool(a == b)
+
+# Prazo a até N dias úteis conta como "próximo do vencimento"
+DIAS_PROXIMAS = 3
+
+# Peso da classificação de risco na pontuação de urgência dos processos críticos
+PESOS_RISCO = {'baixo': 1, 'medio': 2, 'alto': 3}
+
+# Processos críticos exibidos por página no Painel de Coordenação
+TAMANHO_PAGINA_CRITICOS = 20
+
+def estatisticas_equipe(df: pd.DataFrame, hoje=None, dias_proximas: int = DIAS_PROXIMAS) -> pd.DataFrame:
+    """Estatísticas por inspetor em uma passada agrupada
+
+    Colunas: inspetor_id, total, pendentes, concluidas, vencidas e proximas
+    (em dias úteis, ver utils/calendario.py), mes_atual (inspeções do mês e
+    ano correntes) e mediana/p90 dos dias entre a inspeção e a conclusão
+    (última atualização das concluídas).
+    """
+    colunas = ['inspetor_id', 'total', 'pendentes', 'concluidas', 'vencidas', 'proximas',
+               'mes_atual', 'dias_conclusao_mediana', 'dias_conclusao_p90']
+    if len(df) == 0:
+        return pd.DataFrame(columns=colunas)
+
+    hoje = pd.Timestamp(hoje or datetime.now().date()).normalize()
+    inicio_mes = hoje.replace(day=1)
+    fim_mes = inicio_mes + pd.offsets.MonthBegin(1)
+
+    pendente = (df['status'] == 'pendente').to_numpy()
+    concluido = (df['status'] == 'concluido').to_numpy()
+    prazos = calendario.situacao_prazos(df, hoje, dias_proximas)
+    vencida = prazos['vencida'].to_numpy()
+    proxima = prazos['proxima'].to_numpy()
+    mes_atual = ((df['data_inspecao'] >= inicio_mes) & (df['data_inspecao'] < fim_mes)).to_numpy()
+
+    inspetor = df['inspetor_id'].array
+    flags = pd.DataFrame({
+        'inspetor_id': inspetor,
+        'total': 1,
+        'pendentes': pendente,
+        'concluidas': concluido,
+        'vencidas': vencida,
+        'proximas': proxima,
+        'mes_atual': mes_atual
+    })
+    stats = flags.groupby('inspetor_id', sort=True).sum()
+
+    fechamento = 'data_atualizacao' if 'data_atualizacao' in df.columns else 'data_inspecao'
+    dias = (df[fechamento] - df['data_inspecao']).dt.days.to_numpy(dtype='float64', na_value=float('nan'))
+    dias = pd.Series(dias[concluido], index=pd.Index(inspetor[concluido], name='inspetor_id')).dropna()
+    por_inspetor = dias.groupby(level=0)
+    stats['dias_conclusao_mediana'] = por_inspetor.median()
+    stats['dias_conclusao_p90'] = por_inspetor.quantile(0.9)
+
+    return stats.reset_index()[colunas]
+
+def processos_criticos(df: pd.DataFrame, hoje=None, dias_proximas: int = DIAS_PROXIMAS) -> pd.DataFrame:
+    """Pendentes vencidas (urgência alta) ou a até `dias_proximas` dias úteis do prazo (média)
+
+    `dias_vencimento` conta, em dias úteis, a partir do prazo mais urgente:
+    dias de atraso nas vencidas, dias restantes nas próximas. `pontuacao` =
+    (dias úteis de atraso + dias_proximas + 1) × peso do risco: cresce com o
+    atraso e com o risco e é sempre positiva (um prazo que vence hoje vale
+    1 × peso a mais que um que vence em `dias_proximas` dias úteis).
+    """
+    colunas = ['id', 'estabelecimento', 'inspetor_id', 'territorio', 'classificacao_risco',
+               'prazo_inspetor', 'prazo_coordenacao', 'urgencia', 'dias_vencimento', 'pontuacao']
+    prazos = calendario.situacao_prazos(df, hoje, dias_proximas)
+    mask = (prazos['vencida'] | prazos['proxima']).to_numpy()
+    if not mask.any():
+        return pd.DataFrame(columns=colunas)
+
+    criticos = df[mask].reset_index(drop=True)
+    atraso = -prazos['dias_uteis'].to_numpy()[mask].astype('int64')
+    vencida = atraso > 0
+    peso = criticos['classificacao_risco'].map(PESOS_RISCO).astype('float64').fillna(1).to_numpy(dtype='int64')
+    criticos['urgencia'] = np.where(vencida, 'alta', 'media')
+    criticos['dias_vencimento'] = np.abs(atraso)
+    criticos['pontuacao'] = (atraso + dias_proximas + 1) * peso
+    return criticos[colunas]
+
+def pagina_criticos(criticos: pd.DataFrame, pagina: int = 0,
+                    tamanho: int = TAMANHO_PAGINA_CRITICOS) -> pd.DataFrame:
+    """Página `pagina` (a partir de 0) dos processos críticos, da maior pontuação para a menor
+
+    Ordena só o necessário: argpartition separa as (pagina + 1) × tamanho
+    primeiras e apenas elas são ordenadas. Empates seguem a ordem do frame,
+    então as páginas não repetem nem pulam processos.
+    """
+    n = len(criticos)
+    inicio = pagina * tamanho
+    if inicio >= n:
+        return criticos.iloc[:0]
+    k = min(inicio + tamanho, n)
+    # Chave única: pontuação (inteira) com a posição como desempate fracionário
+    chave = criticos['pontuacao'].to_numpy(dtype='float64') + (n - np.arange(n)) / (n + 1)
+    melhores = np.argpartition(-chave, k - 1)[:k] if k < n else np.arange(n)
+    melhores = melhores[np.argsort(-chave[melhores])]
+    return criticos.iloc[melhores[inicio:k]]
+
+def contagem_criticos(criticos: pd.DataFrame, coluna: str) -> pd.DataFrame:
+    """Vencidas, próximas e total de processos críticos por `coluna` (territorio, inspetor_id)"""
+    contagem = pd.crosstab(criticos[coluna], criticos['urgencia'])
+    contagem = contagem.reindex(columns=['alta', 'media'], fill_value=0)
+    contagem.columns = ['vencidas', 'proximas']
+    contagem['total'] = contagem['vencidas'] + contagem['proximas']
+    return contagem.sort_values('total', ascending=False).reset_index()
+
+class ConflitoVersao(Exception):
+    """A inspeção foi alterada por outra pessoa desde que foi lida"""
+
+    def __init__(self, inspecao_id: str, esperada: int, atual: int):
+        super().__init__(f"Inspeção {inspecao_id} está na versão {atual} (esperada {esperada})")
+        self.inspecao_id = inspecao_id
+        self.esperada = esperada
+        self.atual = atual
 
 class DataManager:
     def __init__(self, data_dir: str = "data"):
         self.data_dir = data_dir
         self.inspecoes_file = os.path.join(data_dir, "inspecoes.csv")
+        # Armazenamento frio (comprimido) das inspeções concluídas antigas
+        self.arquivo_file = os.path.join(data_dir, "inspecoes_arquivo.csv.gz")
+        self.arquivo_meta_file = os.path.join(data_dir, "inspecoes_arquivo.json")
+        # Trava dos ciclos leitura-alteração-gravação (entre processos)
+        self._trava = TravaArquivo(self.inspecoes_file)
+        # Cadastros e atualizações simultâneos são gravados em lotes
+        self._gravador = GravadorAgrupado(self._aplicar_alteracoes)
+        # VISA_STORAGE=journal: alterações anexadas a um journal sobre o CSV
+        self.journal = None
+        if ARMAZENAMENTO == 'journal':
+            self.journal = JournalInspecoes(self.inspecoes_file, self._trava, self._preparar)
+        # Auditoria: quem alterou o quê e quando, campo a campo
+        self.historico = HistoricoInspecoes(os.path.join(data_dir, "historico.journal"), self._trava)
+        # Últimos cadastros e mudanças de status por inspetor e território
+        self.atividade = AtividadeRecente()
+        # Última inspeção e próxima reinspeção por CNPJ; últimas do arquivo
+        # frio guardadas por mtime do arquivo: (mtime, frame)
+        self.reinspecoes = AgendaReinspecoes()
+        self._ultimas_arquivo = None
+        # Versão dos dados: gravações, mudanças nos arquivos e gravações de
+        # outras réplicas (VISA_REPLICAS_DB) invalidam os caches
+        self.canal = CanalVersao(self._file_key, registro_configurado())
+        # Frame compacto de cada versão em Arrow, mapeado por todos os processos
+        self.snapshot = SnapshotArrow(os.path.join(data_dir, "inspecoes.arrow")) if USAR_SNAPSHOT else None
+        # Textos longos (observações, comentários) mantidos fora do frame:
+        # os do frame atual (trocados a cada recarga; vêm do snapshot quando
+        # ele é usado) e os do último histórico quente + frio carregado
+        self._textos = TextosLongos()
+        self._textos_historico = TextosLongos()
+        self._memoria = {}
+        # Cache do frame compacto: (versão dos dados, frame, marca do histórico
+        # lida antes do arquivo: as entradas até ela estão no frame)
+        self._cache = None
+        # Uma só thread reconstrói o cache; as demais esperam e reaproveitam
+        self._cache_lock = threading.Lock()
         self.ensure_data_files()
     
     def ensure_data_files(self):
@@ -25,89 +213,584 @@ class DataManager:
                 'classificacao_risco', 'data_inspecao', 'observacoes',
                 'prazo_inspetor', 'prazo_coordenacao', 'status',
                 'inspetor_id', 'territorio', 'data_criacao',
-                'data_atualizacao', 'comentarios_internos'
+                'data_atualizacao', 'comentarios_internos', 'versao'
             ])
-            empty_df.to_csv(self.inspecoes_file, index=False)
+            gravar_atomico(self.inspecoes_file, lambda tmp: empty_df.to_csv(tmp, index=False))
+    
+    def _parse_dates(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Converte as colunas de data"""
+        for col in DATE_COLUMNS:
+            if col in df.columns:
+                # ISO8601 aceita datas com e sem hora na mesma coluna (linhas
+                # novas gravadas como data ao lado de linhas antigas com hora)
+                df[col] = pd.to_datetime(df[col], errors='coerce', format='ISO8601')
+        return df
+    
+    def _preencher_versao(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Arquivos anteriores ao controle de versão: todas as linhas na versão 0"""
+        if 'versao' in df.columns:
+            df['versao'] = df['versao'].fillna(0).astype('int64')
+        else:
+            df['versao'] = 0
+        return df
+    
+    def _preparar(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Tipos do frame completo: datas e versão"""
+        return self._parse_dates(self._preencher_versao(df))
+    
+    @instrumentar
+    def _read_inspecoes(self) -> pd.DataFrame:
+        """Lê o CSV de inspeções no formato completo (usado nas escritas)"""
+        if self.journal is not None:
+            # Cópia rasa: quem altera o frame não mexe no estado do journal
+            return self.journal.ler().copy(deep=False)
+        df = pd.read_csv(self.inspecoes_file)
+        metrics.add_bytes_read(os.path.getsize(self.inspecoes_file))
+        return self._preparar(df)
+    
+    def _compact(self, df: pd.DataFrame):
+        """Converte para o esquema compacto; retorna frame, textos e uso de memória
+
+        O uso "depois" soma o frame compacto e os textos guardados fora dele.
+        """
+        compacto, textos = compact_inspecoes(df)
+        memoria = {
+            'linhas': len(df),
+            'bytes_por_linha_antes': bytes_por_linha(df),
+            'bytes_por_linha_depois': bytes_por_linha(compacto, textos)
+        }
+        return compacto, textos, memoria
     
+    def _carregar_compacto(self) -> pd.DataFrame:
+        """Frame compacto da versão atual: snapshot mapeado ou leitura do CSV
+
+        Os textos e o uso de memória passam a ser os desta versão: textos de
+        linhas arquivadas ou removidas não sobrevivem à recarga.
+        """
+        if self.snapshot is None:
+            compacto, self._textos, self._memoria = self._compact(self._read_inspecoes())
+            return compacto
+        # Chave lida antes dos dados: o snapshot nunca fica marcado com uma versão mais nova
+        chave = self._file_key()
+        carregado = self.snapshot.abrir(chave)
+        if carregado is None:
+            with self.snapshot.trava():
+                # Outro processo pode ter publicado enquanto esperava a trava
+                carregado = self.snapshot.abrir(chave)
+                if carregado is None:
+                    compacto, textos, memoria = self._compact(self._read_inspecoes())
+                    try:
+                        self.snapshot.publicar(compacto, textos, chave, memoria)
+                        carregado = self.snapshot.abrir(chave)
+                    except Exception:
+                        # Sem snapshot (disco cheio, tipos inesperados): frame só deste processo
+                        metrics.incr('snapshot_falhas')
+                    if carregado is None:
+                        carregado = (compacto, textos, memoria)
+        compacto, self._textos, self._memoria = carregado
+        return compacto
+    
+    def _todos_textos(self):
+        """Textos do frame atual e do último histórico (quente + frio) carregado"""
+        return ChainMap(self._textos, self._textos_historico)
+    
+    def _file_key(self):
+        """Identifica a versão dos arquivos em disco (mtime e tamanho) e a marca do histórico
+
+        O histórico é gravado depois dos dados: a observação que pega uma
+        gravação de outro processo no meio publica de novo quando o
+        histórico dela chega, e a atividade recente a recebe.
+        """
+        if self.journal is not None:
+            return self.journal.chave() + self.historico.marca()
+        stat = os.stat(self.inspecoes_file)
+        return (stat.st_mtime_ns, stat.st_size) + self.historico.marca()
+    
+    def _cache_atual(self):
+        """(versão, frame compacto, marca do histórico) da versão atual, recarregado se preciso"""
+        self.canal.iniciar()
+        cache = self._cache
+        if cache is None or cache[0] != self.canal.versao:
+            with self._cache_lock:
+                # Os dados podem ter mudado enquanto esperava: comparar com a versão atual
+                versao = self.canal.versao
+                cache = self._cache
+                if cache is None or cache[0] != versao:
+                    metrics.incr('data_cache_misses')
+                    # Versão e marca do histórico lidas antes do arquivo: uma
+                    # gravação no meio invalida este frame, e as entradas até a
+                    # marca (gravadas depois dos dados) já estão nele
+                    marca = self.historico.marca()
+                    cache = (versao, self._carregar_compacto(), marca)
+                    self._cache = cache
+                else:
+                    metrics.incr('data_cache_hits')
+        else:
+            metrics.incr('data_cache_hits')
+        metrics.add_rows(len(cache[1]))
+        return cache
+    
+    @instrumentar
     def load_inspecoes(self) -> pd.DataFrame:
-        """Carrega dados das inspeções"""
+        """Carrega dados das inspeções (armazenamento quente, esquema compacto)
+
+        O frame é compartilhado entre sessões; cada chamada recebe uma visão
+        rasa que só copia colunas quando alterada (copy-on-write). O cache vale
+        enquanto a versão dos dados não mudar (ver utils/versao_dados.py).
+        """
         try:
-            df = pd.read_csv(self.inspecoes_file)
-            # Converter datas
-            date_columns = ['data_inspecao', 'prazo_inspetor', 'prazo_coordenacao', 
-                          'data_criacao', 'data_atualizacao']
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-            return df
+            return self._cache_atual()[1].copy(deep=False)
         except Exception as e:
             st.error(f"Erro ao carregar inspeções: {e}")
             return pd.DataFrame()
     
-    def save_inspecoes(self, df: pd.DataFrame):
+    def get_textos(self, inspecao_id) -> Dict[str, str]:
+        """Retorna observações e comentários internos de uma inspeção"""
+        key = id_to_key(inspecao_id)
+        if key not in self._todos_textos():
+            self.load_inspecoes()
+        return self._todos_textos().get(key, {'observacoes': '', 'comentarios_internos': ''})
+    
+    def memory_report(self) -> Dict[str, Any]:
+        """Retorna bytes por linha antes e depois da compactação (frame e textos longos)"""
+        if not self._memoria:
+            self.load_inspecoes()
+        report = dict(self._memoria) if self._memoria else {
+            'linhas': 0, 'bytes_por_linha_antes': 0.0, 'bytes_por_linha_depois': 0.0
+        }
+        depois = report['bytes_por_linha_depois']
+        report['reducao'] = report['bytes_por_linha_antes'] / depois if depois else 0.0
+        return report
+    
+    @instrumentar
+    def load_arquivo(self) -> pd.DataFrame:
+        """Carrega as inspeções arquivadas (armazenamento frio)"""
+        if not os.path.exists(self.arquivo_file):
+            return pd.DataFrame()
+        try:
+            df = pd.read_csv(self.arquivo_file, compression='gzip')
+            metrics.add_bytes_read(os.path.getsize(self.arquivo_file))
+            metrics.add_rows(len(df))
+            return self._parse_dates(self._preencher_versao(df))
+        except Exception as e:
+            st.error(f"Erro ao carregar arquivo de inspeções: {e}")
+            return pd.DataFrame()
+    
+    def get_storage_stats(self) -> Dict[str, Any]:
+        """Retorna tamanho dos arquivos e número de linhas quente/frio"""
+        # Usa o frame em cache quando existe, para não distorcer as métricas
+        cache = self._cache
+        linhas = len(cache[1]) if cache is not None else len(self.load_inspecoes())
+        return {
+            'arquivo_bytes': os.path.getsize(self.inspecoes_file),
+            'journal_bytes': self.journal.tamanho() if self.journal is not None else 0,
+            'snapshot_bytes': (os.path.getsize(self.snapshot.caminho)
+                               if self.snapshot is not None and os.path.exists(self.snapshot.caminho) else 0),
+            'arquivo_frio_bytes': os.path.getsize(self.arquivo_file) if os.path.exists(self.arquivo_file) else 0,
+            'linhas': linhas,
+            'linhas_frio': self.get_arquivo_meta()['total']
+        }
+    
+    def get_arquivo_meta(self) -> Dict[str, Any]:
+        """Retorna o resumo do arquivo frio (totais e período coberto)"""
+        meta = {
+            'total': 0,
+            'por_inspetor': {},
+            'data_inspecao_max': None,
+            'arquivado_em': None
+        }
+        if os.path.exists(self.arquivo_meta_file):
+            try:
+                with open(self.arquivo_meta_file, encoding='utf-8') as f:
+                    meta.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+        return meta
+    
+    @instrumentar
+    def load_inspecoes_historico(self, data_inicio=None) -> pd.DataFrame:
+        """Carrega inspeções unindo quente e frio quando o período exige"""
+        meta = self.get_arquivo_meta()
+        
+        if meta['total'] == 0:
+            return self.load_inspecoes()
+        
+        # O arquivo só é lido se o período começa antes da última data arquivada
+        if data_inicio is not None and meta['data_inspecao_max']:
+            if pd.Timestamp(data_inicio) > pd.Timestamp(meta['data_inspecao_max']):
+                return self.load_inspecoes()
+        
+        arquivo = self.load_arquivo()
+        if len(arquivo) == 0:
+            return self.load_inspecoes()
+        
+        try:
+            historico = pd.concat([self._read_inspecoes(), arquivo], ignore_index=True)
+            # Uma falha no meio do arquivamento pode deixar a linha nos dois lados
+            historico = historico.drop_duplicates(subset='id', keep='first')
+            # Textos do histórico trocados a cada carga (não se acumulam)
+            compacto, self._textos_historico, _ = self._compact(historico)
+            return compacto
+        except Exception as e:
+            st.error(f"Erro ao carregar histórico de inspeções: {e}")
+            return pd.DataFrame()
+    
+    @instrumentar
+    def archive_inspecoes_concluidas(self, meses: int = MESES_ARQUIVAMENTO) -> int:
+        """Move inspeções concluídas há mais de N meses para o arquivo frio"""
+        try:
+            with self._trava():
+                df = self._read_inspecoes()
+                if len(df) == 0:
+                    return 0
+                
+                limite = pd.Timestamp(datetime.now()) - pd.DateOffset(months=meses)
+                conclusao = df['data_atualizacao'] if 'data_atualizacao' in df.columns else df['data_inspecao']
+                conclusao = conclusao.fillna(df['data_inspecao'])
+                mask = (df['status'] == 'concluido') & (conclusao < limite)
+                
+                if not mask.any():
+                    return 0
+                
+                # Grava primeiro o arquivo frio; só depois remove do quente
+                arquivo = pd.concat([self.load_arquivo(), df[mask]], ignore_index=True)
+                arquivo = arquivo.drop_duplicates(subset='id', keep='last')
+                gravar_atomico(self.arquivo_file,
+                               lambda tmp: arquivo.to_csv(tmp, index=False, compression='gzip'))
+                metrics.add_bytes_written(os.path.getsize(self.arquivo_file))
+                
+                if not self.save_inspecoes(df[~mask]):
+                    return 0
+                # Textos das arquivadas saem da memória do armazenamento quente
+                self._textos = self._textos.sem(id_to_key(key) for key in df.loc[mask, 'id'])
+                
+                por_inspetor = arquivo['inspetor_id'].dropna().astype(int).value_counts()
+                meta = {
+                    'total': len(arquivo),
+                    'por_inspetor': {str(k): int(v) for k, v in por_inspetor.items()},
+                    'data_inspecao_max': str(arquivo['data_inspecao'].max().date()),
+                    'arquivado_em': datetime.now().isoformat(timespec='seconds')
+                }
+                
+                def escrever_meta(tmp):
+                    with open(tmp, 'w', encoding='utf-8') as f:
+                        json.dump(meta, f)
+                
+                gravar_atomico(self.arquivo_meta_file, escrever_meta)
+                # Totais arquivados mudaram depois da gravação do arquivo quente
+                self.canal.publicar()
+                
+                return int(mask.sum())
+        except Exception as e:
+            st.error(f"Erro ao arquivar inspeções: {e}")
+            return 0
+    
+    def _gravar(self, df: pd.DataFrame, publicar: bool = True):
+        """Grava o arquivo de inspeções (atômico, sob a trava de escrita)
+
+        Com `publicar=False` quem chama publica a nova versão, ainda com a
+        trava e dentro de `canal.gravacao()`.
+        """
+        with self._trava(), self.canal.gravacao():
+            if self.journal is not None:
+                # Novo snapshot completo: o journal recomeça vazio
+                self.journal.substituir(df)
+            else:
+                gravar_atomico(self.inspecoes_file, lambda tmp: df.to_csv(tmp, index=False))
+            if publicar:
+                self.canal.publicar(self._file_key())
+        metrics.add_bytes_written(os.path.getsize(self.inspecoes_file))
+    
+    @instrumentar
+    def save_inspecoes(self, df: pd.DataFrame) -> bool:
         """Salva dados das inspeções"""
         try:
-            df.to_csv(self.inspecoes_file, index=False)
+            self._gravar(df)
+            return True
         except Exception as e:
             st.error(f"Erro ao salvar inspeções: {e}")
+            return False
+    
+    def _nova_inspecao(self, data: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+        """Monta a linha de uma nova inspeção"""
+        return {
+            'id': str(uuid.uuid4()),
+            'estabelecimento': data['estabelecimento'],
+            'cnpj': data['cnpj'],
+            'atividade_principal': data['atividade_principal'],
+            'classificacao_risco': data['classificacao_risco'],
+            'data_inspecao': data['data_inspecao'],
+            'observacoes': data['observacoes'],
+            'prazo_inspetor': data.get('prazo_inspetor'),
+            'prazo_coordenacao': None,
+            'status': 'pendente',
+            'inspetor_id': user_id,
+            'territorio': data.get('territorio', ''),
+            'data_criacao': datetime.now(),
+            'data_atualizacao': datetime.now(),
+            'comentarios_internos': '',
+            'versao': 1
+        }
+    
+    def _preparar_atualizacao(self, df: pd.DataFrame, inspecao_id: str, data: Dict[str, Any],
+                              expected_version: Optional[int]):
+        """Confere a versão e monta uma atualização, sem alterar o frame
+
+        Retorna a máscara da linha, os campos a gravar (com a nova data de
+        atualização e versão) e os valores que a linha tem hoje.
+        """
+        mask = df['id'] == inspecao_id
+        if not mask.any():
+            raise LookupError("Inspeção não encontrada")
+        
+        atual = int(df.loc[mask, 'versao'].iloc[0])
+        if expected_version is not None and atual != expected_version:
+            raise ConflitoVersao(inspecao_id, expected_version, atual)
+        
+        campos = {key: value for key, value in data.items() if key in df.columns and key != 'versao'}
+        campos['data_atualizacao'] = datetime.now()
+        campos['versao'] = atual + 1
+        anteriores = {key: df.loc[mask, key].iloc[0] for key in campos}
+        return mask, campos, anteriores
+    
+    def _atualizar_linha(self, df: pd.DataFrame, mask: pd.Series, campos: Dict[str, Any],
+                         anteriores: Dict[str, Any], alterados: Dict[str, Any]):
+        """Aplica a atualização no frame completo; retorna o evento de status e a reinspeção a recalcular
+
+        Se algo falhar no meio, a linha volta aos valores anteriores: o lote
+        não grava uma alteração informada como falha.
+        """
+        try:
+            for key, value in campos.items():
+                df.loc[mask, key] = value
+            status = agendada = None
+            if CAMPOS_AGENDA.intersection(alterados):
+                linha = df.loc[mask].iloc[0].to_dict()
+                if 'status' in alterados:
+                    status = evento('status', campos['data_atualizacao'], linha, alterados['status'][0])
+                agendada = (linha, {key: anteriores.get(key, linha[key]) for key in ('cnpj', 'data_inspecao')})
+            return status, agendada
+        except Exception:
+            for key, value in anteriores.items():
+                df.loc[mask, key] = value
+            raise
     
+    def _entrada_historico(self, inspecao_id: str, campos: Dict[str, Any],
+                           anteriores: Dict[str, Any], user_id: Optional[int]) -> Dict[str, Any]:
+        """Entrada de auditoria de uma atualização: só os campos que mudaram"""
+        alterados = {}
+        for key, novo in campos.items():
+            if key in ('data_atualizacao', 'versao'):
+                continue
+            antes = anteriores[key]
+            if key in DATE_COLUMNS:
+                # Datas do formulário (date) contra Timestamps do arquivo
+                novo = pd.Timestamp(novo) if novo is not None else pd.NaT
+            if _mesmo_valor(antes, novo):
+                continue
+            alterados[key] = [antes, novo]
+        return {
+            'id': inspecao_id,
+            'op': 'atualizar',
+            'em': campos['data_atualizacao'],
+            'usuario': user_id,
+            'versao': campos['versao'],
+            'atualizacao_anterior': anteriores['data_atualizacao'],
+            'campos': alterados
+        }
+    
+    @instrumentar
+    def _aplicar_alteracoes(self, alteracoes: List[Dict[str, Any]]) -> List[Any]:
+        """Aplica um lote de alterações com uma leitura e uma gravação
+
+        Retorna, para cada alteração, True ou a exceção que a impediu; as
+        demais alterações do lote seguem normalmente.
+        """
+        with self._trava():
+            df = self._read_inspecoes()
+            # Gravações de outros processos viram versão antes deste lote: a
+            # atividade recente só é atualizada em cima de filas em dia
+            self.canal.conferir()
+            versao_antes = self.canal.versao
+            marca_antes = self.historico.marca()
+            novas = []
+            registros = []
+            entradas = []
+            eventos = []
+            agendadas = []
+            resultados = []
+            for alteracao in alteracoes:
+                try:
+                    # Tudo de uma alteração é montado antes de entrar no lote:
+                    # uma falha no meio não deixa parte dela ser gravada
+                    if alteracao['tipo'] == 'criar':
+                        linha = self._nova_inspecao(alteracao['dados'], alteracao['user_id'])
+                        entrada = {'id': linha['id'], 'op': 'criar', 'em': linha['data_criacao'],
+                                   'usuario': alteracao['user_id'], 'versao': 1, 'campos': {}}
+                        cadastro = evento('cadastro', linha['data_criacao'], linha)
+                        novas.append(linha)
+                        registros.append({'op': 'criar', 'id': linha['id'], 'linha': linha})
+                        entradas.append(entrada)
+                        eventos.append(cadastro)
+                        agendadas.append((linha, None))
+                    else:
+                        mask, campos, anteriores = self._preparar_atualizacao(
+                            df, alteracao['id'], alteracao['dados'], alteracao['versao'])
+                        entrada = self._entrada_historico(alteracao['id'], campos, anteriores,
+                                                          alteracao.get('user_id'))
+                        # Último passo que pode falhar; desfaz a linha se falhar
+                        status, agendada = self._atualizar_linha(df, mask, campos, anteriores,
+                                                                 entrada['campos'])
+                        registros.append({'op': 'atualizar', 'id': alteracao['id'], 'campos': campos})
+                        entradas.append(entrada)
+                        if status is not None:
+                            eventos.append(status)
+                        if agendada is not None:
+                            agendadas.append(agendada)
+                    resultados.append(True)
+                except Exception as e:
+                    resultados.append(e)
+            
+            if registros:
+                # Da troca dos arquivos à publicação, a observação não confere:
+                # a versão desta gravação é publicada uma vez, depois da auditoria
+                with self.canal.gravacao():
+                    if self.journal is not None:
+                        # Só os registros do lote vão para o disco
+                        self.journal.anexar(registros)
+                    else:
+                        if novas:
+                            df = pd.concat([df, pd.DataFrame(novas)], ignore_index=True)
+                        self._gravar(df, publicar=False)
+                
+                    # Auditoria ainda com a trava e antes de publicar a versão: as
+                    # sessões não veem a alteração sem o registro. Os dados já estão
+                    # gravados, então uma falha aqui não desfaz o lote
+                    try:
+                        self.historico.registrar(entradas)
+                        marca_depois = self.historico.marca()
+                    except Exception:
+                        logger.exception("Falha ao gravar o histórico de %d alteração(ões)", len(entradas))
+                        metrics.incr('historico_falhas')
+                        # Posição do histórico incerta: a atividade recomeça do zero
+                        marca_depois = None
+                
+                    self.canal.publicar(self._file_key())
+                    self.atividade.registrar(eventos, versao_antes, self.canal.versao,
+                                             marca_antes, marca_depois)
+                    self.reinspecoes.registrar(agendadas, versao_antes, self.canal.versao)
+        return resultados
+    
+    def _enviar(self, alteracao: Dict[str, Any]) -> bool:
+        """Grava a alteração (em lote, se o agrupamento estiver ativo) e espera a gravação"""
+        if AGRUPAR_ESCRITAS:
+            return self._gravador.enviar(alteracao)
+        resultado = self._aplicar_alteracoes([alteracao])[0]
+        if isinstance(resultado, BaseException):
+            raise resultado
+        return resultado
+    
+    @instrumentar
     def create_inspecao(self, data: Dict[str, Any], user_id: int) -> bool:
         """Cria nova inspeção"""
         try:
-            df = self.load_inspecoes()
-            
-            # Gerar ID único
-            new_id = str(uuid.uuid4())
-            
-            # Preparar dados da nova inspeção
-            new_inspecao = {
-                'id': new_id,
-                'estabelecimento': data['estabelecimento'],
-                'cnpj': data['cnpj'],
-                'atividade_principal': data['atividade_principal'],
-                'classificacao_risco': data['classificacao_risco'],
-                'data_inspecao': data['data_inspecao'],
-                'observacoes': data['observacoes'],
-                'prazo_inspetor': data.get('prazo_inspetor'),
-                'prazo_coordenacao': None,
-                'status': 'pendente',
-                'inspetor_id': user_id,
-                'territorio': data.get('territorio', ''),
-                'data_criacao': datetime.now(),
-                'data_atualizacao': datetime.now(),
-                'comentarios_internos': ''
-            }
-            
-            # Adicionar nova linha
-            new_df = pd.concat([df, pd.DataFrame([new_inspecao])], ignore_index=True)
-            self.save_inspecoes(new_df)
-            return True
+            return self._enviar({'tipo': 'criar', 'dados': data, 'user_id': user_id})
         except Exception as e:
             st.error(f"Erro ao criar inspeção: {e}")
             return False
     
-    def update_inspecao(self, inspecao_id: str, data: Dict[str, Any]) -> bool:
-        """Atualiza inspeção existente"""
+    def get_versao(self, inspecao_id) -> Optional[int]:
+        """Versão atual de uma inspeção (do frame em cache)"""
+        df = self.load_inspecoes()
+        if len(df) == 0 or 'versao' not in df.columns:
+            return None
+        versoes = df.loc[df['id'] == id_to_key(inspecao_id), 'versao']
+        return int(versoes.iloc[0]) if len(versoes) else None
+    
+    def _historico_frame(self, entradas: List[Dict[str, Any]]) -> pd.DataFrame:
+        """Uma linha por campo alterado (cadastros viram uma linha sem campo)"""
+        linhas = []
+        for entrada in entradas:
+            base = {'id': entrada['id'], 'em': entrada['em'], 'usuario': entrada['usuario'],
+                    'versao': entrada['versao'], 'op': entrada['op']}
+            if not entrada['campos']:
+                linhas.append({**base, 'campo': None, 'antes': None, 'depois': None})
+            for campo, (antes, depois) in entrada['campos'].items():
+                linhas.append({**base, 'campo': campo, 'antes': antes, 'depois': depois})
+        colunas = ['id', 'em', 'usuario', 'versao', 'op', 'campo', 'antes', 'depois']
+        df = pd.DataFrame(linhas, columns=colunas)
+        df['em'] = pd.to_datetime(df['em'], format='ISO8601')
+        return df
+    
+    @instrumentar
+    def get_historico(self, inspecao_id) -> pd.DataFrame:
+        """Alterações de uma inspeção, da mais antiga para a mais recente"""
+        return self._historico_frame(self.historico.da_inspecao(id_to_str(inspecao_id)))
+    
+    @instrumentar
+    def get_alteracoes_entre(self, inicio, fim) -> pd.DataFrame:
+        """Alterações de todas as inspeções no período (busca no índice por data)"""
+        return self._historico_frame(self.historico.entre(inicio, fim))
+    
+    @instrumentar
+    def get_estado_em(self, inspecao_id, momento) -> Optional[Dict[str, Any]]:
+        """Estado de uma inspeção em um instante do passado
+
+        Parte do estado atual e desfaz, da mais recente para a mais antiga, só
+        as alterações gravadas depois de `momento`. Retorna None se a inspeção
+        ainda não existia (ou não está no armazenamento quente).
+        """
+        df = self.load_inspecoes()
+        if len(df) == 0:
+            return None
+        linha = df[df['id'] == id_to_key(inspecao_id)]
+        if len(linha) == 0:
+            return None
+        estado = expand_inspecoes(linha, self._todos_textos()).iloc[0].to_dict()
+        
+        for entrada in reversed(self.historico.posteriores(id_to_str(inspecao_id), momento)):
+            if entrada['op'] == 'criar':
+                return None
+            for campo, (antes, _) in entrada['campos'].items():
+                estado[campo] = pd.Timestamp(antes) if campo in DATE_COLUMNS else antes
+            estado['versao'] = entrada['versao'] - 1
+            estado['data_atualizacao'] = pd.Timestamp(entrada['atualizacao_anterior'])
+        return estado
+    
+    @instrumentar
+    def update_inspecao(self, inspecao_id: str, data: Dict[str, Any],
+                        expected_version: Optional[int] = None, user_id: Optional[int] = None) -> bool:
+        """Atualiza inspeção existente
+
+        Com `expected_version`, só grava se a linha ainda estiver nessa versão;
+        caso contrário levanta ConflitoVersao sem alterar nada. `user_id` é
+        registrado no histórico como autor da alteração.
+        """
         try:
-            df = self.load_inspecoes()
-            mask = df['id'] == inspecao_id
+            inspecao_id = id_to_str(inspecao_id)
             
-            if not mask.any():
-                st.error("Inspeção não encontrada")
-                return False
+            # Falha rápida pelo cache, sem esperar a gravação
+            if expected_version is not None:
+                atual = self.get_versao(inspecao_id)
+                if atual is not None and atual != expected_version:
+                    raise ConflitoVersao(inspecao_id, expected_version, atual)
             
-            # Atualizar dados
-            for key, value in data.items():
-                if key in df.columns:
-                    df.loc[mask, key] = value
-            
-            df.loc[mask, 'data_atualizacao'] = datetime.now()
-            self.save_inspecoes(df)
-            return True
+            # A versão é conferida de novo no lote, sob a trava de escrita
+            return self._enviar({
+                'tipo': 'atualizar', 'id': inspecao_id, 'dados': data, 'versao': expected_version,
+                'user_id': user_id
+            })
+        except ConflitoVersao:
+            metrics.incr('conflitos_versao')
+            raise
+        except LookupError as e:
+            st.error(str(e))
+            return False
         except Exception as e:
             st.error(f"Erro ao atualizar inspeção: {e}")
             return False
     
+    @instrumentar
     def get_inspecoes_by_user(self, user_id: int, user_profile: str) -> pd.DataFrame:
         """Retorna inspeções filtradas por usuário"""
         df = self.load_inspecoes()
@@ -119,36 +802,26 @@ class DataManager:
             # Coordenadores e gerência veem todas
             return df
     
+    @instrumentar
     def get_inspecoes_vencidas(self) -> pd.DataFrame:
-        """Retorna inspeções vencidas"""
+        """Retorna inspeções vencidas (algum prazo com dias úteis de atraso)"""
         df = self.load_inspecoes()
-        hoje = datetime.now().date()
-        
-        # Verificar prazos do inspetor e coordenação
-        mask_vencidas = (
-            ((df['prazo_inspetor'].dt.date < hoje) | 
-             (df['prazo_coordenacao'].dt.date < hoje)) &
-            (df['status'] == 'pendente')
-        )
+        if len(df) == 0:
+            return df
         
-        return df[mask_vencidas]
+        # Prazos do inspetor e da coordenação, em dias úteis
+        return df[calendario.situacao_prazos(df)['vencida'].to_numpy()]
     
-    def get_inspecoes_proximas_vencimento(self, dias: int = 3) -> pd.DataFrame:
-        """Retorna inspeções próximas do vencimento"""
+    @instrumentar
+    def get_inspecoes_proximas_vencimento(self, dias: int = DIAS_PROXIMAS) -> pd.DataFrame:
+        """Retorna inspeções não vencidas com algum prazo a até `dias` dias úteis"""
         df = self.load_inspecoes()
-        hoje = datetime.now().date()
-        limite = hoje + timedelta(days=dias)
-        
-        mask_proximas = (
-            ((df['prazo_inspetor'].dt.date <= limite) | 
-             (df['prazo_coordenacao'].dt.date <= limite)) &
-            ((df['prazo_inspetor'].dt.date >= hoje) | 
-             (df['prazo_coordenacao'].dt.date >= hoje)) &
-            (df['status'] == 'pendente')
-        )
+        if len(df) == 0:
+            return df
         
-        return df[mask_proximas]
+        return df[calendario.situacao_prazos(df, dias_proximas=dias)['proxima'].to_numpy()]
     
+    @instrumentar
     def get_estatisticas(self, user_id: int = None, user_profile: str = None) -> Dict[str, Any]:
         """Retorna estatísticas das inspeções"""
         df = self.load_inspecoes()
@@ -161,6 +834,15 @@ class DataManager:
         concluidas = len(df[df['status'] == 'concluido'])
         vencidas = len(self.get_inspecoes_vencidas())
         
+        # Somar as concluídas arquivadas sem ler o arquivo frio
+        meta = self.get_arquivo_meta()
+        if user_profile == 'inspetor' and user_id:
+            arquivadas = meta['por_inspetor'].get(str(user_id), 0)
+        else:
+            arquivadas = meta['total']
+        total += arquivadas
+        concluidas += arquivadas
+        
         return {
             'total': total,
             'pendentes': pendentes,
@@ -169,13 +851,90 @@ class DataManager:
             'percentual_cumprimento': (concluidas / total * 100) if total > 0 else 0
         }
     
-    def export_to_csv(self, df: pd.DataFrame) -> str:
-        """Exporta DataFrame para CSV e retorna o caminho"""
+    @instrumentar
+    def get_estatisticas_equipe(self) -> pd.DataFrame:
+        """Estatísticas por inspetor das inspeções ativas (ver estatisticas_equipe)"""
+        return estatisticas_equipe(self.load_inspecoes())
+    
+    @instrumentar
+    def get_processos_criticos(self) -> pd.DataFrame:
+        """Processos críticos das inspeções ativas (ver processos_criticos)"""
+        return processos_criticos(self.load_inspecoes())
+    
+    @instrumentar
+    def get_atividade_recente(self, n: int = 5, inspetor_id: Optional[int] = None,
+                              territorio: Optional[str] = None) -> pd.DataFrame:
+        """Últimos cadastros e mudanças de status, do mais recente para o mais antigo
+
+        Com `inspetor_id` ou `territorio`, só os daquele inspetor ou território.
+        """
+        if self.atividade.versao != self.canal.versao:
+            # Frame, versão e marca do histórico do mesmo cache: aplica só o
+            # que o histórico gravou desde a última sincronização
+            versao, df, marca = self._cache_atual()
+            self.atividade.sincronizar(df, self.historico, marca, versao)
+        return self.atividade.ultimos(n, inspetor_id, territorio)
+    
+    def _ultimas_do_arquivo(self) -> Optional[pd.DataFrame]:
+        """Última inspeção por CNPJ no arquivo frio (recalculada só quando ele muda)"""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            mtime = os.stat(self.arquivo_file).st_mtime_ns
+        except OSError:
+            return None
+        guardado = self._ultimas_arquivo
+        if guardado is None or guardado[0] != mtime:
+            arquivo = self.load_arquivo()
+            guardado = self._ultimas_arquivo = (mtime, ultimas_por_cnpj(arquivo) if len(arquivo) > 0 else None)
+        return guardado[1]
+    
+    @instrumentar
+    def get_agenda_reinspecoes(self, hoje=None) -> pd.DataFrame:
+        """Próxima reinspeção de cada CNPJ conforme o risco (ver utils/reinspecao.py)
+
+        Uma linha por CNPJ, com a última inspeção (de todo o histórico), o
+        inspetor e o território dela, a data da reinspeção, os dias restantes
+        e se está atrasada; da mais atrasada para a mais distante.
+        """
+        versao = self.canal.versao
+        if self.reinspecoes.versao != versao:
+            # Versão lida antes dos dados: uma gravação no meio força nova reconstrução
+            self.reinspecoes.reconstruir(self.load_inspecoes(), versao, self._ultimas_do_arquivo())
+        return agenda(self.reinspecoes.ultimas(), hoje)
+    
+    @instrumentar
+    def get_carga_reinspecoes(self, coluna: str = 'territorio', meses: Optional[int] = None,
+                              hoje=None) -> pd.DataFrame:
+        """Reinspeções atrasadas e por mês à frente, por território ou inspetor"""
+        agendadas = self.get_agenda_reinspecoes(hoje)
+        if meses is None:
+            return carga_reinspecoes(agendadas, coluna, hoje)
+        return carga_reinspecoes(agendadas, coluna, hoje, meses)
+    
+    @instrumentar
+    def export_to_csv(self, df: pd.DataFrame, progresso=None) -> str:
+        """Exporta DataFrame para CSV e retorna o caminho
+
+        O arquivo é gravado em blocos de linhas; `progresso(fracao)`, se
+        informado, é chamado a cada bloco (exportações da fila de tarefas).
+        """
+        try:
+            # Microssegundos: exportações simultâneas da fila não disputam o mesmo nome
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
             filename = f"export_inspecoes_{timestamp}.csv"
             filepath = os.path.join(self.data_dir, filename)
-            df.to_csv(filepath, index=False)
+            textos = self._todos_textos()
+
+            def escrever(tmp):
+                with open(tmp, 'w', encoding='utf-8', newline='') as f:
+                    for inicio in range(0, max(len(df), 1), LINHAS_POR_BLOCO_EXPORTACAO):
+                        bloco = df.iloc[inicio:inicio + LINHAS_POR_BLOCO_EXPORTACAO]
+                        expand_inspecoes(bloco, textos).to_csv(f, header=inicio == 0, index=False)
+                        if progresso is not None:
+                            progresso((inicio + len(bloco)) / len(df) if len(df) else 1.0)
+
+            # Exportação cancelada ou interrompida não deixa arquivo pela metade
+            gravar_atomico(filepath, escrever)
+            metrics.add_bytes_written(os.path.getsize(filepath))
             return filepath
         except Exception as e:
             st.error(f"Erro ao exportar dados: {e}")
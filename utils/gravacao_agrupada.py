@@ -0,0 +1,90 @@
+"""
+Gravação agrupada (group commit) das alterações de inspeções
+
+Uma única thread gravadora consome a fila de alterações. As que chegam
+dentro de uma janela curta (alguns milissegundos) formam um lote, aplicado
+com uma leitura e uma gravação durável do arquivo. Quem enviou a alteração
+fica bloqueado até o lote ser gravado, então a semântica de durabilidade é
+a mesma da gravação individual.
+
+Configuração por variáveis de ambiente:
+    VISA_GROUP_COMMIT      0 desativa o agrupamento (grava na thread de quem chama)
+    VISA_GROUP_COMMIT_MS   janela de espera pelo lote, em ms (padrão 5)
+    VISA_GROUP_COMMIT_MAX  tamanho máximo de um lote (padrão 256)
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+from .metrics import metrics
+
+AGRUPAR_ESCRITAS = os.environ.get("VISA_GROUP_COMMIT", "1") != "0"
+JANELA_MS = float(os.environ.get("VISA_GROUP_COMMIT_MS", "5"))
+MAX_LOTE = int(os.environ.get("VISA_GROUP_COMMIT_MAX", "256"))
+
+class GravadorAgrupado:
+    """Fila de alterações gravadas em lotes por uma thread dedicada
+
+    `aplicar` recebe a lista de alterações do lote e devolve, para cada uma,
+    o resultado ou a exceção a ser entregue a quem a enviou.
+    """
+
+    def __init__(self, aplicar: Callable[[List[Any]], List[Any]],
+                 janela_ms: float = JANELA_MS, max_lote: int = MAX_LOTE):
+        self.aplicar = aplicar
+        self.janela = janela_ms / 1000
+        self.max_lote = max_lote
+        self._fila: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def enviar(self, alteracao: Any) -> Any:
+        """Enfileira a alteração e espera o lote dela ser gravado"""
+        futuro = Future()
+        self._fila.put((alteracao, futuro))
+        self._iniciar()
+        return futuro.result()
+
+    def _iniciar(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="visa-gravador", daemon=True)
+                self._thread.start()
+
+    def _proximo_lote(self) -> List[tuple]:
+        """Espera a primeira alteração e junta as que chegarem dentro da janela"""
+        lote = [self._fila.get()]
+        prazo = time.monotonic() + self.janela
+        while len(lote) < self.max_lote:
+            restante = prazo - time.monotonic()
+            try:
+                if restante > 0:
+                    lote.append(self._fila.get(timeout=restante))
+                else:
+                    # Janela encerrada: leva o que já estiver na fila
+                    lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _loop(self):
+        while True:
+            lote = self._proximo_lote()
+            try:
+                resultados = self.aplicar([alteracao for alteracao, _ in lote])
+            except Exception as e:
+                # Falha na gravação: nenhuma alteração do lote foi persistida
+                resultados = [e] * len(lote)
+
+            metrics.incr('escrita_lotes')
+            metrics.incr('escrita_alteracoes', len(lote))
+
+            for (_, futuro), resultado in zip(lote, resultados):
+                if isinstance(resultado, BaseException):
+                    futuro.set_exception(resultado)
+                else:
+                    futuro.set_result(resultado)
@@ -0,0 +1,177 @@
+"""
+Histórico de alterações das inspeções (auditoria)
+
+Cada cadastro e atualização gera uma entrada com a inspeção, quem alterou,
+quando e, para cada campo alterado, o valor anterior e o novo. As entradas
+são anexadas a `data/historico.journal`, no mesmo formato do journal de
+inspeções (uma linha CRC32 + JSON), e indexadas em memória:
+
+- por inspeção, em ordem de data: o estado de uma inspeção em um instante
+  sai do estado atual desfazendo só as alterações posteriores a ele;
+- por data: as alterações de um período saem por busca binária (bisect),
+  sem varrer o histórico inteiro;
+- na ordem do arquivo: quem acompanha o histórico (a atividade recente)
+  guarda uma marca (inode, tamanho do arquivo) e pede só as entradas
+  gravadas entre duas marcas.
+"""
+import bisect
+import itertools
+import math
+import os
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+from .journal import anexar_registros, decodificar
+from .metrics import metrics
+
+def instante(valor: Any) -> datetime:
+    """Converte datas, Timestamps e textos ISO para datetime"""
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor)
+    if isinstance(valor, date) and not isinstance(valor, datetime):
+        return datetime.combine(valor, datetime.min.time())
+    return pd.Timestamp(valor).to_pydatetime()
+
+class HistoricoInspecoes:
+    """Entradas de alteração indexadas por inspeção e por data"""
+
+    def __init__(self, caminho: str, trava):
+        self.caminho = caminho
+        self.trava = trava
+        self._lock = threading.Lock()
+        # Posição já indexada do arquivo: (inode, bytes válidos lidos)
+        self._inode = 0
+        self._lido = 0
+        # Itens (data, sequência, entrada): a sequência desempata datas iguais
+        self._seq = itertools.count()
+        self._por_data: List[Tuple[datetime, int, Dict[str, Any]]] = []
+        self._por_inspecao: Dict[str, List[Tuple[datetime, int, Dict[str, Any]]]] = {}
+        # Itens na ordem do arquivo e o byte onde cada um termina
+        self._na_ordem: List[Tuple[datetime, int, Dict[str, Any]]] = []
+        self._fins: List[int] = []
+
+    def _atualizar(self):
+        """Indexa as entradas gravadas desde a última leitura (chamar com _lock)"""
+        try:
+            f = open(self.caminho, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._lido:
+                # Arquivo substituído: reconstrói os índices
+                self._inode = stat.st_ino
+                self._lido = 0
+                self._por_data = []
+                self._por_inspecao = {}
+                self._na_ordem = []
+                self._fins = []
+            if stat.st_size == self._lido:
+                return
+            f.seek(self._lido)
+            dados = f.read()
+        metrics.add_bytes_read(len(dados))
+        entradas, valido = decodificar(dados)
+        fim = 0
+        for entrada in entradas:
+            fim = dados.index(b'\n', fim) + 1
+            self._indexar(entrada, self._lido + fim)
+        self._lido += valido
+
+    def _indexar(self, entrada: Dict[str, Any], fim: int):
+        item = (instante(entrada['em']), next(self._seq), entrada)
+        self._na_ordem.append(item)
+        self._fins.append(fim)
+        for lista in (self._por_data, self._por_inspecao.setdefault(entrada['id'], [])):
+            # Gravadas sob a trava, as entradas chegam quase sempre em ordem
+            if lista and lista[-1][0] > item[0]:
+                bisect.insort(lista, item)
+            else:
+                lista.append(item)
+
+    def carregar(self):
+        """Indexa as entradas já gravadas (aquecimento na partida)"""
+        with self._lock:
+            self._atualizar()
+
+    def registrar(self, entradas: List[Dict[str, Any]]):
+        """Anexa entradas ao histórico (uma escrita e um fsync)"""
+        if not entradas:
+            return
+        with self.trava():
+            with self._lock:
+                # Posição válida atual: restos de uma gravação interrompida são cortados
+                self._atualizar()
+                inode, valido = self._inode, self._lido
+            metrics.add_bytes_written(anexar_registros(self.caminho, entradas, inode, valido))
+
+    def da_inspecao(self, inspecao_id: str) -> List[Dict[str, Any]]:
+        """Entradas de uma inspeção, da mais antiga para a mais recente"""
+        with self._lock:
+            self._atualizar()
+            return [entrada for _, _, entrada in self._por_inspecao.get(inspecao_id, [])]
+
+    def posteriores(self, inspecao_id: str, momento: Any) -> List[Dict[str, Any]]:
+        """Entradas de uma inspeção gravadas depois de `momento`"""
+        with self._lock:
+            self._atualizar()
+            lista = self._por_inspecao.get(inspecao_id, [])
+            inicio = bisect.bisect_right(lista, (instante(momento), math.inf))
+            return [entrada for _, _, entrada in lista[inicio:]]
+
+    def entre(self, inicio: Any, fim: Any) -> List[Dict[str, Any]]:
+        """Entradas de todas as inspeções com inicio <= data <= fim"""
+        with self._lock:
+            self._atualizar()
+            i = bisect.bisect_left(self._por_data, (instante(inicio),))
+            j = bisect.bisect_right(self._por_data, (instante(fim), math.inf))
+            return [entrada for _, _, entrada in self._por_data[i:j]]
+
+    def marca(self) -> Tuple[int, int]:
+        """Posição atual do arquivo (inode, tamanho), sem ler as entradas
+
+        As entradas gravadas por completo até ela ficam "antes da marca".
+        """
+        try:
+            stat = os.stat(self.caminho)
+        except FileNotFoundError:
+            return (0, 0)
+        return (stat.st_ino, stat.st_size)
+
+    def _ate(self, marca: Tuple[int, int]) -> Optional[int]:
+        """Quantas entradas (na ordem do arquivo) ficam antes da marca; None se é de outro arquivo"""
+        if marca == (0, 0):
+            return 0
+        if marca[0] != self._inode:
+            return None
+        return bisect.bisect_right(self._fins, marca[1])
+
+    def entre_marcas(self, de: Tuple[int, int], ate: Tuple[int, int]) -> Optional[List[Dict[str, Any]]]:
+        """Entradas gravadas depois da marca `de` e antes da marca `ate`, na ordem do arquivo
+
+        None se alguma marca é de um arquivo que já foi substituído.
+        """
+        with self._lock:
+            self._atualizar()
+            i, j = self._ate(de), self._ate(ate)
+            if i is None or j is None:
+                return None
+            return [entrada for _, _, entrada in self._na_ordem[i:j]]
+
+    def recentes(self, campo: str, ate: Tuple[int, int]) -> Iterator[Dict[str, Any]]:
+        """Atualizações antes da marca `ate` que mudaram `campo`, da mais recente para a mais antiga
+
+        Gerador sobre uma cópia rasa do índice por data: quem para cedo não
+        monta a lista do histórico inteiro.
+        """
+        with self._lock:
+            self._atualizar()
+            j = self._ate(ate)
+            if not j:
+                return iter(())
+            # Sequências crescem na ordem do arquivo
+            limite = self._na_ordem[j - 1][1]
+            itens = self._por_data[:]
+        return (entrada for _, seq, entrada in reversed(itens)
+                if seq <= limite and campo in entrada['campos'])
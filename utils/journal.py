@@ -0,0 +1,284 @@
+"""
+Armazenamento em journal (somente anexação) das inspeções
+
+O estado atual é o snapshot `data/inspecoes.csv` mais o journal
+`data/inspecoes.journal` reaplicado por cima. Cadastros e atualizações
+viram registros curtos anexados ao journal (uma escrita + fsync por lote),
+em vez de regravar o CSV inteiro. Quando o journal passa do limite, uma
+thread compactadora grava um novo snapshot e recomeça o journal vazio.
+
+Cada registro ocupa uma linha `<crc32> <json>`. Na leitura, uma linha final
+incompleta ou com CRC inválido (queda no meio da gravação) encerra a
+reaplicação; a próxima gravação corta esses bytes antes de anexar.
+
+A reaplicação é idempotente: cadastros de um id já presente e atualizações
+com versão menor ou igual à da linha são ignorados, então um snapshot novo
+com o journal antigo (queda entre as duas trocas da compactação) continua
+correto.
+
+Configuração por variáveis de ambiente:
+    VISA_STORAGE             csv (padrão) ou journal
+    VISA_JOURNAL_MAX_BYTES   tamanho que dispara a compactação (padrão 4 MB)
+"""
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .arquivos import gravar_atomico
+from .metrics import metrics
+
+ARMAZENAMENTO = os.environ.get("VISA_STORAGE", "csv")
+LIMITE_JOURNAL = int(os.environ.get("VISA_JOURNAL_MAX_BYTES", str(4 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+def _json_padrao(valor: Any) -> Any:
+    """Datas e escalares numpy/pandas nos registros"""
+    if valor is pd.NaT:
+        return None
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    raise TypeError(f"Valor não serializável no journal: {valor!r}")
+
+def codificar(registro: Dict[str, Any]) -> bytes:
+    """Linha do journal: CRC32 do JSON seguido do JSON"""
+    corpo = json.dumps(registro, default=_json_padrao, ensure_ascii=False, separators=(',', ':'))
+    corpo = corpo.encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(corpo), corpo)
+
+def decodificar(dados: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    """Registros válidos e quantos bytes eles ocupam
+
+    Para na primeira linha incompleta ou corrompida; o que vem depois dela
+    não é confiável.
+    """
+    registros = []
+    valido = 0
+    while valido < len(dados):
+        fim = dados.find(b'\n', valido)
+        if fim < 0:
+            break
+        linha = dados[valido:fim]
+        try:
+            crc, corpo = linha.split(b' ', 1)
+            if int(crc, 16) != zlib.crc32(corpo):
+                break
+            registros.append(json.loads(corpo))
+        except ValueError:
+            break
+        valido = fim + 1
+    return registros, valido
+
+def anexar_registros(caminho: str, registros: List[Dict[str, Any]], inode: int, valido: int) -> int:
+    """Anexa registros com uma escrita e um fsync; retorna os bytes gravados
+
+    Se o arquivo ainda é o mesmo (`inode`) e tem bytes depois de `valido`
+    (gravação interrompida), eles são cortados antes.
+    """
+    dados = b''.join(codificar(r) for r in registros)
+    fd = os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        stat = os.fstat(fd)
+        if stat.st_ino == inode and stat.st_size > valido:
+            os.ftruncate(fd, valido)
+            metrics.incr('journal_bytes_descartados', stat.st_size - valido)
+        os.write(fd, dados)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return len(dados)
+
+class JournalInspecoes:
+    """Snapshot CSV + journal de alterações, com reaplicação incremental
+
+    `preparar` normaliza os tipos de um frame lido (datas, versão); as
+    gravações e a compactação rodam sob `trava`.
+    """
+
+    def __init__(self, caminho_base: str, trava, preparar: Callable[[pd.DataFrame], pd.DataFrame],
+                 limite: int = LIMITE_JOURNAL):
+        self.caminho_base = caminho_base
+        self.caminho = os.path.splitext(caminho_base)[0] + '.journal'
+        self.trava = trava
+        self.preparar = preparar
+        self.limite = limite
+        # Estado reaplicado: (chave do snapshot, inode do journal, bytes lidos, frame)
+        self._estado: Optional[Tuple[tuple, int, int, pd.DataFrame]] = None
+        self._lock = threading.Lock()
+        self._compactar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.bytes_descartados = 0
+
+    def _chave_base(self) -> tuple:
+        stat = os.stat(self.caminho_base)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def chave(self) -> tuple:
+        """Identifica o estado em disco (snapshot e journal)"""
+        try:
+            stat = os.stat(self.caminho)
+            journal = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            journal = (0, 0)
+        return self._chave_base() + journal
+
+    def tamanho(self) -> int:
+        """Tamanho atual do journal em bytes"""
+        try:
+            return os.path.getsize(self.caminho)
+        except FileNotFoundError:
+            return 0
+
+    def ler(self) -> pd.DataFrame:
+        """Frame completo: snapshot + journal
+
+        Se o snapshot não mudou desde a última leitura, só os registros
+        novos do journal são lidos e aplicados.
+        """
+        with self._lock:
+            # Abrir o journal antes de ler o snapshot: se uma compactação
+            # acontecer no meio, o pior caso é snapshot novo + journal antigo,
+            # que a reaplicação idempotente resolve
+            try:
+                f = open(self.caminho, 'rb')
+            except FileNotFoundError:
+                f = None
+            try:
+                tamanho = os.fstat(f.fileno()).st_size if f else 0
+                inode = os.fstat(f.fileno()).st_ino if f else 0
+                chave_base = self._chave_base()
+                estado = self._estado
+                if (estado is not None and estado[0] == chave_base and estado[1] == inode
+                        and tamanho >= estado[2]):
+                    df, inicio = estado[3], estado[2]
+                else:
+                    df = self.preparar(pd.read_csv(self.caminho_base))
+                    metrics.add_bytes_read(chave_base[1])
+                    inicio = 0
+
+                if f is not None and tamanho > inicio:
+                    f.seek(inicio)
+                    dados = f.read()
+                    metrics.add_bytes_read(len(dados))
+                    registros, valido = decodificar(dados)
+                    self.bytes_descartados = len(dados) - valido
+                    if registros:
+                        df = self.aplicar(df, registros)
+                    inicio += valido
+            finally:
+                if f is not None:
+                    f.close()
+
+            self._estado = (chave_base, inode, inicio, df)
+            return df
+
+    def aplicar(self, df: pd.DataFrame, registros: List[Dict[str, Any]]) -> pd.DataFrame:
+        """Reaplica registros sobre o frame (uma atribuição por coluna)"""
+        indice = dict(zip(df['id'].astype(str), range(len(df))))
+        versoes = df['versao'].to_numpy()
+
+        novas: Dict[str, Dict[str, Any]] = {}
+        # id -> (posição, versão aplicada, {coluna: valor})
+        atualizacoes: Dict[str, list] = {}
+        for registro in registros:
+            inspecao_id = registro['id']
+            if registro['op'] == 'criar':
+                if inspecao_id not in novas and inspecao_id not in indice:
+                    novas[inspecao_id] = dict(registro['linha'])
+                continue
+
+            campos = registro['campos']
+            if inspecao_id in novas:
+                novas[inspecao_id].update(campos)
+                continue
+
+            if inspecao_id not in atualizacoes:
+                pos = indice.get(inspecao_id)
+                if pos is None:
+                    # Linha arquivada ou removida depois da alteração
+                    continue
+                atualizacoes[inspecao_id] = [pos, int(versoes[pos]), {}]
+            alvo = atualizacoes[inspecao_id]
+            if campos['versao'] <= alvo[1]:
+                # Já contida no snapshot
+                continue
+            alvo[1] = campos['versao']
+            alvo[2].update(campos)
+
+        if atualizacoes:
+            df = df.copy(deep=False)
+            por_coluna: Dict[str, Tuple[list, list]] = {}
+            for pos, _, campos in atualizacoes.values():
+                for coluna, valor in campos.items():
+                    posicoes, valores = por_coluna.setdefault(coluna, ([], []))
+                    posicoes.append(pos)
+                    valores.append(valor)
+            for coluna, (posicoes, valores) in por_coluna.items():
+                if coluna not in df.columns:
+                    continue
+                valores = self.preparar(pd.DataFrame({coluna: valores}))[coluna]
+                df.iloc[posicoes, df.columns.get_loc(coluna)] = valores.to_numpy()
+
+        if novas:
+            linhas = self.preparar(pd.DataFrame(list(novas.values())))
+            df = pd.concat([df, linhas], ignore_index=True)
+        return df
+
+    def anexar(self, registros: List[Dict[str, Any]]):
+        """Anexa registros ao journal (uma escrita e um fsync)"""
+        with self.trava():
+            # Atualiza a posição válida; bytes de uma gravação interrompida são cortados
+            self.ler()
+            _, inode, valido, _ = self._estado
+            metrics.add_bytes_written(anexar_registros(self.caminho, registros, inode, valido))
+
+        if self.tamanho() >= self.limite:
+            self._iniciar_compactador()
+
+    def substituir(self, df: pd.DataFrame):
+        """Grava `df` como novo snapshot e recomeça o journal vazio"""
+        with self.trava():
+            gravar_atomico(self.caminho_base, lambda tmp: df.to_csv(tmp, index=False))
+            gravar_atomico(self.caminho, lambda tmp: None)
+            with self._lock:
+                # O frame gravado já é o estado atual: evita reler o snapshot
+                self._estado = (self._chave_base(), os.stat(self.caminho).st_ino, 0, df)
+
+    def compactar(self) -> bool:
+        """Incorpora o journal ao snapshot; False se já estava vazio"""
+        with self.trava():
+            if self.tamanho() == 0:
+                return False
+            self.substituir(self.ler())
+        metrics.incr('journal_compactacoes')
+        return True
+
+    def _iniciar_compactador(self):
+        self._compactar.set()
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop_compactador, name="visa-compactador",
+                                                daemon=True)
+                self._thread.start()
+
+    def _loop_compactador(self):
+        while True:
+            self._compactar.wait()
+            self._compactar.clear()
+            try:
+                # Outro processo pode ter compactado enquanto esperava a trava
+                if self.tamanho() >= self.limite:
+                    self.compactar()
+            except Exception:
+                # Tenta de novo quando o journal crescer outra vez
+                logger.exception("Falha ao compactar o journal %s", self.caminho)
+                metrics.incr('journal_compactacao_falhas')
@@ -0,0 +1,265 @@
+"""
+Instrumentação da camada de dados do Diário de Campo Digital
+
+Cada método instrumentado registra número de chamadas, histograma de
+latência, linhas varridas e bytes lidos/gravados. Os valores são por
+processo e ficam em memória.
+"""
+import bisect
+import functools
+import threading
+import time
+from collections import deque, defaultdict
+from datetime import datetime
+from typing import Any, Dict, List
+
+# Limites (ms) dos buckets do histograma: progressão geométrica de razão 1.25,
+# de 0,01 ms a ~100 s (erro de no máximo ~25% na estimativa dos percentis)
+BUCKET_BOUNDS_MS = [0.01 * 1.25 ** i for i in range(73)]
+
+# Quantas chamadas recentes guardar para a lista das mais lentas
+RECENT_CALLS = 500
+
+# Sessão sem rerun há mais que isso deixa de contar como ativa
+ACTIVE_SESSION_SECONDS = 300
+
+class MethodStats:
+    """Acumuladores de um método instrumentado"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def observe(self, elapsed_ms: float):
+        """Soma uma duração ao histograma"""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+
+    def percentile(self, q: float) -> float:
+        """Estima o percentil q (0-1) interpolando dentro do bucket"""
+        if self.count == 0:
+            return 0.0
+        alvo = q * self.count
+        acumulado = 0
+        for i, n in enumerate(self.buckets):
+            if n and acumulado + n >= alvo:
+                inferior = BUCKET_BOUNDS_MS[i - 1] if i > 0 else 0.0
+                superior = BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max_ms
+                return min(inferior + (superior - inferior) * (alvo - acumulado) / n, self.max_ms)
+            acumulado += n
+        return self.max_ms
+
+class _Call:
+    """Contadores de uma chamada em andamento"""
+    __slots__ = ('rows', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, MethodStats] = {}
+        self._recent = deque(maxlen=RECENT_CALLS)
+        self._counters = defaultdict(int)
+        self._reruns = defaultdict(int)
+        self._sessions = {}
+        self._sections: Dict[tuple, MethodStats] = {}
+        self._observations: Dict[str, MethodStats] = {}
+        self._local = threading.local()
+        self.started_at = datetime.now()
+
+    def _stack(self) -> List[_Call]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def add_rows(self, n: int):
+        """Soma linhas varridas a todas as chamadas instrumentadas em andamento"""
+        for call in self._stack():
+            call.rows += n
+
+    def add_bytes_read(self, n: int):
+        """Soma bytes lidos a todas as chamadas em andamento"""
+        for call in self._stack():
+            call.bytes_read += n
+
+    def add_bytes_written(self, n: int):
+        """Soma bytes gravados a todas as chamadas em andamento"""
+        for call in self._stack():
+            call.bytes_written += n
+
+    def record(self, name: str, elapsed_ms: float, call: _Call, error: bool = False):
+        """Registra uma chamada concluída"""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = MethodStats()
+            stats.observe(elapsed_ms)
+            stats.errors += int(error)
+            stats.rows += call.rows
+            stats.bytes_read += call.bytes_read
+            stats.bytes_written += call.bytes_written
+            self._recent.append((datetime.now(), name, elapsed_ms, call.rows))
+
+    def incr(self, name: str, n: int = 1):
+        """Incrementa um contador simples (ex.: acertos de cache)"""
+        with self._lock:
+            self._counters[name] += n
+
+    def counters(self) -> Dict[str, int]:
+        """Retorna os contadores simples"""
+        with self._lock:
+            return dict(self._counters)
+
+    def record_rerun(self, pagina: str, session_id: str = None):
+        """Registra um rerun de página e marca a sessão como ativa"""
+        agora = time.monotonic()
+        with self._lock:
+            self._reruns[pagina] += 1
+            if session_id:
+                self._sessions[session_id] = agora
+                # Descartar sessões inativas para o dicionário não crescer
+                if len(self._sessions) > 1000:
+                    limite = agora - ACTIVE_SESSION_SECONDS
+                    self._sessions = {s: t for s, t in self._sessions.items() if t >= limite}
+
+    def record_section(self, pagina: str, secao: str, elapsed_ms: float):
+        """Registra a duração de uma etapa do rerun de uma página"""
+        with self._lock:
+            stats = self._sections.get((pagina, secao))
+            if stats is None:
+                stats = self._sections[(pagina, secao)] = MethodStats()
+            stats.observe(elapsed_ms)
+
+    def section_summary(self) -> List[Dict[str, Any]]:
+        """Retorna uma linha de resumo por página e etapa"""
+        with self._lock:
+            items = list(self._sections.items())
+        return [
+            {
+                'pagina': pagina,
+                'etapa': secao,
+                'reruns': stats.count,
+                'p50_ms': stats.percentile(0.50),
+                'p95_ms': stats.percentile(0.95),
+                'p99_ms': stats.percentile(0.99),
+                'media_ms': stats.total_ms / stats.count if stats.count else 0.0,
+                'max_ms': stats.max_ms
+            }
+            for (pagina, secao), stats in sorted(items)
+        ]
+
+    def section_snapshot(self) -> Dict[tuple, MethodStats]:
+        """Retorna os acumuladores brutos das etapas (para exportação)"""
+        with self._lock:
+            return dict(self._sections)
+
+    def record_observation(self, name: str, elapsed_ms: float):
+        """Registra uma duração medida fora de uma chamada (ex.: atraso entre réplicas)"""
+        with self._lock:
+            stats = self._observations.get(name)
+            if stats is None:
+                stats = self._observations[name] = MethodStats()
+            stats.observe(elapsed_ms)
+
+    def observation_snapshot(self) -> Dict[str, MethodStats]:
+        """Retorna os histogramas das durações avulsas (para exportação)"""
+        with self._lock:
+            return dict(self._observations)
+
+    def reruns(self) -> Dict[str, int]:
+        """Retorna o número de reruns por página"""
+        with self._lock:
+            return dict(self._reruns)
+
+    def active_sessions(self) -> int:
+        """Número de sessões com rerun nos últimos minutos"""
+        limite = time.monotonic() - ACTIVE_SESSION_SECONDS
+        with self._lock:
+            return sum(1 for t in self._sessions.values() if t >= limite)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Retorna uma linha de resumo por método"""
+        with self._lock:
+            items = list(self._stats.items())
+        resumo = []
+        for name, stats in sorted(items):
+            resumo.append({
+                'metodo': name,
+                'chamadas': stats.count,
+                'erros': stats.errors,
+                'p50_ms': stats.percentile(0.50),
+                'p95_ms': stats.percentile(0.95),
+                'p99_ms': stats.percentile(0.99),
+                'media_ms': stats.total_ms / stats.count if stats.count else 0.0,
+                'max_ms': stats.max_ms,
+                'linhas': stats.rows,
+                'bytes_lidos': stats.bytes_read,
+                'bytes_gravados': stats.bytes_written
+            })
+        return resumo
+
+    def slowest_recent(self, n: int = 20) -> List[Dict[str, Any]]:
+        """Retorna as N chamadas mais lentas entre as recentes"""
+        with self._lock:
+            recent = list(self._recent)
+        recent.sort(key=lambda item: item[2], reverse=True)
+        return [
+            {'quando': quando, 'metodo': name, 'duracao_ms': ms, 'linhas': rows}
+            for quando, name, ms, rows in recent[:n]
+        ]
+
+    def snapshot(self) -> Dict[str, MethodStats]:
+        """Retorna os acumuladores brutos (para exportação)"""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self):
+        """Zera todas as métricas"""
+        with self._lock:
+            self._stats.clear()
+            self._recent.clear()
+            self._counters.clear()
+            self._reruns.clear()
+            self._sections.clear()
+            self._observations.clear()
+            self.started_at = datetime.now()
+
+def instrumentar(func):
+    """Decorator que mede as chamadas do método no registro global"""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = metrics._stack()
+        call = _Call()
+        stack.append(call)
+        inicio = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            # st.rerun e st.stop derivam de BaseException e não contam como erro
+            error = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - inicio) * 1000
+            stack.pop()
+            metrics.record(name, elapsed_ms, call, error)
+
+    return wrapper
+
+# Instância global do registro de métricas
+metrics = MetricsRegistry()
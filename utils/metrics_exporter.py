@@ -0,0 +1,303 @@
+"""
+Exportador de métricas no formato de exposição do Prometheus
+
+Publica as métricas do processo em http://127.0.0.1:<porta>/metrics e,
+opcionalmente, grava o mesmo conteúdo em um arquivo para o textfile
+collector do node_exporter. A rota /pronto responde 200 depois do
+aquecimento da partida (utils/aquecimento.py) e 503 antes, para o
+health check do balanceador. Com várias réplicas na mesma máquina, cada
+uma precisa da sua porta (VISA_METRICS_PORT distinto): a que não consegue
+a porta registra um aviso no log e fica sem endpoint.
+
+Configuração por variáveis de ambiente:
+    VISA_METRICS_PORT      porta do endpoint local (padrão 9464; 0 desativa)
+    VISA_METRICS_HOST      interface de escuta (padrão 127.0.0.1)
+    VISA_METRICS_TEXTFILE  caminho do arquivo .prom (desativado se vazio)
+    VISA_METRICS_INTERVAL  intervalo de gravação do arquivo, em segundos
+"""
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from .metrics import metrics, BUCKET_BOUNDS_MS
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Limites (ms) publicados nos histogramas: subconjunto dos buckets internos
+EXPORT_BOUNDS_MS = [b for b in BUCKET_BOUNDS_MS if b >= 0.5][::4]
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label(**labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+def _header(lines: List[str], name: str, kind: str, help_text: str):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def _histogram(lines: List[str], name: str, s, **labels):
+    acumulado = 0
+    idx = 0
+    for bound in EXPORT_BOUNDS_MS:
+        while idx < len(BUCKET_BOUNDS_MS) and BUCKET_BOUNDS_MS[idx] <= bound:
+            acumulado += s.buckets[idx]
+            idx += 1
+        lines.append(f"{name}_bucket{_label(**labels, le=f'{bound / 1000:.6g}')} {acumulado}")
+    lines.append(f"{name}_bucket{_label(**labels, le='+Inf')} {s.count}")
+    lines.append(f"{name}_sum{_label(**labels)} {s.total_ms / 1000:.6f}")
+    lines.append(f"{name}_count{_label(**labels)} {s.count}")
+
+def render_metrics() -> str:
+    """Monta o texto de exposição com as métricas atuais do processo"""
+    from .data_manager import data_manager
+
+    lines = []
+
+    _header(lines, "visa_active_sessions", "gauge", "Sessões com rerun nos últimos 5 minutos")
+    lines.append(f"visa_active_sessions {metrics.active_sessions()}")
+
+    from .aquecimento import aquecimento
+    situacao = aquecimento.situacao()
+    _header(lines, "visa_warmup_ready", "gauge", "1 depois do aquecimento da partida")
+    lines.append(f"visa_warmup_ready {int(situacao['pronto'])}")
+    _header(lines, "visa_warmup_step_seconds", "gauge", "Duração de cada etapa do aquecimento")
+    for etapa in situacao['etapas']:
+        if etapa['ms'] is not None:
+            lines.append(f"visa_warmup_step_seconds{_label(step=etapa['etapa'])} {etapa['ms'] / 1000:.6f}")
+
+    _header(lines, "visa_data_version", "gauge", "Versão dos dados de inspeções neste processo")
+    lines.append(f"visa_data_version {data_manager.canal.versao}")
+
+    _header(lines, "visa_replica_staleness_seconds", "histogram",
+            "Atraso entre a gravação em outra réplica e a invalidação dos caches desta")
+    atraso = metrics.observation_snapshot().get('replica_atraso')
+    if atraso is not None:
+        _histogram(lines, "visa_replica_staleness_seconds", atraso)
+
+    _header(lines, "visa_page_reruns_total", "counter", "Reruns por página")
+    for pagina, n in sorted(metrics.reruns().items()):
+        lines.append(f"visa_page_reruns_total{_label(page=pagina)} {n}")
+
+    counters = metrics.counters()
+    hits = counters.get('data_cache_hits', 0)
+    misses = counters.get('data_cache_misses', 0)
+    _header(lines, "visa_data_cache_requests_total", "counter", "Leituras do frame de inspeções por resultado do cache")
+    lines.append(f"visa_data_cache_requests_total{_label(result='hit')} {hits}")
+    lines.append(f"visa_data_cache_requests_total{_label(result='miss')} {misses}")
+    _header(lines, "visa_data_cache_hit_ratio", "gauge", "Fração de leituras servidas pelo cache")
+    lines.append(f"visa_data_cache_hit_ratio {hits / (hits + misses) if hits + misses else 0:.6f}")
+
+    try:
+        storage = data_manager.get_storage_stats()
+        _header(lines, "visa_storage_file_bytes", "gauge", "Tamanho dos arquivos de inspeções")
+        lines.append(f"visa_storage_file_bytes{_label(store='quente')} {storage['arquivo_bytes']}")
+        lines.append(f"visa_storage_file_bytes{_label(store='frio')} {storage['arquivo_frio_bytes']}")
+        lines.append(f"visa_storage_file_bytes{_label(store='journal')} {storage['journal_bytes']}")
+        lines.append(f"visa_storage_file_bytes{_label(store='snapshot')} {storage['snapshot_bytes']}")
+        _header(lines, "visa_storage_rows", "gauge", "Inspeções armazenadas")
+        lines.append(f"visa_storage_rows{_label(store='quente')} {storage['linhas']}")
+        lines.append(f"visa_storage_rows{_label(store='frio')} {storage['linhas_frio']}")
+    except OSError:
+        pass
+
+    # Histogramas por método: leitura/gravação do CSV, notificações, login...
+    stats = metrics.snapshot()
+    _header(lines, "visa_method_duration_seconds", "histogram", "Latência dos métodos instrumentados")
+    for name, s in sorted(stats.items()):
+        _histogram(lines, "visa_method_duration_seconds", s, method=name)
+
+    _header(lines, "visa_page_section_duration_seconds", "histogram", "Duração das etapas de cada rerun")
+    for (pagina, secao), s in sorted(metrics.section_snapshot().items()):
+        _histogram(lines, "visa_page_section_duration_seconds", s, page=pagina, section=secao)
+
+    _header(lines, "visa_auto_reruns_total", "counter", "Reruns pedidos às sessões porque os dados mudaram")
+    lines.append(f"visa_auto_reruns_total {counters.get('reruns_automaticos', 0)}")
+
+    _header(lines, "visa_reruns_over_budget_total", "counter", "Reruns acima do orçamento de tempo")
+    lines.append(f"visa_reruns_over_budget_total {counters.get('reruns_acima_orcamento', 0)}")
+
+    _header(lines, "visa_write_batches_total", "counter", "Gravações do arquivo feitas pelo gravador agrupado")
+    lines.append(f"visa_write_batches_total {counters.get('escrita_lotes', 0)}")
+    _header(lines, "visa_write_mutations_total", "counter", "Cadastros e atualizações gravados em lote")
+    lines.append(f"visa_write_mutations_total {counters.get('escrita_alteracoes', 0)}")
+
+    _header(lines, "visa_replica_versions_received_total", "counter", "Versões recebidas de outras réplicas")
+    lines.append(f"visa_replica_versions_received_total {counters.get('replicas_versoes_recebidas', 0)}")
+    _header(lines, "visa_replica_registry_errors_total", "counter", "Falhas de leitura/gravação no registro de réplicas")
+    lines.append(f"visa_replica_registry_errors_total {counters.get('replicas_falhas', 0)}")
+
+    _header(lines, "visa_snapshot_loads_total", "counter", "Cargas do frame pelo snapshot Arrow mapeado")
+    lines.append(f"visa_snapshot_loads_total {counters.get('snapshot_mapeados', 0)}")
+    _header(lines, "visa_snapshot_publications_total", "counter", "Snapshots Arrow gravados por este processo")
+    lines.append(f"visa_snapshot_publications_total {counters.get('snapshot_publicados', 0)}")
+    _header(lines, "visa_snapshot_failures_total", "counter", "Publicações do snapshot que falharam (carga pelo CSV)")
+    lines.append(f"visa_snapshot_failures_total {counters.get('snapshot_falhas', 0)}")
+
+    _header(lines, "visa_nightly_report_views_total", "counter", "Visões dos Indicadores servidas pelo snapshot noturno")
+    lines.append(f"visa_nightly_report_views_total {counters.get('relatorios_noturnos_servidos', 0)}")
+    _header(lines, "visa_nightly_report_failures_total", "counter", "Leituras do snapshot noturno que falharam (cálculo na hora)")
+    lines.append(f"visa_nightly_report_failures_total {counters.get('relatorios_noturnos_falhas', 0)}")
+
+    from .resumos import resumos_dashboard
+    situacao = resumos_dashboard.situacao()
+    _header(lines, "visa_dashboard_summaries", "gauge", "Resumos do Dashboard guardados por estado")
+    lines.append(f"visa_dashboard_summaries{_label(state='current')} {situacao['atuais']}")
+    lines.append(f"visa_dashboard_summaries{_label(state='stale')} {situacao['guardados'] - situacao['atuais']}")
+    _header(lines, "visa_dashboard_summary_total", "counter", "Consultas e recálculos dos resumos do Dashboard")
+    for resultado, contador in (('hit', 'resumos_hits'), ('miss', 'resumos_misses'),
+                                ('refreshed', 'resumos_recalculados'), ('failed', 'resumos_falhas')):
+        lines.append(f"visa_dashboard_summary_total{_label(result=resultado)} {counters.get(contador, 0)}")
+
+    from .tarefas import fila_tarefas
+    _header(lines, "visa_jobs", "gauge", "Tarefas em segundo plano por estado")
+    for estado, n in fila_tarefas.contagem().items():
+        lines.append(f"visa_jobs{_label(state=estado)} {n}")
+    _header(lines, "visa_jobs_total", "counter", "Tarefas em segundo plano por resultado")
+    for resultado, contador in (('submitted', 'tarefas_enviadas'), ('rejected', 'tarefas_recusadas'),
+                                ('completed', 'tarefas_concluidas'), ('failed', 'tarefas_falhas'),
+                                ('cancelled', 'tarefas_canceladas')):
+        lines.append(f"visa_jobs_total{_label(result=resultado)} {counters.get(contador, 0)}")
+    _header(lines, "visa_job_duration_seconds", "histogram", "Duração das tarefas concluídas no pool de processos")
+    for nome, s in sorted(metrics.observation_snapshot().items()):
+        if nome.startswith('tarefa_'):
+            _histogram(lines, "visa_job_duration_seconds", s, type=nome[len('tarefa_'):])
+
+    _header(lines, "visa_journal_compactions_total", "counter", "Compactações do journal em novo snapshot")
+    lines.append(f"visa_journal_compactions_total {counters.get('journal_compactacoes', 0)}")
+    _header(lines, "visa_journal_compaction_failures_total", "counter", "Compactações do journal que falharam")
+    lines.append(f"visa_journal_compaction_failures_total {counters.get('journal_compactacao_falhas', 0)}")
+
+    _header(lines, "visa_history_write_failures_total", "counter", "Lotes gravados sem a entrada de histórico")
+    lines.append(f"visa_history_write_failures_total {counters.get('historico_falhas', 0)}")
+
+    _header(lines, "visa_version_conflicts_total", "counter", "Atualizações recusadas por conflito de versão")
+    lines.append(f"visa_version_conflicts_total {counters.get('conflitos_versao', 0)}")
+
+    _header(lines, "visa_method_errors_total", "counter", "Chamadas que terminaram em exceção")
+    for name, s in sorted(stats.items()):
+        lines.append(f"visa_method_errors_total{_label(method=name)} {s.errors}")
+
+    _header(lines, "visa_method_rows_scanned_total", "counter", "Linhas varridas por método")
+    for name, s in sorted(stats.items()):
+        lines.append(f"visa_method_rows_scanned_total{_label(method=name)} {s.rows}")
+
+    _header(lines, "visa_method_bytes_total", "counter", "Bytes lidos/gravados por método")
+    for name, s in sorted(stats.items()):
+        lines.append(f"visa_method_bytes_total{_label(method=name, direction='read')} {s.bytes_read}")
+        lines.append(f"visa_method_bytes_total{_label(method=name, direction='write')} {s.bytes_written}")
+
+    return "\n".join(lines) + "\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        rota = self.path.split('?')[0]
+        if rota == '/pronto':
+            self._pronto()
+            return
+        if rota != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _pronto(self):
+        from .aquecimento import aquecimento
+        # O health check também dispara o aquecimento de um processo que ainda não o começou
+        aquecimento.iniciar()
+        situacao = aquecimento.situacao()
+        body = json.dumps(situacao, ensure_ascii=False).encode('utf-8')
+        self.send_response(200 if situacao['pronto'] else 503)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Sem log de acesso a cada scrape
+        pass
+
+def write_textfile(path: str):
+    """Grava as métricas no arquivo .prom (escrita atômica)"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(render_metrics())
+    os.replace(tmp, path)
+
+class MetricsExporter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.textfile_thread: Optional[threading.Thread] = None
+        self.started = False
+
+    @property
+    def port(self) -> Optional[int]:
+        return self.server.server_address[1] if self.server else None
+
+    def start(self, port: int = None, host: str = None, textfile: str = None):
+        """Inicia o endpoint e o textfile collector (uma vez por processo)"""
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+            
+            if port is None:
+                port = int(os.environ.get("VISA_METRICS_PORT", "9464"))
+                habilitado = port != 0
+            else:
+                # Porta explícita: 0 deixa o sistema escolher uma porta livre
+                habilitado = True
+            host = host or os.environ.get("VISA_METRICS_HOST", "127.0.0.1")
+            textfile = textfile or os.environ.get("VISA_METRICS_TEXTFILE", "")
+
+            if habilitado:
+                try:
+                    self.server = ThreadingHTTPServer((host, port), _Handler)
+                    self.server.daemon_threads = True
+                    threading.Thread(target=self.server.serve_forever, name="visa-metrics",
+                                     daemon=True).start()
+                except OSError as e:
+                    # Porta ocupada (outra réplica na mesma porta): segue sem
+                    # endpoint, e sem /pronto próprio para o balanceador
+                    logger.warning("Endpoint de métricas desativado: não foi possível escutar em %s:%s (%s); "
+                                   "defina um VISA_METRICS_PORT distinto para cada réplica", host, port, e)
+                    self.server = None
+
+            if textfile:
+                intervalo = float(os.environ.get("VISA_METRICS_INTERVAL", "15"))
+
+                def loop():
+                    while True:
+                        try:
+                            write_textfile(textfile)
+                        except OSError:
+                            pass
+                        time.sleep(intervalo)
+
+                self.textfile_thread = threading.Thread(target=loop, name="visa-metrics-textfile",
+                                                        daemon=True)
+                self.textfile_thread.start()
+
+    def stop(self):
+        """Encerra o endpoint HTTP"""
+        with self._lock:
+            if self.server:
+                self.server.shutdown()
+                self.server.server_close()
+                self.server = None
+            self.started = False
+
+# Instância global do exportador de métricas
+metrics_exporter = MetricsExporter()
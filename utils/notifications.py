@@ -4,29 +4,32 @@ Sistema de notificações para o Diário de Campo Digital
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from .data_manager import data_manager
+from .calendario import calendario
+from .metrics import instrumentar
 
 class NotificationManager:
     def __init__(self):
         self.data_manager = data_manager
     
+    @instrumentar
     def get_notifications(self, user_id: int, user_profile: str) -> List[Dict[str, Any]]:
         """Retorna lista de notificações para o usuário"""
         notifications = []
         
-        # Buscar inspeções vencidas
+        # Buscar inspeções vencidas (dias úteis de atraso do prazo mais urgente)
         vencidas = self.data_manager.get_inspecoes_vencidas()
         if user_profile == 'inspetor':
             vencidas = vencidas[vencidas['inspetor_id'] == user_id]
         
-        for _, inspecao in vencidas.iterrows():
+        for inspecao, dias in self._com_dias_uteis(vencidas):
             notifications.append({
                 'tipo': 'vencida',
                 'titulo': 'Inspeção Vencida',
-                'mensagem': f"Estabelecimento: {inspecao['estabelecimento']}",
+                'mensagem': f"Estabelecimento: {inspecao['estabelecimento']} ({-dias} dia(s) útil(eis) de atraso)",
                 'urgencia': 'alta',
-                'data': inspecao['prazo_inspetor'] or inspecao['prazo_coordenacao']
+                'data': self._prazo(inspecao)
             })
         
         # Buscar inspeções próximas do vencimento
@@ -34,20 +37,38 @@ class NotificationManager:
         if user_profile == 'inspetor':
             proximas = proximas[proximas['inspetor_id'] == user_id]
         
-        for _, inspecao in proximas.iterrows():
+        for inspecao, dias in self._com_dias_uteis(proximas):
             notifications.append({
                 'tipo': 'proxima_vencimento',
                 'titulo': 'Prazo Próximo',
-                'mensagem': f"Estabelecimento: {inspecao['estabelecimento']}",
+                'mensagem': f"Estabelecimento: {inspecao['estabelecimento']} "
+                            f"({'vence hoje' if dias == 0 else f'{dias} dia(s) útil(eis) restante(s)'})",
                 'urgencia': 'media',
-                'data': inspecao['prazo_inspetor'] or inspecao['prazo_coordenacao']
+                'data': self._prazo(inspecao)
             })
         
-        return sorted(notifications, key=lambda x: x['data'] if x['data'] else datetime.min)
+        return sorted(notifications, key=lambda x: x['data'] if pd.notna(x['data']) else datetime.min)
     
-    def show_notifications_sidebar(self, user_id: int, user_profile: str):
-        """Exibe notificações na sidebar"""
-        notifications = self.get_notifications(user_id, user_profile)
+    @staticmethod
+    def _com_dias_uteis(df: pd.DataFrame):
+        """Linhas (estabelecimento e prazos) com os dias úteis restantes do prazo mais urgente"""
+        dias = calendario.situacao_prazos(df)['dias_uteis'] if len(df) > 0 else []
+        linhas = df[['estabelecimento', 'prazo_inspetor', 'prazo_coordenacao']].to_dict('records')
+        return zip(linhas, (int(d) for d in dias))
+    
+    @staticmethod
+    def _prazo(inspecao) -> Any:
+        """Prazo do inspetor ou, na falta dele, o da coordenação (NaT é verdadeiro em `or`)"""
+        if pd.notna(inspecao['prazo_inspetor']):
+            return inspecao['prazo_inspetor']
+        return inspecao['prazo_coordenacao'] if pd.notna(inspecao['prazo_coordenacao']) else None
+    
+    @instrumentar
+    def show_notifications_sidebar(self, user_id: int, user_profile: str,
+                                   notifications: Optional[List[Dict[str, Any]]] = None):
+        """Exibe notificações na sidebar (`notifications`: lista já calculada, ex. do resumo do Dashboard)"""
+        if notifications is None:
+            notifications = self.get_notifications(user_id, user_profile)
         
         if notifications:
             st.sidebar.markdown("### 🔔 Notificações")
@@ -63,9 +84,12 @@ class NotificationManager:
             if len(notifications) > 5:
                 st.sidebar.info(f"... e mais {len(notifications) - 5} notificações")
     
-    def show_dashboard_alerts(self, user_id: int, user_profile: str):
+    @instrumentar
+    def show_dashboard_alerts(self, user_id: int, user_profile: str,
+                              notifications: Optional[List[Dict[str, Any]]] = None):
         """Exibe alertas no dashboard principal"""
-        notifications = self.get_notifications(user_id, user_profile)
+        if notifications is None:
+            notifications = self.get_notifications(user_id, user_profile)
         
         if not notifications:
             st.success("✅ Nenhum alerta no momento!")
@@ -91,7 +115,7 @@ class NotificationManager:
         if notifications:
             with st.expander("Ver detalhes dos alertas"):
                 for notif in notifications:
-                    data_str = notif['data'].strftime("%d/%m/%Y") if notif['data'] else "Data não definida"
+                    data_str = notif['data'].strftime("%d/%m/%Y") if pd.notna(notif['data']) else "Data não definida"
                     if notif['urgencia'] == 'alta':
                         st.error(f"🔴 **{notif['titulo']}** - {notif['mensagem']} (Prazo: {data_str})")
                     else:
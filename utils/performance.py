@@ -0,0 +1,182 @@
+"""
+Medições de desempenho das páginas do Diário de Campo Digital
+
+Cada rerun de página é medido por etapas (autenticação, dados, filtros,
+gráficos, tabelas...). Reruns acima do orçamento são sinalizados, e um
+usuário da gerência pode ligar o cProfile para a própria sessão.
+
+Uso nas páginas:
+    iniciar_rerun("Dashboard")      # logo após st.set_page_config
+    etapa("autenticação")
+    ...
+    def main():
+        etapa("dados")
+        ...
+    with medir_rerun("Dashboard"):
+        main()
+"""
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Medição de memória de pico por rerun (opt-in: tracemalloc tem custo)
+MEDIR_MEMORIA = os.environ.get("VISA_MEDIR_MEMORIA", "0") == "1"
+
+# Orçamento de tempo de um rerun, em milissegundos
+ORCAMENTO_RERUN_MS = float(os.environ.get("VISA_RERUN_BUDGET_MS", "2000"))
+
+# Quantos reruns acima do orçamento guardar para a página de Desempenho
+RERUNS_LENTOS = 100
+
+_local = threading.local()
+_lentos_lock = threading.Lock()
+_reruns_lentos = deque(maxlen=RERUNS_LENTOS)
+
+class RerunTiming:
+    """Cronômetro de um rerun, dividido em etapas"""
+
+    def __init__(self, pagina: str):
+        self.pagina = pagina
+        self.inicio = time.perf_counter()
+        self.etapas: List[tuple] = []
+        self._etapa_atual: Optional[str] = None
+        self._etapa_inicio = self.inicio
+
+    def etapa(self, nome: Optional[str]):
+        """Encerra a etapa em andamento e inicia a próxima"""
+        agora = time.perf_counter()
+        if self._etapa_atual is not None:
+            self.etapas.append((self._etapa_atual, (agora - self._etapa_inicio) * 1000))
+        self._etapa_atual = nome
+        self._etapa_inicio = agora
+
+    def finalizar(self) -> float:
+        """Fecha a última etapa e retorna a duração total em ms"""
+        self.etapa(None)
+        return (time.perf_counter() - self.inicio) * 1000
+
+def iniciar_rerun(pagina: str) -> RerunTiming:
+    """Inicia a medição do rerun atual (uma por thread de script)"""
+    rerun = RerunTiming(pagina)
+    _local.rerun = rerun
+    ctx = get_script_run_ctx()
+    metrics.record_rerun(pagina, ctx.session_id if ctx else None)
+    return rerun
+
+def etapa(nome: str):
+    """Marca o início de uma etapa no rerun em andamento"""
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is not None:
+        rerun.etapa(nome)
+
+def profiling_ativo() -> bool:
+    """Indica se o cProfile está ligado para a sessão atual"""
+    return bool(st.session_state.get('cprofile_ativo'))
+
+def ativar_profiling(ativo: bool):
+    """Liga/desliga o cProfile nos reruns da sessão atual"""
+    st.session_state.cprofile_ativo = ativo
+    if ativo and 'cprofile' not in st.session_state:
+        st.session_state.cprofile = cProfile.Profile()
+
+def limpar_profiling():
+    """Descarta as estatísticas acumuladas do cProfile da sessão"""
+    st.session_state.cprofile = cProfile.Profile()
+
+def _profiling_stats(stream=None) -> Optional[pstats.Stats]:
+    profile = st.session_state.get('cprofile')
+    if profile is None:
+        return None
+    try:
+        return pstats.Stats(profile, stream=stream)
+    except TypeError:
+        # Nenhuma chamada registrada ainda
+        return None
+
+def profiling_stats_bytes() -> Optional[bytes]:
+    """Retorna o arquivo de estatísticas da sessão (formato do pstats)"""
+    stats = _profiling_stats()
+    return marshal.dumps(stats.stats) if stats else None
+
+def profiling_resumo(limite: int = 25) -> str:
+    """Retorna as funções com maior tempo acumulado (texto do pstats)"""
+    saida = io.StringIO()
+    stats = _profiling_stats(saida)
+    if stats is None:
+        return ""
+    stats.sort_stats('cumulative').print_stats(limite)
+    return saida.getvalue()
+
+def reruns_lentos() -> List[Dict[str, Any]]:
+    """Retorna os reruns recentes que passaram do orçamento"""
+    with _lentos_lock:
+        return list(_reruns_lentos)
+
+@contextmanager
+def medir_rerun(pagina: str):
+    """Mede o rerun da página: etapas, orçamento, memória e cProfile
+
+    O tracemalloc é global ao processo: com várias sessões simultâneas o
+    pico medido inclui as alocações das outras sessões.
+    """
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is None or rerun.pagina != pagina:
+        rerun = iniciar_rerun(pagina)
+
+    if MEDIR_MEMORIA:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        memoria_inicio, _ = tracemalloc.get_traced_memory()
+
+    profile = st.session_state.get('cprofile') if profiling_ativo() else None
+    if profile is not None:
+        profile.enable()
+
+    try:
+        yield rerun
+    finally:
+        if profile is not None:
+            profile.disable()
+
+        total_ms = rerun.finalizar()
+        _local.rerun = None
+
+        for nome, ms in rerun.etapas:
+            metrics.record_section(pagina, nome, ms)
+        metrics.record_section(pagina, 'total', total_ms)
+
+        if total_ms > ORCAMENTO_RERUN_MS:
+            metrics.incr('reruns_acima_orcamento')
+            logger.warning("Rerun de %s levou %.0f ms (orçamento %.0f ms): %s", pagina, total_ms,
+                           ORCAMENTO_RERUN_MS, ", ".join(f"{n}={ms:.0f}ms" for n, ms in rerun.etapas))
+            with _lentos_lock:
+                _reruns_lentos.append({
+                    'quando': datetime.now(),
+                    'pagina': pagina,
+                    'total_ms': total_ms,
+                    'etapas': dict(rerun.etapas)
+                })
+
+        if MEDIR_MEMORIA:
+            _, pico = tracemalloc.get_traced_memory()
+            pico_mb = max(pico - memoria_inicio, 0) / (1024 * 1024)
+            if 'memoria_rerun' not in st.session_state:
+                st.session_state.memoria_rerun = {}
+            st.session_state.memoria_rerun[pagina] = pico_mb
+            st.sidebar.caption(f"💾 Pico de memória do rerun: {pico_mb:.1f} MB")
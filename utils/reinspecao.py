@@ -0,0 +1,192 @@
+"""
+Agenda de reinspeções por CNPJ conforme o risco
+
+Cada estabelecimento é reinspecionado em um ciclo definido pela
+classificação de risco da sua última inspeção (PERIODICIDADE_MESES: alto a
+cada 6 meses, médio a cada 12, baixo a cada 24). A próxima reinspeção é a
+data da última inspeção mais o ciclo; quando cai em dia não útil, vale o
+dia útil seguinte (utils/calendario.py).
+
+A última inspeção de cada CNPJ sai de uma passada ordenada sobre todo o
+histórico (armazenamento quente e arquivo frio). A tabela fica em memória
+para uma versão dos dados (CanalVersao) e é atualizada pelas gravações do
+próprio processo: DataManager._aplicar_alteracoes passa as linhas
+cadastradas e alteradas, e só os CNPJs delas são recalculados. Gravações
+de outros processos ou réplicas, e a rara edição que tira de um CNPJ a sua
+última inspeção, fazem a tabela ser reconstruída uma vez.
+
+Configuração por variáveis de ambiente:
+    VISA_REINSPECAO_HORIZONTE_MESES   meses do calendário de carga (padrão 12)
+"""
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import pandas as pd
+from .calendario import calendario
+from .schema import id_to_key
+
+# Meses entre reinspeções por classificação de risco
+PERIODICIDADE_MESES = {'alto': 6, 'medio': 12, 'baixo': 24}
+
+HORIZONTE_MESES = int(os.environ.get("VISA_REINSPECAO_HORIZONTE_MESES", "12"))
+
+# Campos da inspeção que mudam a agenda do seu CNPJ
+CAMPOS_AGENDA = {'cnpj', 'estabelecimento', 'territorio', 'inspetor_id',
+                 'classificacao_risco', 'data_inspecao', 'status'}
+
+COLUNAS = ['cnpj', 'id', 'estabelecimento', 'territorio', 'inspetor_id', 'classificacao_risco',
+           'status', 'ultima_inspecao', 'data_criacao', 'proxima_reinspecao']
+
+def _vazia() -> pd.DataFrame:
+    vazia = pd.DataFrame(columns=COLUNAS)
+    for coluna in ('ultima_inspecao', 'data_criacao', 'proxima_reinspecao'):
+        vazia[coluna] = pd.to_datetime(vazia[coluna])
+    return vazia.set_index('cnpj', drop=False)
+
+def proximas_reinspecoes(ultima: pd.Series, risco: pd.Series) -> pd.Series:
+    """Data da próxima reinspeção (NaT para risco desconhecido ou sem data)"""
+    ultima = pd.to_datetime(ultima)
+    proxima = pd.Series(pd.NaT, index=ultima.index, dtype='datetime64[ns]')
+    risco = risco.astype(object)
+    for classificacao, meses in PERIODICIDADE_MESES.items():
+        mask = (risco == classificacao).to_numpy(dtype=bool)
+        if mask.any():
+            proxima[mask] = ultima[mask] + pd.DateOffset(months=meses)
+    # Ciclo vencendo em fim de semana ou feriado vale no dia útil seguinte
+    return pd.Series(calendario.vencimentos(proxima), index=ultima.index).astype('datetime64[ns]')
+
+def ultimas_por_cnpj(df: pd.DataFrame) -> pd.DataFrame:
+    """Última inspeção de cada CNPJ (pela data da inspeção, depois a do cadastro) e a próxima reinspeção
+
+    Aceita o frame compacto, o completo ou linhas novas; o resultado usa
+    tipos simples (texto, Int64, datetime) e é indexado pelo CNPJ.
+    """
+    if len(df) == 0:
+        return _vazia()
+    base = pd.DataFrame({
+        'cnpj': df['cnpj'].astype(object),
+        'id': df['id'],
+        'estabelecimento': df['estabelecimento'].astype(object),
+        'territorio': df['territorio'].astype(object),
+        'inspetor_id': pd.to_numeric(df['inspetor_id'], errors='coerce').astype('Int64'),
+        'classificacao_risco': df['classificacao_risco'].astype(object),
+        'status': df['status'].astype(object),
+        'ultima_inspecao': pd.to_datetime(df['data_inspecao'], errors='coerce'),
+        'data_criacao': pd.to_datetime(df['data_criacao'], errors='coerce')
+    })
+    base = base[base['cnpj'].notna() & (base['cnpj'] != '') & base['ultima_inspecao'].notna()]
+    ultimas = (base.sort_values(['ultima_inspecao', 'data_criacao'], na_position='first', kind='stable')
+                   .drop_duplicates('cnpj', keep='last'))
+    ultimas['proxima_reinspecao'] = proximas_reinspecoes(ultimas['ultima_inspecao'],
+                                                         ultimas['classificacao_risco'])
+    return ultimas.set_index('cnpj', drop=False)
+
+def _momento(linha: Dict[str, Any]) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """Ordem das inspeções de um CNPJ: data da inspeção, depois a do cadastro"""
+    criacao = pd.Timestamp(linha['data_criacao']) if pd.notna(linha.get('data_criacao')) else pd.Timestamp.min
+    return pd.Timestamp(linha['data_inspecao']), criacao
+
+def agenda(ultimas: pd.DataFrame, hoje=None) -> pd.DataFrame:
+    """Reinspeções por CNPJ, da mais atrasada para a mais distante
+
+    Acrescenta `dias_restantes` (dias corridos até a reinspeção, negativo =
+    atraso) e `atrasada`.
+    """
+    hoje = pd.Timestamp(hoje or datetime.now().date()).normalize()
+    resultado = ultimas[ultimas['proxima_reinspecao'].notna()].reset_index(drop=True)
+    resultado['dias_restantes'] = (resultado['proxima_reinspecao'] - hoje).dt.days
+    resultado['atrasada'] = resultado['dias_restantes'] < 0
+    return resultado.sort_values('proxima_reinspecao', kind='stable', ignore_index=True)
+
+def carga_reinspecoes(agendadas: pd.DataFrame, coluna: str, hoje=None,
+                      meses: int = HORIZONTE_MESES) -> pd.DataFrame:
+    """Reinspeções por `coluna` (territorio ou inspetor_id) e mês de vencimento
+
+    Colunas: `coluna`, Atrasadas, um mês por coluna (MM/AAAA) do mês corrente
+    em diante por `meses` meses, e Total. Reinspeções além do horizonte
+    ficam de fora.
+    """
+    hoje = pd.Timestamp(hoje or datetime.now().date())
+    rotulos = [periodo.strftime('%m/%Y')
+               for periodo in pd.period_range(hoje.to_period('M'), periods=meses, freq='M')]
+
+    # Coluna 0 = atrasadas; 1..meses = meses a partir do corrente
+    vencimento = agendadas['proxima_reinspecao']
+    mes = (vencimento.dt.year * 12 + vencimento.dt.month) - (hoje.year * 12 + hoje.month) + 1
+    mes = mes.where(~agendadas['atrasada'], 0)
+    dentro = (mes <= meses).to_numpy(dtype=bool)
+
+    carga = (agendadas[dentro].groupby([agendadas[coluna][dentro], mes[dentro].rename('mes')])
+                              .size().unstack(fill_value=0)
+                              .reindex(columns=range(meses + 1), fill_value=0))
+    carga.columns = ['Atrasadas'] + rotulos
+    carga['Total'] = carga.sum(axis=1)
+    return carga.sort_values('Total', ascending=False).reset_index()
+
+class AgendaReinspecoes:
+    """Última inspeção e próxima reinspeção por CNPJ, mantidas por versão dos dados"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Versão dos dados refletida na tabela (None: reconstruir na próxima leitura)
+        self.versao = None
+        self._ultimas = _vazia()
+
+    def reconstruir(self, df: pd.DataFrame, versao: int, arquivo: Optional[pd.DataFrame] = None):
+        """Recria a tabela a partir do frame quente e das últimas do arquivo frio
+
+        `arquivo`: resultado de ultimas_por_cnpj sobre o arquivo frio (muda
+        só no arquivamento, então o DataManager guarda o cálculo).
+        """
+        ultimas = ultimas_por_cnpj(df)
+        if arquivo is not None and len(arquivo) > 0:
+            juntas = pd.concat([arquivo, ultimas], ignore_index=True)
+            ultimas = ultimas_por_cnpj(juntas.rename(columns={'ultima_inspecao': 'data_inspecao'}))
+        with self._lock:
+            self._ultimas = ultimas
+            self.versao = versao
+
+    def registrar(self, alteradas: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]],
+                  versao_antes: int, versao_depois: int):
+        """Linhas cadastradas ou alteradas por uma gravação deste processo
+
+        `alteradas`: (linha como ficou, valores anteriores de cnpj e
+        data_inspecao ou None nos cadastros). Só os CNPJs dessas linhas são
+        recalculados, e só se a tabela estava na versão de antes da gravação.
+        """
+        with self._lock:
+            if self.versao != versao_antes or versao_depois != versao_antes + 1:
+                self.versao = None
+                return
+            ultimas = self._ultimas
+            novas: Dict[Any, Dict[str, Any]] = {}
+            for linha, anterior in alteradas:
+                chave = id_to_key(linha['id'])
+                cnpj_antes = anterior['cnpj'] if anterior else None
+                vigente = ultimas.loc[cnpj_antes] if cnpj_antes in ultimas.index else None
+                if vigente is not None and id_to_key(vigente['id']) == chave and (
+                        cnpj_antes != linha['cnpj'] or pd.isna(linha['data_inspecao'])
+                        or pd.Timestamp(linha['data_inspecao']) < vigente['ultima_inspecao']):
+                    # A última inspeção do CNPJ deixou de ser a última: a
+                    # anterior a ela só está no histórico completo
+                    self.versao = None
+                    return
+                if pd.isna(linha['data_inspecao']) or not linha['cnpj']:
+                    continue
+                cnpj = linha['cnpj']
+                vigente = novas.get(cnpj)
+                if vigente is None and cnpj in ultimas.index:
+                    atual = ultimas.loc[cnpj]
+                    vigente = {'id': atual['id'], 'data_inspecao': atual['ultima_inspecao'],
+                               'data_criacao': atual['data_criacao']}
+                if vigente is None or id_to_key(vigente['id']) == chave or _momento(linha) >= _momento(vigente):
+                    novas[cnpj] = linha
+            if novas:
+                recalculadas = ultimas_por_cnpj(pd.DataFrame(list(novas.values())))
+                self._ultimas = pd.concat([ultimas.drop(index=recalculadas.index, errors='ignore'), recalculadas])
+            self.versao = versao_depois
+
+    def ultimas(self) -> pd.DataFrame:
+        with self._lock:
+            return self._ultimas
@@ -0,0 +1,336 @@
+"""
+Cálculos dos Indicadores e relatórios executados fora da página
+
+Os KPIs, gráficos e a tabela detalhada dos Indicadores ficam aqui para
+serem usados pela página, pelos snapshots noturnos
+(utils/relatorios_noturnos.py) e pelas tarefas da fila.
+
+As funções de tarefa rodam nos processos do pool de utils/tarefas.py, fora
+das sessões do Streamlit: recebem parâmetros simples (diretório dos dados,
+perfil, usuário, período) e devolvem valores serializáveis (números, frames,
+imagens PNG). Cada processo mantém o seu DataManager, que mapeia o snapshot
+Arrow da versão atual em vez de ler o CSV a cada tarefa.
+
+`progresso(fracao, mensagem)` informa o andamento à fila e interrompe a
+tarefa quando o usuário a cancela.
+"""
+import io
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from .calendario import calendario
+from .data_manager import DataManager, estatisticas_equipe
+
+Progresso = Callable[[float, str], None]
+
+# Um gerenciador por diretório de dados em cada processo do pool
+_gerenciadores: Dict[str, DataManager] = {}
+
+def _gerenciador(data_dir: str) -> DataManager:
+    dm = _gerenciadores.get(data_dir)
+    if dm is None:
+        dm = _gerenciadores[data_dir] = DataManager(data_dir)
+    # A tarefa enxerga as gravações feitas até o momento do envio
+    dm.canal.conferir()
+    return dm
+
+def inicio_do_periodo(periodo: str, hoje: date) -> Optional[date]:
+    """Início dos períodos pré-definidos dos Indicadores (None = todo o histórico)"""
+    dias = {"Último mês": 30, "Últimos 3 meses": 90, "Último ano": 365}.get(periodo)
+    return hoje - timedelta(days=dias) if dias else None
+
+def inspecoes_do_periodo(dm: DataManager, parametros: Dict[str, Any]) -> pd.DataFrame:
+    """Inspeções visíveis ao usuário no período pedido (inclui o arquivo frio)"""
+    inicio = parametros.get('inicio')
+    fim = parametros.get('fim')
+    df = dm.load_inspecoes_historico(inicio)
+    if len(df) == 0:
+        return df
+    if parametros.get('perfil') == 'inspetor':
+        df = df[df['inspetor_id'] == parametros['usuario_id']]
+    if inicio is not None or fim is not None:
+        datas = pd.to_datetime(df['data_inspecao']).dt.date
+        dentro = pd.Series(True, index=df.index)
+        if inicio is not None:
+            dentro &= datas >= inicio
+        if fim is not None:
+            dentro &= datas <= fim
+        df = df[dentro]
+    return df
+
+def calculate_kpis(df, user_profile, user_id):
+    """Calcula KPIs principais"""
+    if user_profile == 'inspetor':
+        df = df[df['inspetor_id'] == user_id]
+
+    total = len(df)
+    if total == 0:
+        return {
+            'total_inspecoes': 0,
+            'cumprimento_prazos': 0,
+            'media_dias_prazo': 0,
+            'inspecoes_mes': 0,
+            'percentual_alto_risco': 0
+        }
+
+    # Cumprimento de prazos
+    concluidas = df[df['status'] == 'concluido']
+    cumprimento = len(concluidas) / total * 100 if total > 0 else 0
+
+    # Média de dias para conclusão
+    if len(concluidas) > 0:
+        dias_conclusao = (
+            pd.to_datetime(concluidas['data_atualizacao']) -
+            pd.to_datetime(concluidas['data_inspecao'])
+        ).dt.days
+        media_dias = dias_conclusao.mean()
+    else:
+        media_dias = 0
+
+    # Inspeções do mês atual
+    mes_atual = datetime.now().month
+    ano_atual = datetime.now().year
+    inspecoes_mes = len(df[
+        (pd.to_datetime(df['data_inspecao']).dt.month == mes_atual) &
+        (pd.to_datetime(df['data_inspecao']).dt.year == ano_atual)
+    ])
+
+    # Percentual de alto risco
+    alto_risco = len(df[df['classificacao_risco'] == 'alto'])
+    percentual_alto_risco = alto_risco / total * 100 if total > 0 else 0
+
+    return {
+        'total_inspecoes': total,
+        'cumprimento_prazos': cumprimento,
+        'media_dias_prazo': media_dias,
+        'inspecoes_mes': inspecoes_mes,
+        'percentual_alto_risco': percentual_alto_risco
+    }
+
+def create_monthly_trend_chart(df, user_profile, user_id):
+    """Cria gráfico de tendência mensal"""
+    if user_profile == 'inspetor':
+        df = df[df['inspetor_id'] == user_id]
+
+    if len(df) == 0:
+        return None
+
+    # Agrupar por mês
+    mes_ano = pd.to_datetime(df['data_inspecao']).dt.to_period('M').rename('mes_ano')
+
+    monthly_data = df.groupby([mes_ano, 'status']).size().unstack(fill_value=0)
+    monthly_data.index = monthly_data.index.astype(str)
+
+    fig, ax = plt.subplots()
+
+    if 'pendente' in monthly_data.columns:
+        ax.plot(monthly_data.index, monthly_data['pendente'], marker='o', label='Pendentes', color='orange')
+
+    if 'concluido' in monthly_data.columns:
+        ax.plot(monthly_data.index, monthly_data['concluido'], marker='o', label='Concluídas', color='green')
+
+    ax.set_title('Tendência Mensal de Inspeções')
+    ax.set_xlabel('Mês')
+    ax.set_ylabel('Número de Inspeções')
+    ax.legend()
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+
+    return fig
+
+def create_risk_distribution_chart(df, user_profile, user_id):
+    """Cria gráfico de distribuição por risco"""
+    if user_profile == 'inspetor':
+        df = df[df['inspetor_id'] == user_id]
+
+    if len(df) == 0:
+        return None
+
+    risk_counts = df['classificacao_risco'].value_counts()
+    risk_counts = risk_counts[risk_counts > 0]
+
+    colors = {
+        'alto': '#d62728',
+        'medio': '#ff7f0e',
+        'baixo': '#2ca02c'
+    }
+
+    fig, ax = plt.subplots()
+    ax.pie(risk_counts.values, labels=[name.title() for name in risk_counts.index], autopct='%1.1f%%', colors=[colors.get(name, '#7f7f7f') for name in risk_counts.index])
+    ax.set_title('Distribuição por Classificação de Risco')
+
+    return fig
+
+def create_status_chart(df, user_profile, user_id):
+    """Cria gráfico de status das inspeções"""
+    if user_profile == 'inspetor':
+        df = df[df['inspetor_id'] == user_id]
+
+    if len(df) == 0:
+        return None
+
+    # Calcular status atual incluindo vencidas (prazos em dias úteis)
+    vencida = calendario.situacao_prazos(df)['vencida'].to_numpy()
+    status_atual = np.select(
+        [df['status'].to_numpy() == 'concluido', vencida, df['status'].to_numpy() == 'pendente'],
+        ['Concluída', 'Vencida', 'Pendente'], default='Outro')
+
+    status_counts = pd.Series(status_atual).value_counts()
+
+    colors = {
+        'Concluída': '#2ca02c',
+        'Pendente': '#ff7f0e',
+        'Vencida': '#d62728',
+        'Outro': '#7f7f7f'
+    }
+
+    fig, ax = plt.subplots()
+    ax.bar(status_counts.index, status_counts.values, color=[colors.get(status, '#7f7f7f') for status in status_counts.index])
+    ax.set_title('Status Atual das Inspeções')
+    ax.set_xlabel('Status')
+    ax.set_ylabel('Quantidade')
+    plt.tight_layout()
+
+    return fig
+
+def create_inspector_performance_chart(df, usuarios_file="data/usuarios.csv"):
+    """Cria gráfico de performance por inspetor (apenas para coordenadores/gerência)"""
+    if len(df) == 0:
+        return None
+
+    # Carregar dados de usuários
+    try:
+        users_df = pd.read_csv(usuarios_file)
+        users_dict = dict(zip(users_df['id'], users_df['nome']))
+    except:
+        users_dict = {}
+
+    # Mesmas estatísticas por inspetor do Painel de Coordenação
+    inspector_stats = estatisticas_equipe(df)
+    inspector_stats['pendentes'] = inspector_stats['total'] - inspector_stats['concluidas']
+    inspector_stats['nome'] = inspector_stats['inspetor_id'].map(users_dict).fillna('Desconhecido')
+
+    fig, ax = plt.subplots()
+
+    bar_width = 0.35
+    index = range(len(inspector_stats['nome']))
+
+    bar1 = ax.bar([i - bar_width/2 for i in index], inspector_stats['concluidas'], bar_width, label='Concluídas', color='green')
+    bar2 = ax.bar([i + bar_width/2 for i in index], inspector_stats['pendentes'], bar_width, label='Pendentes', color='orange')
+
+    ax.set_title('Performance por Inspetor')
+    ax.set_xlabel('Inspetor')
+    ax.set_ylabel('Número de Inspeções')
+    ax.set_xticks(index)
+    ax.set_xticklabels(inspector_stats['nome'], rotation=45, ha='right')
+    ax.legend()
+    plt.tight_layout()
+
+    return fig
+
+def tabela_detalhada(df, user_profile, user_id):
+    """Tabela "Dados Detalhados" dos Indicadores, com datas formatadas"""
+    display_df = df
+
+    # Filtrar por perfil
+    if user_profile == 'inspetor':
+        display_df = display_df[display_df['inspetor_id'] == user_id]
+
+    # Formatar datas (novas colunas em uma visão, sem cópia)
+    display_df = display_df.assign(**{
+        'Data Inspeção': pd.to_datetime(display_df['data_inspecao']).dt.strftime('%d/%m/%Y'),
+        'Prazo Inspetor': pd.to_datetime(display_df['prazo_inspetor']).dt.strftime('%d/%m/%Y').fillna('-'),
+        'Prazo Coordenação': pd.to_datetime(display_df['prazo_coordenacao']).dt.strftime('%d/%m/%Y').fillna('-')
+    })
+
+    # Selecionar colunas
+    columns = ['estabelecimento', 'Data Inspeção', 'classificacao_risco',
+               'Prazo Inspetor', 'Prazo Coordenação', 'status']
+
+    if user_profile in ['coordenador', 'gerencia']:
+        columns.insert(-1, 'inspetor_id')
+
+    # Renomear colunas
+    column_names = {
+        'estabelecimento': 'Estabelecimento',
+        'classificacao_risco': 'Risco',
+        'status': 'Status',
+        'inspetor_id': 'Inspetor ID'
+    }
+
+    return display_df[columns].rename(columns=column_names)
+
+def _png(fig: Figure) -> bytes:
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+def relatorio_detalhado(parametros: Dict[str, Any], progresso: Progresso) -> Dict[str, Any]:
+    """Totais por status e distribuição por risco (Painel de Coordenação)"""
+    progresso(0.1, "Carregando inspeções")
+    df = inspecoes_do_periodo(_gerenciador(parametros['data_dir']), parametros)
+
+    progresso(0.5, "Calculando totais")
+    risco_counts = df['classificacao_risco'].value_counts() if len(df) else pd.Series(dtype=int)
+    risco_counts = risco_counts[risco_counts > 0]
+    resultado = {
+        'total': len(df),
+        'pendentes': int((df['status'] == 'pendente').sum()) if len(df) else 0,
+        'concluidas': int((df['status'] == 'concluido').sum()) if len(df) else 0,
+        'risco': {str(k): int(v) for k, v in risco_counts.items()},
+        'grafico': None
+    }
+
+    if len(risco_counts) > 0:
+        progresso(0.8, "Gerando gráfico")
+        # Figure sem pyplot: nenhum estado global de figuras no processo
+        fig = Figure()
+        ax = fig.subplots()
+        ax.pie(risco_counts.values, labels=[str(k) for k in risco_counts.index], autopct="%1.1f%%")
+        ax.set_title("Distribuição por Classificação de Risco")
+        resultado['grafico'] = _png(fig)
+    return resultado
+
+def exportar_inspecoes(parametros: Dict[str, Any], progresso: Progresso) -> Dict[str, Any]:
+    """CSV completo (com observações e comentários) das inspeções do período"""
+    progresso(0.05, "Carregando inspeções")
+    dm = _gerenciador(parametros['data_dir'])
+    df = inspecoes_do_periodo(dm, parametros)
+
+    progresso(0.1, f"Gravando {len(df)} linhas")
+    caminho = dm.export_to_csv(
+        df, lambda fracao: progresso(0.1 + 0.9 * fracao, f"Gravando {len(df)} linhas"))
+    if caminho is None:
+        raise RuntimeError("falha ao gravar o arquivo de exportação")
+    return {'caminho': caminho, 'linhas': len(df), 'bytes': os.path.getsize(caminho)}
+
+def agregados(parametros: Dict[str, Any], progresso: Progresso) -> Dict[str, Any]:
+    """KPIs, evolução mensal por status e totais por inspetor do período"""
+    progresso(0.1, "Carregando inspeções")
+    df = inspecoes_do_periodo(_gerenciador(parametros['data_dir']), parametros)
+
+    progresso(0.4, "Calculando indicadores")
+    kpis = calculate_kpis(df, parametros['perfil'], parametros['usuario_id'])
+
+    progresso(0.6, "Agrupando por mês")
+    if len(df) > 0:
+        mes_ano = pd.to_datetime(df['data_inspecao']).dt.to_period('M').rename('mes')
+        mensal = df.groupby([mes_ano, 'status'], observed=True).size().unstack(fill_value=0)
+        mensal.index = mensal.index.astype(str)
+        mensal.columns = mensal.columns.astype(str)
+        mensal = mensal.reset_index()
+    else:
+        mensal = pd.DataFrame(columns=['mes'])
+
+    por_inspetor = None
+    if parametros['perfil'] in ('coordenador', 'gerencia') and len(df) > 0:
+        progresso(0.8, "Agrupando por inspetor")
+        # Mesmas estatísticas por inspetor do Painel de Coordenação
+        por_inspetor = estatisticas_equipe(df)[['inspetor_id', 'total', 'concluidas', 'pendentes',
+                                                 'vencidas', 'proximas']]
+
+    return {'kpis': kpis, 'mensal': mensal, 'por_inspetor': por_inspetor}
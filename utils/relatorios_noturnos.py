@@ -0,0 +1,217 @@
+"""
+Snapshots noturnos das visões padrão dos Indicadores
+
+A gerência abre toda manhã as mesmas visões dos Indicadores ("Último mês",
+"Último ano"... com todos os territórios), e cada abertura recalculava os
+KPIs, os quatro gráficos e a tabela detalhada a partir dos dados. O job
+scripts/gerar_relatorios_noturnos.py calcula essas visões de madrugada e
+grava uma versão em data/relatorios/<AAAAMMDD_HHMMSS_microssegundos_pid>/:
+
+- manifesto.json: dia de referência dos períodos, chave dos dados de onde
+  a versão saiu e, por visão, KPIs e arquivos;
+- <visão>_<gráfico>.png: os gráficos, renderizados como no st.pyplot;
+- <visão>_tabela.arrow: a tabela detalhada (Arrow IPC).
+
+`data/relatorios/atual.json` aponta para a versão em uso e só é trocado
+(atomicamente) depois que a versão nova está completa. As versões antigas
+além das N mais recentes são removidas pelo job.
+
+Os Indicadores servem o snapshot quando o período é uma visão padrão, o
+perfil vê todos os territórios e o snapshot é do dia (os períodos são
+relativos à data); nos demais casos calculam na hora. Se os dados mudaram
+depois da geração, a página avisa e oferece o cálculo na hora.
+"""
+import json
+import os
+import shutil
+import threading
+import unicodedata
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+import matplotlib.pyplot as plt
+import pandas as pd
+from .arquivos import gravar_atomico
+from .data_manager import DataManager, data_manager
+from .metrics import metrics
+from .relatorios import (calculate_kpis, create_inspector_performance_chart, create_monthly_trend_chart,
+                         create_risk_distribution_chart, create_status_chart, inicio_do_periodo,
+                         inspecoes_do_periodo, tabela_detalhada)
+
+# Muda quando o conteúdo do manifesto muda: versões antigas deixam de ser servidas
+FORMATO = 1
+
+PERIODOS_PADRAO = ["Todos", "Último mês", "Últimos 3 meses", "Último ano"]
+
+# Os mesmos parâmetros do st.pyplot: a imagem do snapshot é igual à da página
+OPCOES_PNG = {"bbox_inches": "tight", "dpi": 200, "format": "png"}
+
+def _nome_visao(periodo: str) -> str:
+    """'Últimos 3 meses' -> 'ultimos_3_meses'"""
+    ascii_ = unicodedata.normalize('NFKD', periodo).encode('ascii', 'ignore').decode()
+    return '_'.join(ascii_.lower().split())
+
+def _chave_json(chave: Any) -> Any:
+    """Chave dos dados como fica no manifesto (tuplas viram listas)"""
+    return json.loads(json.dumps(chave))
+
+class RelatoriosNoturnos:
+    """Versões dos snapshots das visões padrão em um diretório"""
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        self.ponteiro = os.path.join(diretorio, "atual.json")
+        self._lock = threading.Lock()
+        # Versão carregada: (nome, manifesto, {período: visão com imagens e tabela})
+        self._carregada = None
+
+    def gerar(self, dm: DataManager, periodos: List[str] = PERIODOS_PADRAO,
+              hoje: date = None) -> str:
+        """Calcula as visões e publica uma nova versão; retorna o diretório dela"""
+        hoje = hoje or date.today()
+        # Chave lida antes dos dados: a versão nunca parece mais nova do que é
+        chave = dm.canal.obter_chave()
+        # Microssegundos e pid: duas gerações no mesmo segundo (cron e uma
+        # execução manual) não disputam o mesmo diretório
+        versao = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{os.getpid()}"
+        destino = os.path.join(self.diretorio, versao)
+        tmp = f"{destino}.{os.getpid()}.tmp"
+        os.makedirs(tmp)
+
+        try:
+            usuarios_file = os.path.join(dm.data_dir, "usuarios.csv")
+            visoes = {}
+            for periodo in periodos:
+                inicio = inicio_do_periodo(periodo, hoje)
+                df = inspecoes_do_periodo(dm, {'inicio': inicio, 'fim': None, 'perfil': 'gerencia'})
+                nome = _nome_visao(periodo)
+
+                graficos = {}
+                for grafico, fig in (
+                    ('tendencia', create_monthly_trend_chart(df, 'gerencia', None)),
+                    ('risco', create_risk_distribution_chart(df, 'gerencia', None)),
+                    ('status', create_status_chart(df, 'gerencia', None)),
+                    ('inspetores', create_inspector_performance_chart(df, usuarios_file))
+                ):
+                    graficos[grafico] = None
+                    if fig is not None:
+                        graficos[grafico] = f"{nome}_{grafico}.png"
+                        fig.savefig(os.path.join(tmp, graficos[grafico]), **OPCOES_PNG)
+                        plt.close(fig)
+
+                tabela = tabela_detalhada(df, 'gerencia', None).reset_index(drop=True)
+                tabela.to_feather(os.path.join(tmp, f"{nome}_tabela.arrow"))
+                visoes[periodo] = {
+                    'inicio': inicio.isoformat() if inicio else None,
+                    'kpis': calculate_kpis(df, 'gerencia', None),
+                    'graficos': graficos,
+                    'tabela': f"{nome}_tabela.arrow",
+                    'linhas': len(tabela)
+                }
+
+            manifesto = {
+                'formato': FORMATO,
+                'versao': versao,
+                'gerado_em': datetime.now().isoformat(timespec='seconds'),
+                'dia': hoje.isoformat(),
+                'chave': _chave_json(chave),
+                'visoes': visoes
+            }
+            with open(os.path.join(tmp, "manifesto.json"), 'w', encoding='utf-8') as f:
+                json.dump(manifesto, f, ensure_ascii=False, indent=2)
+            os.rename(tmp, destino)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        def escrever(caminho):
+            with open(caminho, 'w', encoding='utf-8') as f:
+                json.dump({'versao': versao}, f)
+
+        gravar_atomico(self.ponteiro, escrever)
+        return destino
+
+    def limpar(self, manter: int) -> int:
+        """Remove as versões além das `manter` mais recentes (nunca a atual)"""
+        atual = self._versao_atual()
+        versoes = sorted(
+            (nome for nome in os.listdir(self.diretorio)
+             if '.' not in nome and os.path.isfile(os.path.join(self.diretorio, nome, "manifesto.json"))),
+            reverse=True)
+        removidas = 0
+        for nome in versoes[max(manter, 1):]:
+            if nome != atual:
+                shutil.rmtree(os.path.join(self.diretorio, nome), ignore_errors=True)
+                removidas += 1
+        return removidas
+
+    def _versao_atual(self) -> Optional[str]:
+        try:
+            with open(self.ponteiro, encoding='utf-8') as f:
+                return json.load(f)['versao']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _manifesto(self, versao: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.diretorio, versao, "manifesto.json"), encoding='utf-8') as f:
+                manifesto = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifesto if manifesto.get('formato') == FORMATO else None
+
+    def carregar(self, periodo: str, chave_atual: Any = None, hoje: date = None) -> Optional[Dict[str, Any]]:
+        """Visão pré-calculada do período, se a versão atual for do dia
+
+        Retorna KPIs, gráficos (PNG), tabela, momento da geração e
+        `desatualizado` (os dados mudaram depois da geração).
+        """
+        if periodo not in PERIODOS_PADRAO:
+            return None
+        versao = self._versao_atual()
+        if versao is None:
+            return None
+
+        with self._lock:
+            if self._carregada is None or self._carregada[0] != versao:
+                manifesto = self._manifesto(versao)
+                if manifesto is None:
+                    return None
+                self._carregada = (versao, manifesto, {})
+            _, manifesto, visoes = self._carregada
+            if manifesto['dia'] != (hoje or date.today()).isoformat() or periodo not in manifesto['visoes']:
+                return None
+
+            visao = visoes.get(periodo)
+            if visao is None:
+                try:
+                    visao = self._ler_visao(versao, manifesto, periodo)
+                except (OSError, ValueError):
+                    # Versão incompleta ou removida: a página calcula na hora
+                    metrics.incr('relatorios_noturnos_falhas')
+                    return None
+                visoes[periodo] = visao
+
+        metrics.incr('relatorios_noturnos_servidos')
+        desatualizado = chave_atual is not None and _chave_json(chave_atual) != manifesto['chave']
+        return dict(visao, desatualizado=desatualizado)
+
+    def _ler_visao(self, versao: str, manifesto: Dict[str, Any], periodo: str) -> Dict[str, Any]:
+        pasta = os.path.join(self.diretorio, versao)
+        entrada = manifesto['visoes'][periodo]
+        graficos = {}
+        for grafico, arquivo in entrada['graficos'].items():
+            graficos[grafico] = None
+            if arquivo is not None:
+                with open(os.path.join(pasta, arquivo), 'rb') as f:
+                    graficos[grafico] = f.read()
+        return {
+            'versao': versao,
+            'gerado_em': datetime.fromisoformat(manifesto['gerado_em']),
+            'kpis': entrada['kpis'],
+            'graficos': graficos,
+            'tabela': pd.read_feather(os.path.join(pasta, entrada['tabela'])),
+            'linhas': entrada['linhas']
+        }
+
+# Instância global dos snapshots noturnos
+relatorios_noturnos = RelatoriosNoturnos(os.path.join(data_manager.data_dir, "relatorios"))
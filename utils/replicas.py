@@ -0,0 +1,122 @@
+"""
+Versão dos dados compartilhada entre réplicas do servidor
+
+Com várias réplicas do Streamlit atrás de um balanceador (na mesma máquina
+ou em máquinas com um volume compartilhado), cada processo tem o seu
+DataManager, com caches próprios. Para que todas enxerguem a mesma versão
+dos dados, cada gravação incrementa um contador num registro compartilhado
+e a thread observadora de cada réplica (utils/versao_dados.py) confere esse
+contador a cada VISA_WATCH_INTERVAL segundos: quando ele mudou, a réplica
+publica uma nova versão local, invalidando os caches e atualizando as
+sessões com atualização automática.
+
+O atraso de uma réplica em relação à gravação fica limitado ao intervalo
+de observação mais a leitura do registro. Cada versão recebida de outra
+réplica registra o atraso medido (instante da gravação até a invalidação)
+no histograma visa_replica_staleness_seconds; entre máquinas diferentes a
+medida inclui a diferença entre os relógios.
+
+Registros disponíveis:
+- RegistroSQLite: tabela `versoes` num arquivo SQLite no volume
+  compartilhado (modo de journal padrão, sem WAL, que não funciona em
+  volumes de rede);
+- RegistroMemoria: contador dentro do processo, para testes e scripts.
+
+Configuração por variáveis de ambiente:
+    VISA_REPLICAS_DB   arquivo SQLite do registro (vazio desativa; ":memoria:"
+                       usa o registro em memória)
+"""
+import os
+import socket
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+REGISTRO_REPLICAS = os.environ.get("VISA_REPLICAS_DB", "")
+
+# Identifica a réplica que gravou cada versão
+REPLICA = f"{socket.gethostname()}:{os.getpid()}"
+
+class RegistroVersoes(ABC):
+    """Contadores de versão compartilhados: (versão, gravado em, réplica)"""
+
+    @abstractmethod
+    def incrementar(self, nome: str) -> int:
+        """Nova versão de `nome`, gravada por esta réplica"""
+
+    @abstractmethod
+    def ler(self, nome: str) -> Tuple[int, float, str]:
+        """Versão atual, instante da gravação (time.time) e réplica que gravou"""
+
+class RegistroMemoria(RegistroVersoes):
+    """Registro dentro do processo (testes e scripts)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versoes = {}
+
+    def incrementar(self, nome: str) -> int:
+        with self._lock:
+            versao = self._versoes.get(nome, (0,))[0] + 1
+            self._versoes[nome] = (versao, time.time(), REPLICA)
+            return versao
+
+    def ler(self, nome: str) -> Tuple[int, float, str]:
+        with self._lock:
+            return self._versoes.get(nome, (0, 0.0, ''))
+
+class RegistroSQLite(RegistroVersoes):
+    """Registro numa tabela SQLite compartilhada entre os processos"""
+
+    def __init__(self, caminho: str, timeout: float = 10.0):
+        self.caminho = caminho
+        self.timeout = timeout
+        # Conexões SQLite não devem ser compartilhadas entre threads
+        self._local = threading.local()
+        self._conexao().execute(
+            "CREATE TABLE IF NOT EXISTS versoes ("
+            "nome TEXT PRIMARY KEY, versao INTEGER NOT NULL, "
+            "atualizado_em REAL NOT NULL, replica TEXT NOT NULL)"
+        )
+
+    def _conexao(self) -> sqlite3.Connection:
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            # isolation_level=None: as transações são abertas explicitamente
+            conexao = sqlite3.connect(self.caminho, timeout=self.timeout, isolation_level=None)
+            self._local.conexao = conexao
+        return conexao
+
+    def incrementar(self, nome: str) -> int:
+        conexao = self._conexao()
+        # Trava de escrita já na abertura: incrementos simultâneos não se perdem
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            conexao.execute(
+                "INSERT INTO versoes (nome, versao, atualizado_em, replica) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(nome) DO UPDATE SET versao = versao + 1, "
+                "atualizado_em = excluded.atualizado_em, replica = excluded.replica",
+                (nome, time.time(), REPLICA)
+            )
+            versao = conexao.execute("SELECT versao FROM versoes WHERE nome = ?", (nome,)).fetchone()[0]
+            conexao.execute("COMMIT")
+        except Exception:
+            conexao.execute("ROLLBACK")
+            raise
+        return versao
+
+    def ler(self, nome: str) -> Tuple[int, float, str]:
+        linha = self._conexao().execute(
+            "SELECT versao, atualizado_em, replica FROM versoes WHERE nome = ?", (nome,)
+        ).fetchone()
+        return tuple(linha) if linha else (0, 0.0, '')
+
+def registro_configurado() -> Optional[RegistroVersoes]:
+    """Registro indicado por VISA_REPLICAS_DB (None se desativado)"""
+    if not REGISTRO_REPLICAS:
+        return None
+    if REGISTRO_REPLICAS == ':memoria:':
+        return RegistroMemoria()
+    return RegistroSQLite(REGISTRO_REPLICAS)
@@ -0,0 +1,170 @@
+"""
+Resumos do Dashboard materializados por usuário e dia
+
+Tudo o que o Dashboard (app.py e pages/01) mostra antes das tabelas,
+cartões de métricas, pizza de status, tendência mensal, notificações e
+contagem de alertas, depende só de (escopo do usuário, dia, versão dos
+dados). O resumo é calculado uma vez por chave e guardado em um LRU
+limitado, compartilhado pelas sessões do processo: uma visita repetida
+custa uma consulta a dicionário.
+
+O escopo é o inspetor, para inspetores, e "todos" para coordenação e
+gerência (as duas veem os mesmos dados). Quando a versão dos dados muda,
+uma thread recalcula em segundo plano os resumos do dia, dos mais usados
+para os menos usados. Quem chega antes disso a um resumo desatualizado
+espera o recálculo em andamento da sua chave, ou calcula na hora.
+
+Configuração por variáveis de ambiente:
+    VISA_RESUMOS_MAX   resumos guardados (padrão 256)
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+import pandas as pd
+from .data_manager import DataManager, data_manager
+from .metrics import metrics
+from .notifications import NotificationManager, notification_manager
+
+logger = logging.getLogger(__name__)
+
+MAX_RESUMOS = int(os.environ.get("VISA_RESUMOS_MAX", "256"))
+
+# Espera máxima por um recálculo em segundo plano da mesma chave
+ESPERA_RECALCULO_S = 30.0
+
+def escopo(user_id: int, user_profile: str) -> Tuple[str, Optional[int]]:
+    """Chave dos dados que o usuário vê"""
+    if user_profile == 'inspetor':
+        return ('inspetor', int(user_id))
+    return ('todos', None)
+
+def calcular_resumo(dm: DataManager, notificacoes: NotificationManager,
+                    user_id: int, user_profile: str) -> Dict[str, Any]:
+    """Estatísticas, tendência mensal e notificações (alertas) do Dashboard"""
+    estatisticas = dm.get_estatisticas(user_id, user_profile)
+
+    df = dm.get_inspecoes_by_user(user_id, user_profile)
+    mes = df['data_inspecao'].dt.to_period('M').rename('mes') if len(df) > 0 else None
+    if mes is not None:
+        mensal = df.groupby(mes).size().reset_index(name='count')
+        mensal['mes_str'] = mensal['mes'].astype(str)
+    else:
+        mensal = pd.DataFrame(columns=['mes', 'count', 'mes_str'])
+
+    return {
+        'estatisticas': estatisticas,
+        'mensal': mensal,
+        # Vencidas e próximas do vencimento: a sidebar e os alertas contam a partir daqui
+        'notificacoes': notificacoes.get_notifications(user_id, user_profile)
+    }
+
+class ResumosDashboard:
+    """LRU de resumos por (escopo, dia), com a versão dos dados de cada um"""
+
+    def __init__(self, dm: DataManager, notificacoes: NotificationManager, maximo: int = MAX_RESUMOS):
+        self.dm = dm
+        self.notificacoes = notificacoes
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        # (escopo, dia) -> (versão, resumo, (user_id, perfil) usados no cálculo)
+        self._resumos: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # Chaves em recálculo -> evento sinalizado ao terminar
+        self._calculando: Dict[tuple, threading.Event] = {}
+        self._acordar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        dm.canal.inscrever(self._nova_versao)
+
+    def _nova_versao(self, versao: int):
+        # Chamado dentro da publicação: só acorda a thread
+        self._acordar.set()
+
+    def iniciar(self):
+        """Liga a thread de recálculo (uma vez por processo)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="visa-resumos", daemon=True)
+                self._thread.start()
+
+    def obter(self, user_id: int, user_profile: str) -> Dict[str, Any]:
+        """Resumo do Dashboard do usuário para hoje, na versão atual dos dados"""
+        self.iniciar()
+        chave = (escopo(user_id, user_profile), date.today())
+        versao = self.dm.canal.versao
+        with self._lock:
+            guardado = self._resumos.get(chave)
+            if guardado is not None and guardado[0] == versao:
+                self._resumos.move_to_end(chave)
+                metrics.incr('resumos_hits')
+                return guardado[1]
+            evento = self._calculando.get(chave)
+
+        # Recálculo da mesma chave já em andamento: espera em vez de repetir
+        if evento is not None and evento.wait(ESPERA_RECALCULO_S):
+            with self._lock:
+                guardado = self._resumos.get(chave)
+            if guardado is not None and guardado[0] == self.dm.canal.versao:
+                metrics.incr('resumos_hits')
+                return guardado[1]
+
+        metrics.incr('resumos_misses')
+        return self._calcular(chave, user_id, user_profile)
+
+    def _calcular(self, chave: tuple, user_id: int, user_profile: str) -> Dict[str, Any]:
+        evento = threading.Event()
+        with self._lock:
+            self._calculando[chave] = evento
+        try:
+            # Versão lida antes dos dados: uma gravação no meio deixa o resumo desatualizado
+            versao = self.dm.canal.versao
+            resumo = calcular_resumo(self.dm, self.notificacoes, user_id, user_profile)
+            with self._lock:
+                self._resumos[chave] = (versao, resumo, (user_id, user_profile))
+                self._resumos.move_to_end(chave)
+                while len(self._resumos) > self.maximo:
+                    self._resumos.popitem(last=False)
+            return resumo
+        finally:
+            with self._lock:
+                if self._calculando.get(chave) is evento:
+                    del self._calculando[chave]
+            evento.set()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait()
+            self._acordar.clear()
+            hoje = date.today()
+            with self._lock:
+                # Mais usados primeiro
+                pendentes = [(chave, usuario) for chave, (_, _, usuario) in reversed(self._resumos.items())
+                             if chave[1] == hoje]
+            for chave, (user_id, user_profile) in pendentes:
+                with self._lock:
+                    guardado = self._resumos.get(chave)
+                    if guardado is None or guardado[0] == self.dm.canal.versao or chave in self._calculando:
+                        continue
+                try:
+                    self._calcular(chave, user_id, user_profile)
+                    metrics.incr('resumos_recalculados')
+                except Exception:
+                    # A próxima visita calcula na hora
+                    logger.exception("Falha ao recalcular o resumo do Dashboard %s", chave)
+                    metrics.incr('resumos_falhas')
+                if self._acordar.is_set():
+                    # Versão mais nova no meio: recomeça pelos mais usados
+                    break
+
+    def situacao(self) -> Dict[str, Any]:
+        """Resumos guardados e quantos estão na versão atual"""
+        versao = self.dm.canal.versao
+        with self._lock:
+            atuais = sum(1 for v, _, _ in self._resumos.values() if v == versao)
+            return {'guardados': len(self._resumos), 'atuais': atuais, 'maximo': self.maximo}
+
+# Instância global dos resumos do Dashboard
+resumos_dashboard = ResumosDashboard(data_manager, notification_manager)
@@ -0,0 +1,223 @@
+"""
+Esquema compacto em memória do frame de inspeções
+"""
+import uuid
+from collections import ChainMap
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Colunas de baixa cardinalidade guardadas como categorias
+CATEGORY_COLUMNS = ['classificacao_risco', 'status', 'territorio',
+                    'atividade_principal', 'cnpj']
+
+# Textos longos ficam fora do frame principal
+TEXT_COLUMNS = ['observacoes', 'comentarios_internos']
+
+UUID_TYPE = pa.binary(16)
+
+def uuids_to_bytes(ids: pd.Series) -> pd.Series:
+    """Converte UUIDs em texto para valores de 16 bytes"""
+    ids = ids.astype(str)
+    if len(ids) == 0:
+        return pd.Series(pd.arrays.ArrowExtensionArray(pa.array([], type=UUID_TYPE)), index=ids.index)
+
+    # Concatena os hexadecimais e converte tudo de uma vez
+    hex_ids = ids.str.replace('-', '', regex=False)
+    if not (hex_ids.str.len() == 32).all():
+        raise ValueError("id fora do formato UUID")
+    raw = bytes.fromhex(''.join(hex_ids))
+    arr = pa.FixedSizeBinaryArray.from_buffers(UUID_TYPE, len(ids), [None, pa.py_buffer(raw)])
+    return pd.Series(pd.arrays.ArrowExtensionArray(arr), index=ids.index, name=ids.name)
+
+def id_to_str(value: Any) -> str:
+    """Retorna o id de uma inspeção no formato texto"""
+    if isinstance(value, bytes):
+        return str(uuid.UUID(bytes=value))
+    return str(value)
+
+def id_to_key(value: Any) -> Any:
+    """Retorna o id no formato usado pelo frame compacto"""
+    if isinstance(value, str):
+        try:
+            return uuid.UUID(value).bytes
+        except ValueError:
+            return value
+    return value
+
+def _chaves(ids: pd.Series) -> np.ndarray:
+    """Ids como matriz NumPy ordenável: S16 para os UUIDs binários, objetos para os legados"""
+    if isinstance(ids.dtype, pd.ArrowDtype) and ids.dtype.pyarrow_dtype == UUID_TYPE:
+        if len(ids) == 0:
+            return np.empty(0, dtype='S16')
+        arr = pa.array(ids.array)
+        if isinstance(arr, pa.ChunkedArray):
+            arr = arr.combine_chunks()
+        # Sem cópia: os 16 bytes de cada id, lidos do buffer Arrow
+        return np.frombuffer(arr.buffers()[1], dtype='S16', count=len(arr), offset=arr.offset * 16)
+    return np.asarray(ids, dtype=object)
+
+class TextosLongos(Mapping):
+    """id -> textos longos (observações, comentários), em colunas Arrow fora do frame
+
+    Os textos ficam em arrays Arrow de strings, na ordem das linhas, e os ids
+    numa matriz NumPy (16 bytes por id). A busca é binária sobre os ids
+    ordenados, montados no primeiro uso: nenhum objeto Python por linha.
+    """
+
+    def __init__(self, ids: Optional[pd.Series] = None, colunas: Optional[Dict[str, pa.Array]] = None):
+        self._ids = _chaves(ids) if ids is not None else np.empty(0, dtype='S16')
+        self.colunas = colunas or {}
+        # (ids ordenados, posição de cada um nas colunas)
+        self._indice: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def _ordenados(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._indice is None:
+            ordem = np.argsort(self._ids, kind='stable')
+            self._indice = (self._ids[ordem], ordem)
+        return self._indice
+
+    def _posicoes(self, chaves: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Posição de cada chave nas colunas e se ela foi encontrada"""
+        ordenados, ordem = self._ordenados()
+        if len(ordenados) == 0 or len(chaves) == 0 or chaves.dtype != ordenados.dtype:
+            return np.zeros(len(chaves), dtype='int64'), np.zeros(len(chaves), dtype=bool)
+        try:
+            i = np.minimum(np.searchsorted(ordenados, chaves), len(ordenados) - 1)
+        except TypeError:
+            # Ids legados (texto) comparados com chaves de outro tipo: nenhuma encontrada
+            return np.zeros(len(chaves), dtype='int64'), np.zeros(len(chaves), dtype=bool)
+        return ordem[i], np.asarray(ordenados[i] == chaves, dtype=bool)
+
+    def _chave(self, key: Any) -> np.ndarray:
+        if self._ids.dtype.kind == 'S':
+            if not isinstance(key, bytes) or len(key) != 16:
+                raise KeyError(key)
+            return np.array([key], dtype='S16')
+        chave = np.empty(1, dtype=object)
+        chave[0] = key
+        return chave
+
+    def __getitem__(self, key: Any) -> Dict[str, str]:
+        posicao, encontrada = self._posicoes(self._chave(key))
+        if not encontrada[0]:
+            raise KeyError(key)
+        return {col: arr[int(posicao[0])].as_py() for col, arr in self.colunas.items()}
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._ids.dtype.kind == 'S':
+            # O NumPy tira os zeros finais dos valores S16
+            return (bytes(key).ljust(16, b'\0') for key in self._ids)
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def valores(self, ids: pd.Series, coluna: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Textos de `coluna` para vários ids de uma vez ('' nos ausentes) e quais foram encontrados"""
+        posicoes, encontradas = self._posicoes(_chaves(ids))
+        if coluna not in self.colunas:
+            return np.full(len(ids), '', dtype=object), np.zeros(len(ids), dtype=bool)
+        indices = pa.array(posicoes, mask=~encontradas)
+        textos = pc.fill_null(self.colunas[coluna].take(indices), '')
+        return textos.to_numpy(zero_copy_only=False), encontradas
+
+    def sem(self, ids: Iterable[Any]) -> 'TextosLongos':
+        """Cópia sem os textos dos ids informados (chaves do frame compacto)"""
+        if self._ids.dtype.kind == 'S':
+            remover = np.array([key for key in ids if isinstance(key, bytes) and len(key) == 16], dtype='S16')
+        else:
+            remover = np.array(list(ids), dtype=object)
+        manter = ~np.isin(self._ids, remover)
+        if manter.all():
+            return self
+        filtro = pa.array(manter)
+        restantes = TextosLongos(None, {col: arr.filter(filtro) for col, arr in self.colunas.items()})
+        restantes._ids = self._ids[manter]
+        return restantes
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes em memória: textos, ids e o índice ordenado"""
+        ordenados, ordem = self._ordenados()
+        return (sum(arr.nbytes for arr in self.colunas.values())
+                + self._ids.nbytes + ordenados.nbytes + ordem.nbytes)
+
+def compact_inspecoes(df: pd.DataFrame) -> Tuple[pd.DataFrame, TextosLongos]:
+    """Converte o frame lido do CSV para o esquema compacto
+
+    Retorna o frame compacto e os textos longos (TextosLongos, por id).
+    """
+    df = df.copy(deep=False)
+
+    textos = TextosLongos()
+    text_cols = [col for col in TEXT_COLUMNS if col in df.columns]
+
+    if 'id' in df.columns:
+        try:
+            df['id'] = uuids_to_bytes(df['id'])
+        except ValueError:
+            # Ids legados fora do formato UUID continuam como texto
+            pass
+
+        textos = TextosLongos(df['id'], {
+            col: pa.array(df[col].fillna('').astype(str).to_numpy(), type=pa.string())
+            for col in text_cols
+        })
+
+    df = df.drop(columns=text_cols)
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    if 'inspetor_id' in df.columns:
+        df['inspetor_id'] = pd.to_numeric(df['inspetor_id'], errors='coerce').astype('Int32')
+
+    if 'versao' in df.columns:
+        df['versao'] = df['versao'].astype('int32')
+
+    return df, textos
+
+def _coluna_texto(ids: pd.Series, textos: Mapping, coluna: str) -> np.ndarray:
+    """Textos de `coluna` para os ids, da primeira fonte que tiver cada um"""
+    fontes = textos.maps if isinstance(textos, ChainMap) else [textos]
+    valores = np.full(len(ids), '', dtype=object)
+    pendentes = np.ones(len(ids), dtype=bool)
+    for fonte in fontes:
+        if isinstance(fonte, TextosLongos):
+            achados, encontrados = fonte.valores(ids, coluna)
+        else:
+            linhas = [fonte.get(key) for key in ids]
+            encontrados = np.array([linha is not None for linha in linhas], dtype=bool)
+            achados = np.array([linha.get(coluna, '') if linha else '' for linha in linhas], dtype=object)
+        novos = pendentes & encontrados
+        valores[novos] = achados[novos]
+        pendentes &= ~encontrados
+    return valores
+
+def expand_inspecoes(df: pd.DataFrame, textos: Mapping) -> pd.DataFrame:
+    """Reconstrói o frame no formato do CSV (ids em texto e textos longos)"""
+    df = df.copy(deep=False)
+
+    if 'id' in df.columns:
+        for col in TEXT_COLUMNS:
+            if col not in df.columns:
+                df[col] = _coluna_texto(df['id'], textos, col)
+        df['id'] = [id_to_str(key) for key in df['id']]
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+
+    return df
+
+def bytes_por_linha(df: pd.DataFrame, textos: Optional[TextosLongos] = None) -> float:
+    """Calcula o uso de memória (profundo) por linha do frame e dos textos guardados fora dele"""
+    if len(df) == 0:
+        return 0.0
+    total = df.memory_usage(deep=True).sum() + (textos.nbytes if textos is not None else 0)
+    return total / len(df)
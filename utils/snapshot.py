@@ -0,0 +1,143 @@
+"""
+Snapshot Arrow do frame compacto de inspeções, mapeado em memória
+
+Com vários processos do servidor, cada um lia o CSV e montava a sua cópia
+do frame. Agora o primeiro processo que carrega uma versão dos dados grava
+o frame compacto e os textos longos em `data/inspecoes.arrow` (Arrow IPC);
+os outros mapeiam o arquivo e montam o frame sobre o mapeamento, sem
+interpretar o CSV:
+
+- ids, datas, números, códigos das categorias e textos longos não são
+  copiados: ficam nas páginas do cache do sistema, compartilhadas por todos
+  os processos (só os nomes dos estabelecimentos viram objetos Python);
+- o mapeamento é privado (copy-on-write): um processo que altere um frame
+  copia só as páginas alteradas, e nada volta ao arquivo;
+- o snapshot guarda a chave dos arquivos de dados de onde saiu. Com outra
+  chave, ele é regravado uma vez, sob uma trava entre processos, e trocado
+  por os.replace;
+- quem já mapeou um snapshot substituído continua com ele; o sistema libera
+  o arquivo antigo quando o último frame que o usa é descartado.
+
+Configuração por variáveis de ambiente:
+    VISA_SNAPSHOT   1 (padrão) grava e mapeia o snapshot; 0 lê sempre o CSV
+"""
+import json
+import mmap
+import os
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from .arquivos import TravaArquivo, gravar_atomico
+from .metrics import metrics
+from .schema import TextosLongos
+
+USAR_SNAPSHOT = os.environ.get("VISA_SNAPSHOT", "1") != "0"
+
+def _codificar_coluna(serie: pd.Series) -> Tuple[pa.Array, Dict[str, Any]]:
+    """Coluna do frame -> array Arrow e como remontá-la"""
+    dtype = serie.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        codigos = serie.cat.codes.to_numpy()
+        # Os códigos vão inteiros (com -1 nos nulos) para voltarem sem conversão
+        validos = pa.array(codigos >= 0).buffers()[1]
+        indices = pa.Array.from_buffers(pa.from_numpy_dtype(codigos.dtype), len(codigos),
+                                        [validos, pa.py_buffer(codigos)])
+        categorias = pa.array(dtype.categories.to_numpy(), from_pandas=True)
+        return pa.DictionaryArray.from_arrays(indices, categorias), {
+            'tipo': 'categoria', 'dtype': codigos.dtype.str, 'ordenada': bool(dtype.ordered)}
+    if isinstance(dtype, pd.ArrowDtype):
+        arr = pa.array(serie.array)
+        if isinstance(arr, pa.ChunkedArray):
+            arr = pa.concat_arrays(arr.chunks) if arr.num_chunks else pa.array([], type=arr.type)
+        return arr, {'tipo': 'arrow'}
+    if isinstance(dtype, pd.core.dtypes.dtypes.BaseMaskedDtype) and dtype.kind in 'iuf':
+        return pa.array(serie.array), {'tipo': 'mascara', 'dtype': dtype.name,
+                                       'numpy': dtype.numpy_dtype.str}
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iufbMm':
+        # Bytes do numpy como estão: datas com NaT (int64 mínimo) e sem nulos Arrow
+        valores = np.ascontiguousarray(serie.to_numpy())
+        return pa.array(valores.view(f'u{dtype.itemsize}')), {'tipo': 'numpy', 'dtype': dtype.str}
+    return pa.array(serie.to_numpy(), from_pandas=True), {'tipo': 'objeto'}
+
+def _decodificar_coluna(arr: pa.Array, spec: Dict[str, Any], mapa: mmap.mmap, base: int):
+    """Array Arrow mapeado -> valores da coluna do frame"""
+    def sobre_mapa(buffer: pa.Buffer, dtype: np.dtype) -> np.ndarray:
+        # np.frombuffer sobre o mmap privado: sem cópia e gravável
+        return np.frombuffer(mapa, dtype=dtype, count=len(arr), offset=buffer.address - base)
+
+    tipo = spec['tipo']
+    if tipo == 'numpy':
+        return sobre_mapa(arr.buffers()[1], np.dtype(spec['dtype']))
+    if tipo == 'categoria':
+        codigos = sobre_mapa(arr.indices.buffers()[1], np.dtype(spec['dtype']))
+        categorias = pd.Index(arr.dictionary.to_numpy(zero_copy_only=False))
+        return pd.Categorical.from_codes(codigos, dtype=pd.CategoricalDtype(categorias, spec['ordenada']))
+    if tipo == 'mascara':
+        valores = sobre_mapa(arr.buffers()[1], np.dtype(spec['numpy']))
+        nulos = arr.is_null().to_numpy(zero_copy_only=False)
+        return pd.api.types.pandas_dtype(spec['dtype']).construct_array_type()(valores, nulos)
+    if tipo == 'arrow':
+        return pd.arrays.ArrowExtensionArray(arr)
+    valores = arr.to_numpy(zero_copy_only=False)
+    if arr.null_count:
+        # pyarrow devolve None; o frame lido do CSV tem NaN
+        valores[arr.is_null().to_numpy(zero_copy_only=False)] = np.nan
+    return valores
+
+class SnapshotArrow:
+    """Arquivo Arrow IPC com o frame compacto de uma versão dos dados"""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        # Uma só reconstrução por versão entre os processos
+        self.trava = TravaArquivo(caminho)
+
+    def abrir(self, chave: Any) -> Optional[Tuple[pd.DataFrame, TextosLongos, Dict[str, Any]]]:
+        """Frame, textos e metadados do snapshot, se ele for da versão `chave`"""
+        try:
+            with open(self.caminho, 'rb') as f:
+                mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (FileNotFoundError, ValueError):
+            # ValueError: arquivo vazio
+            return None
+        buffer = pa.py_buffer(mapa)
+        try:
+            leitor = pa.ipc.open_file(buffer)
+            meta = json.loads(leitor.schema.metadata[b'visa'])
+        except (pa.ArrowInvalid, KeyError, TypeError, ValueError):
+            # Arquivo estranho ou incompleto: é regravado como se não existisse
+            return None
+        if meta['chave'] != json.loads(json.dumps(chave)):
+            return None
+
+        # Gravado em um único lote: cada coluna é um array contíguo no arquivo
+        lote = leitor.get_batch(0)
+        colunas = {}
+        for nome, spec in meta['colunas'].items():
+            colunas[nome] = _decodificar_coluna(lote.column(nome), spec, mapa, buffer.address)
+        df = pd.DataFrame(colunas, copy=False)
+        # Textos e ids lidos sobre o mapeamento, sem cópia
+        textos = TextosLongos(df['id'], {col: lote.column(col) for col in meta['textos']})
+        metrics.incr('snapshot_mapeados')
+        return df, textos, meta['memoria']
+
+    def publicar(self, compacto: pd.DataFrame, textos: TextosLongos, chave: Any,
+                 memoria: Dict[str, Any]):
+        """Grava o snapshot da versão `chave` (troca atômica)"""
+        arrays = {}
+        colunas = {}
+        for nome in compacto.columns:
+            arrays[nome], colunas[nome] = _codificar_coluna(compacto[nome])
+        # Colunas de TextosLongos: na ordem das linhas do frame compacto
+        arrays.update(textos.colunas)
+        meta = {'chave': chave, 'colunas': colunas, 'textos': list(textos.colunas), 'memoria': memoria}
+        lote = pa.RecordBatch.from_pydict(arrays, metadata={'visa': json.dumps(meta)})
+
+        def escrever(tmp):
+            with pa.ipc.new_file(tmp, lote.schema) as escritor:
+                escritor.write_batch(lote)
+
+        gravar_atomico(self.caminho, escrever)
+        metrics.incr('snapshot_publicados')
+        metrics.add_bytes_written(os.path.getsize(self.caminho))
@@ -0,0 +1,510 @@
+"""
+Fila local de tarefas pesadas em um pool de processos
+
+Relatórios, exportações e agregados de vários anos travavam a página (e a
+thread da sessão) enquanto eram montados dentro do script. Agora a página
+envia uma tarefa e segue; um pool de processos executa as funções de
+utils/relatorios.py e o resultado fica guardado para ser consultado depois,
+inclusive de outra página ou de uma nova sessão do mesmo usuário.
+
+- Limites: no máximo VISA_JOBS_MAX tarefas executando no servidor e
+  VISA_JOBS_POR_USUARIO por usuário; as demais aguardam na fila, até
+  VISA_JOBS_FILA por usuário (além disso o envio é recusado).
+- Andamento: as tarefas informam a fração concluída; as sessões que exibem
+  tarefas ativas recebem reruns (como a atualização automática de
+  utils/versao_dados.py) até a conclusão.
+- Cancelamento: uma tarefa na fila sai dela; uma em execução é interrompida
+  no próximo passo informado (a exportação confere a cada bloco de linhas).
+- Os processos do pool têm prioridade menor que o servidor, para não
+  disputar a CPU com os reruns das páginas.
+
+As tarefas ficam na memória do processo do servidor: com várias réplicas,
+cada uma mantém a sua fila.
+
+Configuração por variáveis de ambiente:
+    VISA_JOBS_MAX           tarefas executando ao mesmo tempo (processos do pool, padrão 2)
+    VISA_JOBS_POR_USUARIO   tarefas executando ao mesmo tempo por usuário (padrão 1)
+    VISA_JOBS_FILA          tarefas aguardando por usuário (padrão 5)
+    VISA_JOBS_RETER_S       por quanto tempo os resultados ficam disponíveis (padrão 3600)
+    VISA_JOBS_NICE          acréscimo de niceness dos processos do pool (padrão 10)
+"""
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from . import relatorios
+from .data_manager import data_manager
+from .metrics import metrics
+from .versao_dados import INTERVALO_RERUN, pedir_reruns
+
+logger = logging.getLogger(__name__)
+
+MAX_PROCESSOS = int(os.environ.get("VISA_JOBS_MAX", "2"))
+POR_USUARIO = int(os.environ.get("VISA_JOBS_POR_USUARIO", "1"))
+MAX_FILA = int(os.environ.get("VISA_JOBS_FILA", "5"))
+RETER_S = float(os.environ.get("VISA_JOBS_RETER_S", "3600"))
+NICE = int(os.environ.get("VISA_JOBS_NICE", "10"))
+
+class LimiteTarefas(Exception):
+    """O usuário já tem tarefas demais aguardando na fila"""
+
+class TarefaCancelada(BaseException):
+    """Interrompe a tarefa cancelada no processo do pool
+
+    BaseException, como asyncio.CancelledError: os `except Exception` da
+    camada de dados não a transformam em erro comum.
+    """
+
+# --- Processo do pool -------------------------------------------------------
+
+_andamento = None
+_dir_cancelamento = None
+
+def _iniciar_processo(andamento, dir_cancelamento: str):
+    """Inicialização de cada processo do pool"""
+    global _andamento, _dir_cancelamento
+    _andamento = andamento
+    _dir_cancelamento = dir_cancelamento
+    try:
+        os.nice(NICE)
+    except OSError:
+        pass
+    # Sem sessão neste processo: os avisos de contexto do Streamlit são ruído
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+def _executar(tarefa_id: str, executar: Callable[..., Any], parametros: Dict[str, Any]) -> Any:
+    """Executa a tarefa no processo do pool
+
+    `executar` vai por referência (módulo e nome): qualquer função de nível
+    de módulo importável pelo pool serve, não só as de TIPOS deste módulo.
+    """
+    marca = os.path.join(_dir_cancelamento, tarefa_id)
+
+    def progresso(fracao: float, mensagem: str = ''):
+        if os.path.exists(marca):
+            raise TarefaCancelada()
+        _andamento.put((tarefa_id, min(max(fracao, 0.0), 1.0), mensagem))
+
+    progresso(0.0, "Iniciando")
+    return executar(parametros, progresso)
+
+@contextmanager
+def _main_neutro():
+    """O Streamlit instala o script da página como __main__, e o spawn o
+    executaria de novo em cada processo novo do pool (set_page_config,
+    autenticação...). Os processos partem de um __main__ sem arquivo."""
+    principal = sys.modules.get('__main__')
+    neutro = types.ModuleType('__main__')
+    sys.modules['__main__'] = neutro
+    try:
+        yield
+    finally:
+        # Um rerun que começou no meio já instalou o próprio __main__
+        if sys.modules.get('__main__') is neutro:
+            sys.modules['__main__'] = principal
+
+# --- Servidor ---------------------------------------------------------------
+
+class Tarefa:
+    """Uma tarefa enviada à fila e o seu andamento"""
+
+    def __init__(self, tipo: str, usuario_id: int, parametros: Dict[str, Any], descricao: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.tipo = tipo
+        self.usuario_id = usuario_id
+        self.parametros = parametros
+        self.descricao = descricao
+        # na_fila, executando, concluida, falhou ou cancelada
+        self.estado = 'na_fila'
+        self.progresso = 0.0
+        self.mensagem = 'Aguardando na fila'
+        self.enviada_em = datetime.now()
+        self.iniciada_em: Optional[datetime] = None
+        self.concluida_em: Optional[datetime] = None
+        self.resultado: Any = None
+        self.erro: Optional[str] = None
+        self.cancelamento_pedido = False
+
+    def ativa(self) -> bool:
+        return self.estado in ('na_fila', 'executando')
+
+class FilaTarefas:
+    """Fila com limites por usuário e global, executada em um pool de processos"""
+
+    def __init__(self, max_processos: int = MAX_PROCESSOS, por_usuario: int = POR_USUARIO,
+                 max_fila: int = MAX_FILA, reter_s: float = RETER_S):
+        self.max_processos = max(1, max_processos)
+        self.por_usuario = max(1, por_usuario)
+        self.max_fila = max_fila
+        self.reter_s = reter_s
+        self._lock = threading.RLock()
+        # id -> tarefa, na ordem de envio
+        self._tarefas: Dict[str, Tarefa] = {}
+        self._fila: deque = deque()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._contexto = multiprocessing.get_context('spawn')
+        self._andamento = None
+        self._dir_cancelamento: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._mudou = threading.Event()
+        # session_id -> página, sessões exibindo tarefas ativas
+        self._sessoes: Dict[str, str] = {}
+
+    def enviar(self, tipo: str, usuario_id: int, parametros: Dict[str, Any],
+               descricao: str = None) -> Tarefa:
+        """Coloca uma tarefa na fila; LimiteTarefas se o usuário já tem tarefas demais aguardando"""
+        with self._lock:
+            self._descartar_antigas()
+            aguardando = sum(1 for t in self._fila if t.usuario_id == usuario_id)
+            if aguardando >= self.max_fila:
+                metrics.incr('tarefas_recusadas')
+                raise LimiteTarefas(
+                    f"Você já tem {aguardando} tarefas aguardando; espere a conclusão ou cancele alguma.")
+            tarefa = Tarefa(tipo, usuario_id, parametros, descricao or TIPOS[tipo].nome)
+            self._tarefas[tarefa.id] = tarefa
+            self._fila.append(tarefa)
+            metrics.incr('tarefas_enviadas')
+            self._despachar()
+        return tarefa
+
+    def cancelar(self, tarefa_id: str, usuario_id: int) -> bool:
+        """Cancela uma tarefa ativa do usuário"""
+        with self._lock:
+            tarefa = self._tarefas.get(tarefa_id)
+            if tarefa is None or tarefa.usuario_id != usuario_id or not tarefa.ativa():
+                return False
+            if tarefa.estado == 'na_fila':
+                self._fila.remove(tarefa)
+                self._finalizar(tarefa, 'cancelada', 'Cancelada antes de começar')
+                metrics.incr('tarefas_canceladas')
+            elif not tarefa.cancelamento_pedido:
+                # O processo confere a marca a cada passo informado
+                tarefa.cancelamento_pedido = True
+                tarefa.mensagem = 'Cancelando...'
+                open(os.path.join(self._dir_cancelamento, tarefa.id), 'w').close()
+        self._mudou.set()
+        return True
+
+    def descartar(self, tarefa_id: str, usuario_id: int) -> bool:
+        """Remove da lista uma tarefa já terminada do usuário"""
+        with self._lock:
+            tarefa = self._tarefas.get(tarefa_id)
+            if tarefa is None or tarefa.usuario_id != usuario_id or tarefa.ativa():
+                return False
+            del self._tarefas[tarefa_id]
+            return True
+
+    def listar(self, usuario_id: int) -> List[Tarefa]:
+        """Tarefas do usuário, das mais recentes para as mais antigas"""
+        with self._lock:
+            self._descartar_antigas()
+            return [t for t in reversed(self._tarefas.values()) if t.usuario_id == usuario_id]
+
+    def obter(self, tarefa_id: str) -> Optional[Tarefa]:
+        with self._lock:
+            return self._tarefas.get(tarefa_id)
+
+    def contagem(self) -> Dict[str, int]:
+        """Tarefas por estado (para o endpoint de métricas)"""
+        with self._lock:
+            contagem = {'na_fila': 0, 'executando': 0, 'concluida': 0, 'falhou': 0, 'cancelada': 0}
+            for tarefa in self._tarefas.values():
+                contagem[tarefa.estado] += 1
+            return contagem
+
+    def acompanhar_sessao(self):
+        """A sessão atual recebe reruns enquanto as suas tarefas andam"""
+        ctx = get_script_run_ctx()
+        if ctx is None:
+            return
+        with self._lock:
+            self._sessoes[ctx.session_id] = ctx.page_script_hash
+
+    def aguardar(self, tarefa_id: str, timeout: Optional[float] = None) -> Optional[Tarefa]:
+        """Espera a tarefa terminar (scripts); None se o tempo acabou antes"""
+        limite = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            tarefa = self.obter(tarefa_id)
+            if tarefa is None or not tarefa.ativa():
+                return tarefa
+            if limite is not None and time.monotonic() >= limite:
+                return None
+            time.sleep(0.05)
+
+    def encerrar(self):
+        """Cancela o que está na fila e desliga o pool (scripts e testes)"""
+        with self._lock:
+            while self._fila:
+                self._finalizar(self._fila.popleft(), 'cancelada', 'Servidor encerrado')
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _iniciar_pool(self):
+        if self._dir_cancelamento is None:
+            self._dir_cancelamento = tempfile.mkdtemp(prefix="visa_tarefas_")
+            self._andamento = self._contexto.Queue()
+            self._thread = threading.Thread(target=self._loop, name="visa-tarefas", daemon=True)
+            self._thread.start()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_processos, mp_context=self._contexto,
+            initializer=_iniciar_processo, initargs=(self._andamento, self._dir_cancelamento))
+
+    def _despachar(self):
+        """Inicia as tarefas da fila que cabem nos limites (com o lock)"""
+        executando: Dict[int, int] = {}
+        for tarefa in self._tarefas.values():
+            if tarefa.estado == 'executando':
+                executando[tarefa.usuario_id] = executando.get(tarefa.usuario_id, 0) + 1
+        total = sum(executando.values())
+        for tarefa in list(self._fila):
+            if total >= self.max_processos:
+                break
+            if executando.get(tarefa.usuario_id, 0) >= self.por_usuario:
+                continue
+            self._fila.remove(tarefa)
+            tarefa.estado = 'executando'
+            tarefa.mensagem = 'Iniciando'
+            tarefa.iniciada_em = datetime.now()
+            executando[tarefa.usuario_id] = executando.get(tarefa.usuario_id, 0) + 1
+            total += 1
+            self._submeter(tarefa)
+
+    def _submeter(self, tarefa: Tarefa):
+        for tentativa in range(2):
+            if self._executor is None:
+                self._iniciar_pool()
+            try:
+                # O submit cria os processos do pool sob demanda
+                with _main_neutro():
+                    future = self._executor.submit(_executar, tarefa.id, TIPOS[tarefa.tipo].executar,
+                                                   tarefa.parametros)
+                break
+            except (BrokenProcessPool, RuntimeError):
+                # Pool quebrado por um processo que morreu: um novo na segunda tentativa
+                self._descartar_pool()
+                if tentativa:
+                    self._finalizar(tarefa, 'falhou', 'Pool de processos indisponível')
+                    metrics.incr('tarefas_falhas')
+                    return
+        future.add_done_callback(functools.partial(self._concluir, tarefa))
+
+    def _descartar_pool(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _concluir(self, tarefa: Tarefa, future):
+        """Callback do pool: registra o resultado e libera o lugar na fila"""
+        with self._lock:
+            try:
+                resultado = future.result()
+            except TarefaCancelada:
+                self._finalizar(tarefa, 'cancelada', 'Cancelada pelo usuário')
+                metrics.incr('tarefas_canceladas')
+            except BrokenProcessPool:
+                # Processo encerrado à força (memória, sinal): as demais tarefas do pool também caem
+                self._finalizar(tarefa, 'falhou', 'O processo da tarefa terminou inesperadamente')
+                metrics.incr('tarefas_falhas')
+                self._descartar_pool()
+            except Exception as e:
+                logger.exception("Falha na tarefa %s (%s)", tarefa.id, tarefa.tipo)
+                self._finalizar(tarefa, 'falhou', str(e))
+                metrics.incr('tarefas_falhas')
+            else:
+                tarefa.resultado = resultado
+                tarefa.progresso = 1.0
+                self._finalizar(tarefa, 'concluida', 'Concluída')
+                metrics.incr('tarefas_concluidas')
+                metrics.record_observation(
+                    f'tarefa_{tarefa.tipo}',
+                    (tarefa.concluida_em - tarefa.iniciada_em).total_seconds() * 1000)
+            self._despachar()
+        self._mudou.set()
+
+    def _finalizar(self, tarefa: Tarefa, estado: str, mensagem: str):
+        tarefa.estado = estado
+        tarefa.mensagem = mensagem
+        tarefa.concluida_em = datetime.now()
+        if estado == 'falhou':
+            tarefa.erro = mensagem
+        if self._dir_cancelamento is not None:
+            try:
+                os.unlink(os.path.join(self._dir_cancelamento, tarefa.id))
+            except FileNotFoundError:
+                pass
+
+    def _descartar_antigas(self):
+        """Esquece tarefas terminadas há mais de VISA_JOBS_RETER_S (com o lock)"""
+        agora = datetime.now()
+        antigas = [t.id for t in self._tarefas.values()
+                   if not t.ativa() and (agora - t.concluida_em).total_seconds() > self.reter_s]
+        for tarefa_id in antigas:
+            del self._tarefas[tarefa_id]
+
+    def _loop(self):
+        """Recebe o andamento dos processos e pede rerun às sessões que acompanham"""
+        proximo_aviso = 0.0
+        while True:
+            try:
+                tarefa_id, fracao, mensagem = self._andamento.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            else:
+                with self._lock:
+                    tarefa = self._tarefas.get(tarefa_id)
+                    # Mensagens atrasadas não voltam uma tarefa já terminada
+                    if tarefa is not None and tarefa.estado == 'executando' and not tarefa.cancelamento_pedido:
+                        tarefa.progresso = fracao
+                        tarefa.mensagem = mensagem or tarefa.mensagem
+                self._mudou.set()
+            if self._mudou.is_set() and time.monotonic() >= proximo_aviso:
+                self._mudou.clear()
+                with self._lock:
+                    sessoes, self._sessoes = self._sessoes, {}
+                if sessoes:
+                    # A sessão volta a se registrar no rerun se ainda tiver tarefas ativas
+                    pedir_reruns(sessoes)
+                    proximo_aviso = time.monotonic() + INTERVALO_RERUN
+
+# --- Tipos de tarefa e exibição dos resultados ------------------------------
+
+def _mostrar_relatorio(tarefa: Tarefa):
+    resultado = tarefa.resultado
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total de Inspeções", resultado['total'])
+    with col2:
+        st.metric("Pendentes", resultado['pendentes'])
+    with col3:
+        st.metric("Concluídas", resultado['concluidas'])
+
+    if resultado['grafico'] is not None:
+        st.markdown("#### Distribuição por Risco")
+        st.image(resultado['grafico'])
+
+    if st.button("📄 Exportar Relatório Completo", key=f"exportar_{tarefa.id}"):
+        enviar_tarefa('exportacao', tarefa.usuario_id, tarefa.parametros)
+
+def _mostrar_exportacao(tarefa: Tarefa):
+    resultado = tarefa.resultado
+    st.success(f"✅ Relatório exportado para: {resultado['caminho']}")
+    st.caption(f"{resultado['linhas']} registros, {resultado['bytes'] / 1024 / 1024:.1f} MB")
+
+def _mostrar_agregados(tarefa: Tarefa):
+    resultado = tarefa.resultado
+    kpis = resultado['kpis']
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric("📋 Total de Inspeções", kpis['total_inspecoes'])
+    with col2:
+        st.metric("✅ Cumprimento", f"{kpis['cumprimento_prazos']:.1f}%")
+    with col3:
+        st.metric("⏱️ Média de Dias", f"{kpis['media_dias_prazo']:.0f}")
+    with col4:
+        st.metric("📅 Mês Atual", kpis['inspecoes_mes'])
+    with col5:
+        st.metric("⚠️ Alto Risco", f"{kpis['percentual_alto_risco']:.1f}%")
+
+    st.markdown("#### Inspeções por mês e status")
+    st.dataframe(resultado['mensal'], use_container_width=True, hide_index=True)
+    st.download_button("⬇️ Baixar CSV mensal", resultado['mensal'].to_csv(index=False),
+                       file_name=f"agregados_mensais_{tarefa.id}.csv", mime="text/csv",
+                       key=f"baixar_{tarefa.id}")
+    if resultado['por_inspetor'] is not None:
+        st.markdown("#### Inspeções por inspetor")
+        st.dataframe(resultado['por_inspetor'], use_container_width=True, hide_index=True)
+
+class TipoTarefa:
+    """Função executada no pool e exibição do resultado na página"""
+
+    def __init__(self, nome: str, executar: Callable[..., Any], mostrar: Callable[[Tarefa], None]):
+        self.nome = nome
+        self.executar = executar
+        self.mostrar = mostrar
+
+TIPOS: Dict[str, TipoTarefa] = {
+    'relatorio': TipoTarefa("📊 Relatório detalhado", relatorios.relatorio_detalhado, _mostrar_relatorio),
+    'exportacao': TipoTarefa("📄 Exportação de inspeções", relatorios.exportar_inspecoes, _mostrar_exportacao),
+    'agregados': TipoTarefa("🧮 Resumo do período", relatorios.agregados, _mostrar_agregados),
+}
+
+ROTULOS_ESTADO = {
+    'na_fila': '⏳ Na fila',
+    'executando': '⚙️ Executando',
+    'concluida': '✅ Concluída',
+    'falhou': '❌ Falhou',
+    'cancelada': '🚫 Cancelada',
+}
+
+# Instância global da fila de tarefas
+fila_tarefas = FilaTarefas()
+
+def enviar_tarefa(tipo: str, usuario_id: int, parametros: Dict[str, Any],
+                  descricao: str = None) -> Optional[Tarefa]:
+    """Envia a tarefa e avisa na página; None se o limite do usuário foi atingido"""
+    try:
+        tarefa = fila_tarefas.enviar(tipo, usuario_id, parametros, descricao)
+    except LimiteTarefas as e:
+        st.warning(str(e))
+        return None
+    st.success(f"Tarefa enviada: {tarefa.descricao}. Acompanhe o andamento abaixo.")
+    return tarefa
+
+def mostrar_tarefas(usuario_id: int, tipos: Optional[List[str]] = None):
+    """Tarefas do usuário com andamento, cancelamento e resultados"""
+    tarefas = [t for t in fila_tarefas.listar(usuario_id) if tipos is None or t.tipo in tipos]
+    if not tarefas:
+        return
+
+    st.markdown("### ⏳ Tarefas em Segundo Plano")
+    if any(t.ativa() for t in tarefas):
+        fila_tarefas.acompanhar_sessao()
+
+    for tarefa in tarefas:
+        titulo = f"{ROTULOS_ESTADO[tarefa.estado]} · {tarefa.descricao} · {tarefa.enviada_em.strftime('%d/%m %H:%M:%S')}"
+        with st.expander(titulo, expanded=tarefa.ativa() or tarefa is tarefas[0]):
+            if tarefa.ativa():
+                st.progress(tarefa.progresso, text=tarefa.mensagem)
+                if st.button("Cancelar", key=f"cancelar_{tarefa.id}", disabled=tarefa.cancelamento_pedido):
+                    fila_tarefas.cancelar(tarefa.id, usuario_id)
+                    st.rerun()
+                continue
+
+            if tarefa.estado == 'concluida':
+                segundos = (tarefa.concluida_em - tarefa.iniciada_em).total_seconds()
+                st.caption(f"Concluída em {segundos:.1f} s")
+                TIPOS[tarefa.tipo].mostrar(tarefa)
+            elif tarefa.estado == 'falhou':
+                st.error(f"Erro na tarefa: {tarefa.erro}")
+            else:
+                st.info(tarefa.mensagem)
+
+            if st.button("🗑️ Remover", key=f"remover_{tarefa.id}"):
+                fila_tarefas.descartar(tarefa.id, usuario_id)
+                st.rerun()
+
+def parametros_relatorio(user: Dict[str, Any], inicio=None, fim=None) -> Dict[str, Any]:
+    """Parâmetros comuns das tarefas: dados, perfil e período"""
+    return {
+        'data_dir': os.path.abspath(data_manager.data_dir),
+        'perfil': user['perfil'],
+        'usuario_id': user['id'],
+        'inicio': inicio,
+        'fim': fim
+    }
@@ -0,0 +1,285 @@
+"""
+Versão dos dados e atualização automática das sessões abertas
+
+Um canal, dentro do processo do servidor, avisa que os dados de inspeções
+mudaram, incrementando a versão dos dados:
+- as gravações do DataManager publicam uma nova versão logo após gravar;
+- uma thread observadora confere a chave dos arquivos (mtime e tamanho) a
+  cada VISA_WATCH_INTERVAL segundos e publica quando outro processo (outro
+  worker, o script de arquivamento) alterou os dados. Enquanto uma gravação
+  deste processo está em andamento (`gravacao`), a observação não confere:
+  a gravação publica a própria versão, uma só, quando termina;
+- com várias réplicas do servidor, a mesma thread confere o registro de
+  versões compartilhado (utils/replicas.py), que cada gravação incrementa.
+
+Caches em memória guardam a versão com que foram montados e só valem
+enquanto ela for a atual; quem precisa reagir na hora se inscreve com
+`inscrever`. Páginas com atualização automática chamam `acompanhar_sessao`
+a cada rerun: quando a versão exibida fica velha, a sessão recebe um rerun,
+no máximo um a cada VISA_AUTO_REFRESH_S segundos.
+
+Configuração por variáveis de ambiente:
+    VISA_WATCH_INTERVAL   intervalo da observação dos arquivos, em s (padrão 1)
+    VISA_AUTO_REFRESH_S   intervalo mínimo entre reruns automáticos (padrão 2)
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import pandas as pd
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from .metrics import metrics
+from .replicas import REPLICA, RegistroVersoes
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_OBSERVACAO = float(os.environ.get("VISA_WATCH_INTERVAL", "1"))
+INTERVALO_RERUN = float(os.environ.get("VISA_AUTO_REFRESH_S", "2"))
+
+def pedir_reruns(sessoes: Dict[str, str]) -> int:
+    """Pede rerun às sessões {session_id: página} que continuam na mesma página"""
+    try:
+        from streamlit.runtime import Runtime
+        gerenciador = Runtime.instance()._session_mgr
+    except Exception:
+        # Fora do servidor (scripts, AppTest): não há sessões a avisar
+        return 0
+
+    pedidos = 0
+    for sid, pagina in sessoes.items():
+        try:
+            info = gerenciador.get_active_session_info(sid)
+            if info is None:
+                continue
+            client_state = info.session._client_state
+            if client_state.page_script_hash and client_state.page_script_hash != pagina:
+                # Sessão já foi para outra página (formulários não são interrompidos)
+                continue
+            # O mesmo pedido do "rerun ao salvar" do Streamlit: página e widgets atuais
+            info.session.request_rerun(client_state)
+            metrics.incr('reruns_automaticos')
+            pedidos += 1
+        except Exception:
+            logger.debug("Rerun automático falhou para a sessão %s", sid, exc_info=True)
+    return pedidos
+
+class CanalVersao:
+    """Versão dos dados, inscrições de invalidação e reruns das sessões"""
+
+    def __init__(self, obter_chave: Callable[[], Any], registro: Optional[RegistroVersoes] = None,
+                 nome: str = 'inspecoes'):
+        self.obter_chave = obter_chave
+        self.registro = registro
+        self.nome = nome
+        self.versao = 0
+        self._chave = None
+        # Última versão do registro compartilhado já incorporada
+        self._versao_registro = 0
+        self._lock = threading.Lock()
+        self._inscritos: List[Callable[[int], None]] = []
+        # Resultados memorizados por função: {argumentos: (versão, resultado)}
+        self._memorizados: Dict[str, Dict[tuple, tuple]] = {}
+        # session_id -> (versão exibida, página)
+        self._sessoes: Dict[str, Tuple[int, str]] = {}
+        # Gravações deste processo em andamento (arquivos trocados, versão ainda não publicada)
+        self._gravando = 0
+        self._acordar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def inscrever(self, callback: Callable[[int], None]):
+        """Chama `callback(versao)` a cada nova versão publicada"""
+        with self._lock:
+            self._inscritos.append(callback)
+
+    def publicar(self, chave: Any = None) -> int:
+        """Nova versão dos dados gravados neste processo; `chave` é a chave dos
+        arquivos já gravados"""
+        versao = self._publicar_local(chave)
+        if self.registro is not None:
+            try:
+                compartilhada = self.registro.incrementar(self.nome)
+            except Exception:
+                # As outras réplicas ainda percebem a gravação pelos arquivos
+                logger.exception("Falha ao publicar a versão no registro de réplicas")
+                metrics.incr('replicas_falhas')
+                return versao
+            with self._lock:
+                # A observação não deve receber de volta a própria gravação; se
+                # outra réplica gravou no meio, a versão dela ainda será recebida
+                if compartilhada == self._versao_registro + 1:
+                    self._versao_registro = compartilhada
+        return versao
+
+    @contextmanager
+    def gravacao(self):
+        """Gravação deste processo, do início até o `publicar` com a chave gravada
+
+        Enquanto houver uma em andamento, a observação não confere arquivos
+        nem registro: veria a chave nova antes da publicação (e antes do que
+        a gravação faz entre trocar os arquivos e publicar, como a auditoria)
+        e publicaria uma versão a mais.
+        """
+        with self._lock:
+            self._gravando += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._gravando -= 1
+
+    def _incrementar(self, chave: Any = None) -> Tuple[int, List[Callable[[int], None]]]:
+        """Nova versão; chamado com `_lock`. Retorna a versão e os inscritos a avisar"""
+        self.versao += 1
+        if chave is not None:
+            # A observação não deve publicar de novo a mesma gravação
+            self._chave = chave
+        # Versões antigas não voltam: libera a memória logo
+        for resultados in self._memorizados.values():
+            resultados.clear()
+        return self.versao, list(self._inscritos)
+
+    def _publicar_local(self, chave: Any = None) -> int:
+        with self._lock:
+            versao, inscritos = self._incrementar(chave)
+        return self._avisar_inscritos(versao, inscritos)
+
+    def _avisar_inscritos(self, versao: int, inscritos: List[Callable[[int], None]]) -> int:
+        for callback in inscritos:
+            try:
+                callback(versao)
+            except Exception:
+                logger.exception("Falha ao invalidar cache na versão %s", versao)
+        self._acordar.set()
+        return versao
+
+    def iniciar(self):
+        """Liga a observação dos arquivos (uma vez por processo)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                try:
+                    self._chave = self.obter_chave()
+                except OSError:
+                    self._chave = None
+                if self.registro is not None:
+                    try:
+                        self._versao_registro = self.registro.ler(self.nome)[0]
+                    except Exception:
+                        logger.exception("Registro de réplicas indisponível")
+                self._thread = threading.Thread(target=self._loop, name="visa-observador", daemon=True)
+                self._thread.start()
+
+    def conferir(self):
+        """Confere arquivos e registro agora (processos sem a observação
+        contínua, como os da fila de tarefas)"""
+        self.iniciar()
+        if self.registro is not None:
+            self._conferir_registro()
+        self._conferir_arquivos()
+
+    def acompanhar_sessao(self):
+        """Registra a versão exibida pela sessão atual (atualização automática)"""
+        ctx = get_script_run_ctx()
+        if ctx is None:
+            return
+        self.iniciar()
+        with self._lock:
+            self._sessoes[ctx.session_id] = (self.versao, ctx.page_script_hash)
+
+    def memorizar(self, funcao: Callable) -> Callable:
+        """Decorador: reaproveita o resultado enquanto a versão dos dados e o dia
+        não mudarem (prazos vencem na virada do dia)
+
+        Os scripts das páginas são executados de novo a cada rerun: o cache é
+        identificado pelo arquivo e nome da função, não pelo objeto.
+        """
+        nome = f"{funcao.__code__.co_filename}:{funcao.__qualname__}"
+        with self._lock:
+            resultados = self._memorizados.setdefault(nome, {})
+
+        @functools.wraps(funcao)
+        def envolvida(*args):
+            versao = self.versao
+            chave = (date.today(),) + args
+            guardado = resultados.get(chave)
+            if guardado is not None and guardado[0] == versao:
+                resultado = guardado[1]
+            else:
+                resultado = funcao(*args)
+                resultados[chave] = (versao, resultado)
+            # Frames compartilhados entre sessões: cópia rasa (copy-on-write)
+            return resultado.copy(deep=False) if isinstance(resultado, pd.DataFrame) else resultado
+
+        return envolvida
+
+    def _conferir_arquivos(self):
+        """Publica se os arquivos mudaram fora deste processo"""
+        # Chave lida e versão publicada sob a mesma trava que `gravacao`: uma
+        # gravação local nunca é vista pela metade
+        with self._lock:
+            if self._gravando:
+                return
+            try:
+                chave = self.obter_chave()
+            except OSError:
+                return
+            if chave == self._chave:
+                return
+            versao, inscritos = self._incrementar(chave)
+        self._avisar_inscritos(versao, inscritos)
+
+    def _conferir_registro(self):
+        """Publica se outra réplica gravou desde a última conferência"""
+        try:
+            versao, gravado_em, replica = self.registro.ler(self.nome)
+        except Exception:
+            logger.debug("Falha ao ler o registro de réplicas", exc_info=True)
+            metrics.incr('replicas_falhas')
+            return
+        with self._lock:
+            # Durante uma gravação local a versão da outra réplica fica para
+            # a próxima conferência
+            if self._gravando or versao == self._versao_registro:
+                return
+            self._versao_registro = versao
+            try:
+                chave = self.obter_chave()
+            except OSError:
+                chave = None
+            # Com a chave atual, a observação dos arquivos não publica a mesma gravação de novo
+            versao_local, inscritos = self._incrementar(chave)
+        self._avisar_inscritos(versao_local, inscritos)
+        if replica != REPLICA:
+            metrics.incr('replicas_versoes_recebidas')
+            metrics.record_observation('replica_atraso', max(0.0, (time.time() - gravado_em) * 1000))
+
+    def _avisar_sessoes(self) -> bool:
+        """Pede rerun às sessões que exibem uma versão velha"""
+        with self._lock:
+            velhas = {sid: pagina for sid, (versao, pagina) in self._sessoes.items()
+                      if versao < self.versao}
+            for sid in velhas:
+                # A sessão volta a se registrar no próprio rerun
+                del self._sessoes[sid]
+        if not velhas:
+            return False
+        pedir_reruns(velhas)
+        return True
+
+    def _loop(self):
+        proximo_aviso = 0.0
+        while True:
+            self._acordar.wait(INTERVALO_OBSERVACAO)
+            self._acordar.clear()
+            if self.registro is not None:
+                self._conferir_registro()
+            self._conferir_arquivos()
+            # Rajada de escritas: no máximo um rerun por sessão a cada intervalo,
+            # sem atrasar a observação (que limita o atraso entre réplicas)
+            if time.monotonic() >= proximo_aviso and self._avisar_sessoes():
+                proximo_aviso = time.monotonic() + INTERVALO_RERUN